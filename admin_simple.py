@@ -6,9 +6,32 @@
 
 import os
 from datetime import datetime
-from models import get_database_url, SessionLocal
+from models import get_database_url, get_engine, SessionLocal
 from database_service import DatabaseService
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+
+# Запросы статистики (индексы - см. migrations/versions/0001_hot_query_indexes.py)
+PACKAGE_STATS_SQL = """
+    SELECT package_interest, COUNT(*) as count 
+    FROM applications 
+    WHERE package_interest IS NOT NULL 
+    GROUP BY package_interest
+"""
+
+DAILY_COUNTS_SQL = """
+    SELECT DATE(created_at) as date, COUNT(*) as count 
+    FROM applications 
+    GROUP BY DATE(created_at) 
+    ORDER BY date DESC 
+    LIMIT 7
+"""
+
+RECENT_ACTIVITY_SQL = """
+    SELECT telegram_id, action, data, created_at 
+    FROM bot_metrics 
+    ORDER BY created_at DESC 
+    LIMIT 10
+"""
 
 def print_separator():
     print("=" * 60)
@@ -78,12 +101,7 @@ def show_statistics():
         print(f"📋 Всего заявок: {total_apps}")
         
         # Статистика по пакетам
-        result = db.execute(text("""
-            SELECT package_interest, COUNT(*) as count 
-            FROM applications 
-            WHERE package_interest IS NOT NULL 
-            GROUP BY package_interest
-        """)).fetchall()
+        result = db.execute(text(PACKAGE_STATS_SQL)).fetchall()
         
         print("\n📦 По пакетам:")
         package_names = {
@@ -97,19 +115,18 @@ def show_statistics():
             print(f"   • {package_name}: {row[1]}")
         
         # Статистика по дням
-        result = db.execute(text("""
-            SELECT DATE(created_at) as date, COUNT(*) as count 
-            FROM applications 
-            GROUP BY DATE(created_at) 
-            ORDER BY date DESC 
-            LIMIT 7
-        """)).fetchall()
+        result = db.execute(text(DAILY_COUNTS_SQL)).fetchall()
         
         print("\n📅 За последние дни:")
         for row in result:
             date_str = row[0].strftime("%d.%m.%Y") if hasattr(row[0], 'strftime') else str(row[0])
             print(f"   • {date_str}: {row[1]}")
         
+        # Действия пользователей (дневные агрегаты + свежие события)
+        print("\n📈 Действия за 30 дней:")
+        for action, count in sorted(DatabaseService.get_action_counts(days=30).items(), key=lambda item: -item[1]):
+            print(f"   • {action}: {count}")
+        
         db.close()
         
     except Exception as e:
@@ -123,8 +140,7 @@ def test_connection():
         database_url = get_database_url()
         print(f"🔗 URL БД: {database_url[:50]}...")
         
-        engine = create_engine(database_url)
-        with engine.connect() as conn:
+        with get_engine().connect() as conn:
             result = conn.execute(text("SELECT 1")).fetchone()
             print("✅ Подключение к базе данных успешно!")
             
@@ -148,12 +164,7 @@ def show_recent_activity():
     try:
         db = SessionLocal()
         
-        result = db.execute(text("""
-            SELECT telegram_id, action, data, created_at 
-            FROM bot_metrics 
-            ORDER BY created_at DESC 
-            LIMIT 10
-        """)).fetchall()
+        result = db.execute(text(RECENT_ACTIVITY_SQL)).fetchall()
         
         if not result:
             print("📭 Активности пока нет")
@@ -211,6 +222,8 @@ def main_menu():
         print("\n" * 2)
 
 if __name__ == "__main__":
+    os.environ.setdefault('DB_POOL_PROFILE', 'cli')
+    
     # Проверяем наличие переменных окружения
     if not os.getenv('DATABASE_URL') and not os.path.exists('bot.db'):
         print("❌ Не найдена база данных!")
@@ -0,0 +1,93 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import Blueprint, request, jsonify
+
+from database_service import DatabaseService
+from export_service import parse_date, parse_date_to
+
+applications_api = Blueprint('applications_api', __name__)
+
+API_FIELDS = ('id', 'name', 'phone', 'package_interest', 'user_id', 'status', 'created_at', 'updated_at')
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 200
+
+def encode_cursor(app) -> str:
+    """Курсор следующей страницы: (created_at, id) последней заявки"""
+    raw = json.dumps([app.created_at.isoformat(), app.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        created_at, app_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(app_id)
+    except Exception:
+        raise ValueError("Некорректный cursor")
+
+def serialize_application(app, fields) -> dict:
+    result = {}
+    for field in fields:
+        value = getattr(app, field)
+        result[field] = value.isoformat() if isinstance(value, datetime) else value
+    return result
+
+@applications_api.route('/api/applications')
+def api_applications():
+    """API заявок с keyset-пагинацией, фильтрами и ETag.
+
+    Параметры: limit (до 200), cursor (из next_cursor), order=desc|asc,
+    status, package, date_from, date_to (YYYY-MM-DD - день включительно,
+    время ISO - граница не включается), fields (через запятую),
+    include_total=1 (общее число заявок без фильтров). Если данные не
+    изменились, на If-None-Match отдается 304.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            raise ValueError("order должен быть asc или desc")
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+
+        fields = API_FIELDS
+        if request.args.get('fields'):
+            fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+            unknown = set(fields) - set(API_FIELDS)
+            if unknown:
+                raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+
+        filters = {
+            'status': request.args.get('status') or None,
+            'package': request.args.get('package') or None,
+            'date_from': parse_date(request.args.get('date_from')),
+            'date_to': parse_date_to(request.args.get('date_to'))
+        }
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # Берем на одну заявку больше, чтобы узнать, есть ли следующая страница
+        applications = DatabaseService.get_applications_page(
+            limit=limit + 1, after=after, ascending=(order == 'asc'), **filters
+        )
+        has_more = len(applications) > limit
+        applications = applications[:limit]
+
+        payload = {
+            'applications': [serialize_application(app, fields) for app in applications],
+            'next_cursor': encode_cursor(applications[-1]) if has_more else None,
+            'has_more': has_more
+        }
+        if request.args.get('include_total') in ('1', 'true'):
+            payload['total'] = DatabaseService.get_applications_count()
+
+        response = jsonify(payload)
+        # ETag по содержимому страницы: при неизменных данных клиент получит 304
+        response.add_etag()
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,507 @@
+from contextlib import asynccontextmanager
+from sqlalchemy import select, func, insert, delete, update
+from models import User, Application, DialogState, BotMetrics, NotificationOutbox, Broadcast, AsyncSessionLocal
+from database_service import (
+    build_summary_query, build_recent_applications_query, summarize_stats, summary_since,
+    build_user_upsert, build_application_upsert, build_dialog_states_upsert, build_active_recipients_query
+)
+from funnel import build_funnel_query, summarize_funnel
+from datetime import datetime, timedelta
+import json
+import logging
+
+@asynccontextmanager
+async def unit_of_work(db=None):
+    """Сессия для операции сервиса.
+
+    Если передана сессия апдейта (см. db_middleware.py), изменения только
+    отправляются в БД (flush), а коммит - один на весь апдейт. Без нее
+    открывается своя сессия с коммитом в конце операции.
+    """
+    if db is not None:
+        yield db
+        await db.flush()
+        return
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+def after_commit(db, callback):
+    """Вызывает callback после коммита сессии апдейта (сразу, если сессии нет)"""
+    if db is None:
+        callback()
+    else:
+        db.info.setdefault('after_commit', []).append(callback)
+
+async def commit_unit(db):
+    """Коммитит сессию апдейта и выполняет отложенные до коммита действия"""
+    await db.commit()
+    for callback in db.info.pop('after_commit', []):
+        callback()
+
+async def rollback_unit(db):
+    """Откатывает сессию апдейта вместе с отложенными действиями"""
+    db.info.pop('after_commit', None)
+    await db.rollback()
+
+class AsyncDatabaseService:
+    """Асинхронный сервис для работы с базой данных (для хендлеров бота)"""
+
+    @staticmethod
+    async def _upsert_returning(session, stmt, model, where):
+        """Выполняет upsert и возвращает строку как ORM-объект.
+
+        SQLite до 3.35 не умеет RETURNING - тогда строка дочитывается SELECT.
+        """
+        if session.bind.dialect.insert_returning:
+            result = await session.scalars(stmt.returning(model), execution_options={'populate_existing': True})
+            return result.one()
+        await session.execute(stmt)
+        result = await session.scalars(select(model).where(where).execution_options(populate_existing=True))
+        return result.one()
+
+    @staticmethod
+    async def get_or_create_user(telegram_id: int, username: str = None,
+                                 first_name: str = None, last_name: str = None, db=None) -> User:
+        """Получает или создает пользователя (один upsert, без гонки при двойном нажатии)"""
+        try:
+            async with unit_of_work(db) as session:
+                stmt = build_user_upsert(session.bind.dialect.name, telegram_id, username, first_name, last_name)
+                return await AsyncDatabaseService._upsert_returning(
+                    session, stmt, User, User.telegram_id == telegram_id
+                )
+        except Exception as e:
+            logging.error(f"Ошибка при работе с пользователем {telegram_id}: {e}")
+            raise e
+
+    @staticmethod
+    async def has_user_submitted_application(telegram_id: int, db=None) -> bool:
+        """Проверяет, подавал ли пользователь уже заявку"""
+        try:
+            async with unit_of_work(db) as session:
+                result = await session.execute(
+                    select(Application.id).where(Application.user_id == telegram_id).limit(1)
+                )
+                return result.first() is not None
+        except Exception as e:
+            logging.error(f"Ошибка при проверке заявки пользователя {telegram_id}: {e}")
+            if db is not None:
+                # Ошибка в общей транзакции апдейта - откатывать ее будет вызывающий
+                raise
+            return False
+
+    @staticmethod
+    async def create_application(telegram_id: int, name: str, phone: str,
+                                 package_interest: str = None, db=None) -> Application:
+        """Создает заявку или обновляет существующую заявку пользователя (один upsert)"""
+        try:
+            async with unit_of_work(db) as session:
+                stmt = build_application_upsert(session.bind.dialect.name, telegram_id, name, phone,
+                                                 package_interest)
+                application = await AsyncDatabaseService._upsert_returning(
+                    session, stmt, Application, Application.user_id == telegram_id
+                )
+            if application.created_at == application.updated_at:
+                logging.info(f"Создана новая заявка: {telegram_id} - {name}")
+            else:
+                logging.info(f"Обновлена заявка пользователя: {telegram_id}")
+            return application
+        except Exception as e:
+            logging.error(f"Ошибка при создании заявки {telegram_id}: {e}")
+            raise e
+
+    @staticmethod
+    async def update_user_contact_data(telegram_id: int, name: str, phone: str, db=None):
+        """Обновляет контактные данные пользователя"""
+        try:
+            async with unit_of_work(db) as session:
+                # UPDATE без предварительного SELECT: пользователь уже зарегистрирован
+                result = await session.execute(
+                    update(User)
+                    .where(User.telegram_id == telegram_id)
+                    .values(name=name, phone=phone, updated_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount:
+                    logging.info(f"Обновлены контактные данные пользователя: {telegram_id}")
+        except Exception as e:
+            logging.error(f"Ошибка при обновлении контактов {telegram_id}: {e}")
+            if db is not None:
+                raise
+
+    @staticmethod
+    async def save_dialog_state(telegram_id: int, state: str, data: dict = None, db=None):
+        """Сохраняет состояние диалога (upsert)"""
+        try:
+            async with unit_of_work(db) as session:
+                await session.execute(
+                    build_dialog_states_upsert(session.bind.dialect.name, {telegram_id: (state, data)})
+                )
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении состояния {telegram_id}: {e}")
+            if db is not None:
+                raise
+
+    @staticmethod
+    async def get_dialog_state(telegram_id: int, db=None) -> tuple:
+        """Получает состояние диалога"""
+        try:
+            async with unit_of_work(db) as session:
+                result = await session.execute(
+                    select(DialogState).where(DialogState.telegram_id == telegram_id)
+                )
+                dialog_state = result.scalars().first()
+
+                if dialog_state:
+                    data = json.loads(dialog_state.data) if dialog_state.data else {}
+                    return dialog_state.current_state, data
+                return None, {}
+        except Exception as e:
+            logging.error(f"Ошибка при получении состояния {telegram_id}: {e}")
+            if db is not None:
+                raise
+            return None, {}
+
+    @staticmethod
+    async def clear_dialog_state(telegram_id: int, db=None):
+        """Очищает состояние диалога"""
+        try:
+            async with unit_of_work(db) as session:
+                await session.execute(
+                    delete(DialogState).where(DialogState.telegram_id == telegram_id)
+                    .execution_options(synchronize_session=False)
+                )
+        except Exception as e:
+            logging.error(f"Ошибка при очистке состояния {telegram_id}: {e}")
+            if db is not None:
+                raise
+
+    @staticmethod
+    async def load_dialog_state(telegram_id: int):
+        """Загружает состояние диалога вместе с временем обновления (для FSM-хранилища)"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(DialogState.current_state, DialogState.data, DialogState.updated_at)
+                .where(DialogState.telegram_id == telegram_id)
+            )
+            row = result.first()
+            if row is None:
+                return None
+            data = json.loads(row.data) if row.data else {}
+            return row.current_state, data, row.updated_at
+
+    @staticmethod
+    async def save_dialog_states(states: dict):
+        """Сохраняет пачку состояний {telegram_id: (state, data)} в одной транзакции.
+
+        Пустое состояние без данных удаляет запись. Остальные пишутся одним
+        многострочным upsert - без предварительного SELECT.
+        """
+        if not states:
+            return
+        cleared = [telegram_id for telegram_id, (state, data) in states.items() if state is None and not data]
+        saved = {telegram_id: value for telegram_id, value in states.items() if telegram_id not in cleared}
+        async with unit_of_work() as session:
+            if cleared:
+                await session.execute(
+                    delete(DialogState).where(DialogState.telegram_id.in_(cleared))
+                    .execution_options(synchronize_session=False)
+                )
+            if saved:
+                await session.execute(build_dialog_states_upsert(session.bind.dialect.name, saved))
+
+    @staticmethod
+    async def delete_expired_dialog_states(before: datetime) -> int:
+        """Удаляет состояния диалогов, не обновлявшиеся с момента before"""
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(
+                    delete(DialogState).where(DialogState.updated_at < before)
+                )
+                await db.commit()
+                return result.rowcount or 0
+            except Exception as e:
+                await db.rollback()
+                logging.error(f"Ошибка при удалении устаревших состояний: {e}")
+                return 0
+
+    @staticmethod
+    async def log_user_action(telegram_id: int, action: str, data: dict = None, db=None):
+        """Логирует действие пользователя"""
+        try:
+            async with unit_of_work(db) as session:
+                session.add(BotMetrics(
+                    telegram_id=telegram_id,
+                    action=action,
+                    data=json.dumps(data) if data else None
+                ))
+        except Exception as e:
+            logging.error(f"Ошибка при логировании действия {telegram_id}: {e}")
+            if db is not None:
+                raise
+
+    @staticmethod
+    async def log_user_actions(events: list):
+        """Записывает пачку действий одним multi-row INSERT"""
+        if not events:
+            return
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(BotMetrics).values(events))
+            await db.commit()
+
+    @staticmethod
+    async def get_applications_count() -> int:
+        """Получает общее количество заявок"""
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(select(func.count(Application.id)))
+                return result.scalar() or 0
+            except Exception as e:
+                logging.error(f"Ошибка при подсчете заявок: {e}")
+                return 0
+
+    @staticmethod
+    async def get_recent_applications(limit: int = 10) -> list:
+        """Получает последние заявки"""
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(build_recent_applications_query(limit))
+                return list(result.scalars().all())
+            except Exception as e:
+                logging.error(f"Ошибка при получении заявок: {e}")
+                return []
+
+    @staticmethod
+    async def get_summary_stats(days: int = 7) -> dict:
+        """Получает агрегированную статистику по заявкам одним запросом"""
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(build_summary_query(summary_since(days)))
+                return summarize_stats(result.fetchall())
+            except Exception as e:
+                logging.error(f"Ошибка при получении статистики: {e}")
+                return summarize_stats([])
+
+    @staticmethod
+    async def get_funnel(days: int = 30) -> dict:
+        """Воронка за days дней из дневных сверток funnel_daily"""
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(build_funnel_query(summary_since(days)))
+                return summarize_funnel(result.fetchall())
+            except Exception as e:
+                logging.error(f"Ошибка при получении воронки: {e}")
+                return summarize_funnel([])
+
+    @staticmethod
+    async def get_applications_since(since: datetime, limit: int = 50) -> list:
+        """Получает заявки, созданные после since (новые первыми)"""
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(
+                    select(Application)
+                    .where(Application.created_at >= since)
+                    .order_by(Application.created_at.desc())
+                    .limit(limit)
+                )
+                return list(result.scalars().all())
+            except Exception as e:
+                logging.error(f"Ошибка при получении заявок: {e}")
+                return []
+
+    @staticmethod
+    async def enqueue_notifications(entries: list, db=None) -> int:
+        """Добавляет уведомления в outbox, пропуская уже существующие ключи идемпотентности.
+
+        entries: список словарей с idempotency_key, application_id, channel, payload.
+        С сессией апдейта записи попадают в ту же транзакцию, что и заявка.
+        """
+        if not entries:
+            return 0
+        async with unit_of_work(db) as session:
+            keys = [entry['idempotency_key'] for entry in entries]
+            result = await session.execute(
+                select(NotificationOutbox.idempotency_key)
+                .where(NotificationOutbox.idempotency_key.in_(keys))
+            )
+            existing = set(result.scalars())
+            new_entries = [entry for entry in entries if entry['idempotency_key'] not in existing]
+            for entry in new_entries:
+                session.add(NotificationOutbox(**entry))
+        return len(new_entries)
+
+    @staticmethod
+    async def claim_notifications(limit: int, lease_seconds: int = 300) -> list:
+        """Забирает готовые к отправке уведомления и помечает их как обрабатываемые.
+
+        Записи в статусе processing с истекшей арендой (воркер упал) забираются повторно.
+        На Postgres используется FOR UPDATE SKIP LOCKED, поэтому воркеров может быть несколько.
+        """
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(
+                    select(NotificationOutbox)
+                    .where(NotificationOutbox.status.in_(['pending', 'processing']))
+                    .where(NotificationOutbox.next_attempt_at <= now)
+                    .order_by(NotificationOutbox.next_attempt_at)
+                    .limit(limit)
+                    .with_for_update(skip_locked=True)
+                )
+                rows = list(result.scalars())
+                for row in rows:
+                    row.status = 'processing'
+                    row.next_attempt_at = now + timedelta(seconds=lease_seconds)
+                await db.commit()
+                return rows
+            except Exception:
+                await db.rollback()
+                raise
+
+    @staticmethod
+    async def complete_notification(outbox_id: int):
+        """Помечает уведомление как отправленное"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id == outbox_id)
+                .values(status='sent', last_error=None, updated_at=datetime.utcnow())
+            )
+            await db.commit()
+
+    @staticmethod
+    async def reschedule_notification(outbox_id: int, attempts: int, next_attempt_at: datetime,
+                                      error: str, failed: bool = False):
+        """Откладывает уведомление до следующей попытки (или помечает как failed)"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id == outbox_id)
+                .values(
+                    status='failed' if failed else 'pending',
+                    attempts=attempts,
+                    next_attempt_at=next_attempt_at,
+                    last_error=error,
+                    updated_at=datetime.utcnow()
+                )
+            )
+            await db.commit()
+
+    @staticmethod
+    async def purge_sent_notifications(before: datetime) -> int:
+        """Удаляет отправленные уведомления старше before"""
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(
+                    delete(NotificationOutbox)
+                    .where(NotificationOutbox.status == 'sent')
+                    .where(NotificationOutbox.updated_at < before)
+                )
+                await db.commit()
+                return result.rowcount or 0
+            except Exception as e:
+                await db.rollback()
+                logging.error(f"Ошибка при очистке outbox: {e}")
+                return 0
+
+    @staticmethod
+    async def create_broadcast(text: str, admin_chat_id: int) -> Broadcast:
+        """Создает рассылку по всем активным пользователям"""
+        async with unit_of_work() as session:
+            total = await session.scalar(select(func.count(User.id)).where(User.is_active == True))
+            broadcast = Broadcast(text=text, admin_chat_id=admin_chat_id, total=total or 0)
+            session.add(broadcast)
+        return broadcast
+
+    @staticmethod
+    async def claim_broadcast(lease_seconds: int = 300):
+        """Забирает самую старую незавершенную рассылку и берет ее в аренду.
+
+        Подходят pending и running с истекшей арендой (воркер упал). На Postgres
+        используется FOR UPDATE SKIP LOCKED, поэтому рассылку ведет один воркер.
+        Возвращает (рассылка, была ли она pending) или None.
+        """
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(
+                    select(Broadcast)
+                    .where(
+                        (Broadcast.status == 'pending')
+                        | ((Broadcast.status == 'running')
+                           & ((Broadcast.lease_until == None) | (Broadcast.lease_until < now)))
+                    )
+                    .order_by(Broadcast.id)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                )
+                broadcast = result.scalars().first()
+                if broadcast is None:
+                    return None
+                was_pending = broadcast.status == 'pending'
+                broadcast.status = 'running'
+                broadcast.lease_until = now + timedelta(seconds=lease_seconds)
+                if was_pending:
+                    broadcast.started_at = now
+                await db.commit()
+                return broadcast, was_pending
+            except Exception:
+                await db.rollback()
+                raise
+
+    @staticmethod
+    async def get_broadcast_recipients(after_user_id: int, limit: int) -> list:
+        """Следующая пачка активных получателей (users.id, telegram_id) по ключу users.id"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(build_active_recipients_query(after_user_id, limit))
+            return result.all()
+
+    @staticmethod
+    async def set_users_active(telegram_ids: list, is_active: bool) -> int:
+        """Отключает или включает пользователей одним UPDATE, возвращает число измененных"""
+        if not telegram_ids:
+            return 0
+        async with unit_of_work() as session:
+            result = await session.execute(
+                update(User)
+                .where(User.telegram_id.in_(telegram_ids), User.is_active == (not is_active))
+                .values(is_active=is_active, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount or 0
+
+    @staticmethod
+    async def update_broadcast(broadcast_id: int, lease_seconds: int = None, **values) -> str:
+        """Сохраняет прогресс рассылки и возвращает ее текущий статус.
+
+        Статус cancelled, выставленный админом, не перезаписывается. С
+        lease_seconds аренда воркера продлевается на этот срок.
+        """
+        async with unit_of_work() as session:
+            values['updated_at'] = datetime.utcnow()
+            if lease_seconds:
+                values['lease_until'] = values['updated_at'] + timedelta(seconds=lease_seconds)
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .where(Broadcast.status != 'cancelled')
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            return await session.scalar(select(Broadcast.status).where(Broadcast.id == broadcast_id))
+
+    @staticmethod
+    async def cancel_broadcasts() -> int:
+        """Отменяет все незавершенные рассылки"""
+        async with unit_of_work() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.status.in_(['pending', 'running']))
+                .values(status='cancelled', finished_at=datetime.utcnow(), updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount or 0
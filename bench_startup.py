@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Замер холодного старта точек входа: время импорта модуля и первого запроса.
+
+Каждая точка входа запускается в отдельном процессе (как dyno после
+перезапуска) на временной SQLite с уже созданными таблицами. Замеряются:
+
+- import - импорт модуля точки входа (внутри процесса);
+- first_request - первый запрос, который ходит в БД: GET через тестовый
+  клиент Flask для админок, show_statistics() для консольной админки и
+  обработка /start диспетчером aiogram (без обращения к Telegram) для бота;
+- process - полное время жизни процесса, включая запуск интерпретатора.
+
+Берется медиана по нескольким запускам. Скрипт завершается с кодом 1, если
+медиана превышает бюджет из BUDGETS_MS или (при --baseline) ухудшилась
+больше чем на --max-regression процентов относительно сохраненного замера.
+
+    python bench_startup.py                                # бюджеты
+    python bench_startup.py --save-baseline startup.json   # сохранить замер
+    python bench_startup.py --baseline startup.json --max-regression 25
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCH_PASSWORD = 'bench'
+
+# Точка входа -> (модуль, профиль пула как в Procfile, первый запрос)
+ENTRY_POINTS = {
+    'simple_admin': ('simple_admin', 'web', '/'),
+    'enhanced_admin': ('enhanced_admin', 'web', f'/?password={BENCH_PASSWORD}'),
+    'web_admin': ('web_admin', 'web', f'/?password={BENCH_PASSWORD}'),
+    'admin_simple': ('admin_simple', 'cli', None),
+    'main': ('main', 'worker', None),
+}
+
+# Бюджеты медиан, мс. Импорт бота почти целиком - импорт aiogram (pydantic-модели
+# всех типов Telegram API), его отложить нельзя
+BUDGETS_MS = {
+    'simple_admin': {'import': 1500, 'first_request': 500},
+    'enhanced_admin': {'import': 1500, 'first_request': 500},
+    'web_admin': {'import': 1500, 'first_request': 500},
+    'admin_simple': {'import': 1000, 'first_request': 500},
+    'main': {'import': 6000, 'first_request': 1000},
+}
+
+# Абсолютный допуск, мс: на быстрых замерах проценты слишком чувствительны к шуму
+REGRESSION_SLACK_MS = 50
+
+def _first_request_flask(module, path: str):
+    client = module.app.test_client()
+    response = client.get(path)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {path} вернул {response.status_code}")
+
+def _first_request_cli(module):
+    with redirect_stdout(io.StringIO()):
+        module.show_statistics()
+
+def _first_request_bot(module):
+    from bench_updates import OfflineSession, build_update
+
+    update = build_update(1, 1, 'text', '/start')
+
+    async def run():
+        module.bot.session = OfflineSession()
+        await module.dp.feed_update(module.bot, update)
+        await module.metrics_buffer.close()
+        await module.dispose_engines()
+
+    asyncio.run(run())
+
+def run_child(name: str):
+    """Один замер внутри дочернего процесса; результат - JSON в stdout"""
+    module_name, _, path = ENTRY_POINTS[name]
+    sys.path.insert(0, REPO_DIR)
+
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        module = __import__(module_name)
+    imported = time.perf_counter()
+
+    if name == 'main':
+        with redirect_stdout(io.StringIO()):
+            _first_request_bot(module)
+    elif path is None:
+        _first_request_cli(module)
+    else:
+        _first_request_flask(module, path)
+    finished = time.perf_counter()
+
+    print(json.dumps({
+        'import': (imported - started) * 1000,
+        'first_request': (finished - imported) * 1000,
+    }))
+
+def _child_env(database_url: str, profile: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': database_url,
+        'DB_POOL_PROFILE': profile,
+        'BOT_TOKEN': env.get('BENCH_BOT_TOKEN', '123456:BENCH-startup-token'),
+        'ADMIN_PASSWORD': BENCH_PASSWORD,
+        'ADMIN_CHAT_ID': '',
+    })
+    return env
+
+def prepare_database(database_url: str):
+    """Создает схему в отдельном процессе, чтобы замеры начинались с готовой БД"""
+    subprocess.run(
+        [sys.executable, '-c', 'from models import create_tables; create_tables()'],
+        cwd=REPO_DIR, env=_child_env(database_url, 'cli'),
+        check=True, stdout=subprocess.DEVNULL
+    )
+
+def measure(name: str, database_url: str, runs: int) -> dict:
+    """Медианы import, first_request и process по нескольким запускам"""
+    samples = {'import': [], 'first_request': [], 'process': []}
+    env = _child_env(database_url, ENTRY_POINTS[name][1])
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', name],
+            cwd=REPO_DIR, env=env, capture_output=True, text=True
+        )
+        elapsed = (time.perf_counter() - started) * 1000
+        if result.returncode != 0:
+            raise RuntimeError(f"{name}: процесс завершился с кодом {result.returncode}\n{result.stderr}")
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        samples['import'].append(timings['import'])
+        samples['first_request'].append(timings['first_request'])
+        samples['process'].append(elapsed)
+    return {key: round(statistics.median(values), 1) for key, values in samples.items()}
+
+def check(results: dict, baseline: dict = None, max_regression: float = 25.0) -> list:
+    """Возвращает список нарушений бюджета и регрессий относительно baseline"""
+    problems = []
+    for name, timings in results.items():
+        for metric, budget in BUDGETS_MS.get(name, {}).items():
+            if timings[metric] > budget:
+                problems.append(f"{name}.{metric}: {timings[metric]} мс > бюджета {budget} мс")
+        if not baseline or name not in baseline:
+            continue
+        for metric, value in timings.items():
+            previous = baseline[name].get(metric)
+            if not previous:
+                continue
+            limit = previous * (1 + max_regression / 100) + REGRESSION_SLACK_MS
+            if value > limit:
+                growth = (value - previous) * 100 / previous
+                problems.append(f"{name}.{metric}: {value} мс против {previous} мс (+{growth:.0f}%)")
+    return problems
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер холодного старта точек входа")
+    parser.add_argument('--child', choices=sorted(ENTRY_POINTS), help=argparse.SUPPRESS)
+    parser.add_argument('--runs', type=int, default=int(os.getenv('BENCH_RUNS', '5')))
+    parser.add_argument('--only', action='append', choices=sorted(ENTRY_POINTS),
+                        help="замерить только указанные точки входа")
+    parser.add_argument('--baseline', help="JSON с предыдущим замером для сравнения")
+    parser.add_argument('--save-baseline', help="сохранить результаты в JSON")
+    parser.add_argument('--max-regression', type=float, default=25.0,
+                        help="допустимое ухудшение относительно baseline, %%")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return 0
+
+    database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_startup.db')
+    prepare_database(database_url)
+
+    results = {}
+    print(f"{'точка входа':<16}{'import':>10}{'1-й запрос':>12}{'процесс':>10}  (мс, медиана из {args.runs})")
+    for name in args.only or ENTRY_POINTS:
+        results[name] = measure(name, database_url, args.runs)
+        timings = results[name]
+        print(f"{name:<16}{timings['import']:>10}{timings['first_request']:>12}{timings['process']:>10}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"💾 Замер сохранен в {args.save_baseline}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    problems = check(results, baseline, args.max_regression)
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        return 1
+    print("✅ Время старта в пределах бюджета")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон диспетчера бота синтетическими апдейтами Telegram.
+
+Строит реалистичные Update (запуск, просмотр пакетов, полная форма заявки)
+для множества пользователей и прогоняет их через dp.feed_update из main.py.
+Bot API подменен сессией без сети (OfflineSession) с настраиваемой задержкой
+ответа. Апдейты одного пользователя идут по порядку, пользователи - параллельно
+(не больше --concurrency одновременно, как UPDATE_CONCURRENCY в webhook-режиме).
+
+Отчет: пропускная способность, p50/p95/p99 времени обработки апдейта,
+число SQL-запросов и вызовов Bot API на апдейт - всего и по типам апдейтов.
+Запросы фоновых задач (буфер метрик, FSM-хранилище) считаются отдельно.
+
+    python bench_updates.py                                  # временная SQLite
+    python bench_updates.py --users 500 --concurrency 50 --scenario contact
+    python bench_updates.py --database-url postgresql://localhost/bot_bench
+
+Для PostgreSQL используйте отдельную базу - прогон пишет в нее пользователей,
+заявки и метрики (telegram_id из диапазона --first-user-id).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update, Message, Chat, User, CallbackQuery
+
+# Сценарии: последовательность апдейтов одного пользователя.
+# ('text', ...) - сообщение, ('callback', ...) - нажатие inline-кнопки
+SCENARIOS = {
+    'start': [
+        ('text', '/start'),
+    ],
+    'browse': [
+        ('text', '/start'),
+        ('callback', 'packages'),
+        ('callback', 'package_start'),
+        ('callback', 'package_business'),
+        ('callback', 'stages'),
+        ('callback', 'about'),
+        ('callback', 'back_to_main'),
+    ],
+    'contact': [
+        ('text', '/start'),
+        ('callback', 'packages'),
+        ('callback', 'package_business'),
+        ('callback', 'contact_package_business'),
+        ('callback', 'start_contact'),
+        ('text', '{name}'),
+        ('text', '+7 (999) {phone}'),
+    ],
+}
+
+# Доли сценариев в смешанной нагрузке
+SCENARIO_MIX = {'start': 0.3, 'browse': 0.5, 'contact': 0.2}
+
+# Апдейт, который сейчас обрабатывается в этой задаче: SQL-запросы вне
+# апдейта (фоновые сбросы буферов) учитываются отдельно
+current_label = contextvars.ContextVar('current_label', default=None)
+
+class OfflineSession(BaseSession):
+    """Сессия Bot API без сети: отвечает заглушками через latency секунд"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = defaultdict(int)  # метка апдейта -> число вызовов
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[current_label.get() or 'background'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if type(method).__name__ in ('SendMessage', 'EditMessageText'):
+            return Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type='private'), text='ok')
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def close(self):
+        pass
+
+def build_update(update_id: int, telegram_id: int, kind: str, payload: str) -> Update:
+    """Update от пользователя telegram_id в его личном чате"""
+    user = User(id=telegram_id, is_bot=False, first_name=f'Bench{telegram_id % 1000}',
+                username=f'bench_{telegram_id}')
+    chat = Chat(id=telegram_id, type='private')
+    if kind == 'text':
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text=payload
+        ))
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance=str(telegram_id), data=payload,
+        message=Message(message_id=update_id, date=datetime.now(), chat=chat, text='menu')
+    ))
+
+def build_workload(users: int, scenario: str, first_user_id: int) -> list:
+    """Список (telegram_id, [(метка, Update), ...]) для всех пользователей"""
+    rng = random.Random(42)
+    names, weights = zip(*SCENARIO_MIX.items())
+    update_id = 0
+    workload = []
+    for n in range(users):
+        telegram_id = first_user_id + n
+        name = scenario if scenario != 'mix' else rng.choices(names, weights)[0]
+        updates = []
+        for kind, payload in SCENARIOS[name]:
+            update_id += 1
+            text = payload.format(name=f'Клиент {n}', phone=f'{n:07d}')
+            updates.append((f'{kind}:{payload}', build_update(update_id, telegram_id, kind, text)))
+        workload.append((telegram_id, updates))
+    return workload
+
+def percentile(values: list, p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+async def run_benchmark(args) -> dict:
+    # main читает конфигурацию при импорте, поэтому окружение задается до него
+    import main
+    from models import create_tables, get_async_engine
+    from sqlalchemy import event
+
+    # INFO-логи хендлеров (каждая новая заявка) искажают замер
+    logging.getLogger().setLevel(logging.WARNING)
+
+    create_tables()
+    session = OfflineSession(latency=args.api_latency_ms / 1000)
+    main.bot.session = session
+
+    statements = defaultdict(int)
+
+    def count_statement(*_):
+        statements[current_label.get() or 'background'] += 1
+
+    event.listen(get_async_engine().sync_engine, 'before_cursor_execute', count_statement)
+
+    main.metrics_buffer.start()
+    main.storage.start()
+
+    workload = build_workload(args.users, args.scenario, args.first_user_id)
+    latencies = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def feed(label: str, update: Update):
+        token = current_label.set(label)
+        started = time.perf_counter()
+        try:
+            await main.dp.feed_update(main.bot, update)
+        finally:
+            latencies[label].append((time.perf_counter() - started) * 1000)
+            current_label.reset(token)
+
+    async def run_user(updates: list):
+        async with semaphore:
+            for label, update in updates:
+                await feed(label, update)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(updates) for _, updates in workload))
+    elapsed = time.perf_counter() - started
+
+    # Фоновые сбросы тоже часть нагрузки на БД
+    await main.metrics_buffer.close()
+    await main.storage.close()
+    await main.dispose_engines()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    total_updates = len(all_latencies)
+    per_update_statements = sum(count for label, count in statements.items() if label != 'background')
+    return {
+        'database': args.database_url.split('://', 1)[0],
+        'users': args.users,
+        'scenario': args.scenario,
+        'concurrency': args.concurrency,
+        'api_latency_ms': args.api_latency_ms,
+        'updates': total_updates,
+        'elapsed_s': round(elapsed, 3),
+        'throughput': round(total_updates / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(all_latencies, 50), 2),
+        'p95_ms': round(percentile(all_latencies, 95), 2),
+        'p99_ms': round(percentile(all_latencies, 99), 2),
+        'max_ms': round(max(all_latencies), 2),
+        'queries_per_update': round(per_update_statements / total_updates, 2),
+        'background_queries': statements['background'],
+        'api_calls_per_update': round(sum(session.calls.values()) / total_updates, 2),
+        'by_update': {
+            label: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50), 2),
+                'p95_ms': round(percentile(values, 95), 2),
+                'queries': round(statements[label] / len(values), 2),
+                'api_calls': round(session.calls[label] / len(values), 2),
+            }
+            for label, values in sorted(latencies.items())
+        },
+    }
+
+def print_report(report: dict):
+    print()
+    print(f"📊 {report['updates']} апдейтов от {report['users']} пользователей "
+          f"(сценарий {report['scenario']}, параллельно {report['concurrency']}, "
+          f"БД {report['database']}, задержка Bot API {report['api_latency_ms']} мс)")
+    print(f"   • Пропускная способность: {report['throughput']} апд/с за {report['elapsed_s']} с")
+    print(f"   • Задержка: p50 {report['p50_ms']} мс, p95 {report['p95_ms']} мс, "
+          f"p99 {report['p99_ms']} мс, max {report['max_ms']} мс")
+    print(f"   • SQL-запросов на апдейт: {report['queries_per_update']} "
+          f"(+{report['background_queries']} фоновых всего)")
+    print(f"   • Вызовов Bot API на апдейт: {report['api_calls_per_update']}")
+    print()
+    print(f"{'апдейт':<36}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'SQL':>7}{'API':>7}")
+    for label, row in report['by_update'].items():
+        print(f"{label:<36}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+              f"{row['queries']:>7}{row['api_calls']:>7}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон диспетчера бота")
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help="БД для прогона (по умолчанию - временная SQLite)")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--scenario', choices=['mix'] + sorted(SCENARIOS), default='mix')
+    parser.add_argument('--api-latency-ms', type=float, default=0.0,
+                        help="искусственная задержка ответа Bot API")
+    parser.add_argument('--first-user-id', type=int, default=1_000_000_000 + int(time.time()) % 1000 * 100_000,
+                        help="первый telegram_id синтетических пользователей")
+    parser.add_argument('--json', help="сохранить отчет в JSON")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        args.database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_updates.db')
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('BOT_TOKEN', '123456:BENCH-updates-token')
+    os.environ.setdefault('DB_POOL_PROFILE', 'worker')
+    # Синтетический пользователь шлет сценарий без пауз - флуд-контроль его не режет
+    os.environ.setdefault('FLOOD_RATE', '1000')
+    os.environ.setdefault('FLOOD_BURST', '1000')
+    # Уведомления менеджеру в прогоне не нужны: outbox остается пустым
+    os.environ['ADMIN_CHAT_ID'] = ''
+    os.environ['MANAGER_EMAIL'] = ''
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Отчет сохранен в {args.json}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+from instrumentation import (
+    CONTENT_TYPE, BOT_UPDATES, BOT_HANDLER_SECONDS, BOT_UPDATE_DB_QUERIES, BOT_UPDATE_DB_SECONDS,
+    TELEGRAM_API_SECONDS, TELEGRAM_API_ERRORS, QueryStats, current_query_stats,
+    instrument_sqlalchemy, metrics_authorized, render
+)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = os.getenv('METRICS_PORT')  # polling-режим: порт отдельного сервера /metrics
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Метрики апдейта по хендлеру: число, время, SQL-запросы (inner-мидлварь).
+
+    Регистрируется раньше DbSessionMiddleware, чтобы в замер попадал и коммит
+    транзакции апдейта.
+    """
+
+    def __init__(self):
+        instrument_sqlalchemy()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        status = 'ok'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            BOT_HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+            BOT_UPDATES.inc(handler=name, status=status)
+            BOT_UPDATE_DB_QUERIES.observe(stats.queries, handler=name)
+            BOT_UPDATE_DB_SECONDS.observe(stats.seconds, handler=name)
+            current_query_stats.reset(token)
+
+class TelegramApiMetrics(BaseRequestMiddleware):
+    """Время и ошибки вызовов Bot API по методам (мидлварь сессии бота)"""
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, '__api_method__', type(method).__name__)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, method=name)
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Метрики процесса бота для Prometheus (по METRICS_TOKEN, без него - по ADMIN_PASSWORD)"""
+    if not metrics_authorized(request.headers.get('Authorization'), request.query.get('password')):
+        raise web.HTTPUnauthorized()
+    return web.Response(body=render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+async def start_metrics_server(port: int = None, host: str = METRICS_HOST):
+    """Отдельный сервер /metrics для polling-режима; None, если порт не задан"""
+    port = port or (int(METRICS_PORT) if METRICS_PORT else None)
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from async_database_service import AsyncDatabaseService
+from instrumentation import BROADCAST_MESSAGES
+from rate_limit import SendRateLimiter
+
+class BroadcastEngine:
+    """Рассылка сообщения всем пользователям бота с соблюдением лимитов Telegram.
+
+    Получатели читаются из users пачками по ``batch_size`` по ключу users.id,
+    сообщения уходят через общий SendRateLimiter (глобальный лимит и лимит на
+    чат); RetryAfter останавливает все отправки на запрошенное время, и
+    сообщение повторяется. После каждой пачки прогресс сохраняется в
+    broadcasts (last_user_id и счетчики), поэтому после перезапуска рассылка
+    продолжается с места остановки - повторно может уйти не больше одной
+    пачки. Рассылку ведет один воркер: он берет ее в аренду на
+    ``lease_seconds`` и продлевает аренду с каждой пачкой; остальные воркеры
+    ее пропускают, пока аренда не истечет. Прогресс раз в ``progress_interval`` секунд обновляется в
+    сообщении в админском чате.
+    """
+
+    def __init__(self, bot, limiter: SendRateLimiter = None, batch_size: int = None,
+                 progress_interval: float = None, poll_interval: float = None, max_attempts: int = 5,
+                 lease_seconds: int = None):
+        self.bot = bot
+        self.limiter = limiter or SendRateLimiter()
+        self.batch_size = batch_size or int(os.getenv('BROADCAST_BATCH_SIZE', '100'))
+        self.progress_interval = progress_interval or float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '15'))
+        self.poll_interval = poll_interval or float(os.getenv('BROADCAST_POLL_INTERVAL', '30'))
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds or int(os.getenv('BROADCAST_LEASE_SECONDS', '300'))
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def start(self):
+        """Запускает фоновый обработчик рассылок"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Будит обработчик сразу после создания рассылки"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                claimed = await AsyncDatabaseService.claim_broadcast(self.lease_seconds)
+                if claimed is not None:
+                    await self._process(*claimed)
+                    continue
+            except Exception as e:
+                logging.error(f"Ошибка рассылки: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _process(self, broadcast, started: bool):
+        counters = {'sent': broadcast.sent, 'blocked': broadcast.blocked, 'failed': broadcast.failed}
+        last_user_id = broadcast.last_user_id or 0
+
+        if started:
+            broadcast.progress_message_id = await self._report(broadcast, counters, 'запущена')
+            await AsyncDatabaseService.update_broadcast(
+                broadcast.id, progress_message_id=broadcast.progress_message_id
+            )
+            logging.info(f"📣 Рассылка #{broadcast.id} запущена: {broadcast.total} получателей")
+        else:
+            logging.info(f"📣 Рассылка #{broadcast.id} продолжена после пользователя {last_user_id}")
+
+        last_report = time.monotonic()
+        while not self._stopping:
+            recipients = await AsyncDatabaseService.get_broadcast_recipients(last_user_id, self.batch_size)
+            if not recipients:
+                await AsyncDatabaseService.update_broadcast(
+                    broadcast.id, status='done', finished_at=datetime.utcnow(), **counters
+                )
+                await self._report(broadcast, counters, 'завершена')
+                logging.info(f"✅ Рассылка #{broadcast.id} завершена: {counters}")
+                return
+
+            results = await asyncio.gather(
+                *(self._deliver(telegram_id, broadcast.text) for _, telegram_id in recipients)
+            )
+            for outcome in results:
+                counters[outcome] += 1
+                BROADCAST_MESSAGES.inc(outcome=outcome)
+            last_user_id = recipients[-1][0]
+
+            status = await AsyncDatabaseService.update_broadcast(
+                broadcast.id, lease_seconds=self.lease_seconds, last_user_id=last_user_id, **counters
+            )
+            if status == 'cancelled':
+                await self._report(broadcast, counters, 'отменена')
+                logging.info(f"⛔ Рассылка #{broadcast.id} отменена: {counters}")
+                return
+
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                await self._report(broadcast, counters, 'идет')
+
+        # Остановка воркера: прогресс сохранен, отпускаем аренду, чтобы рассылку
+        # сразу продолжил другой воркер (или этот после перезапуска)
+        await AsyncDatabaseService.update_broadcast(broadcast.id, lease_until=None)
+
+    async def _deliver(self, chat_id: int, text: str) -> str:
+        """Отправляет сообщение одному получателю: sent, blocked или failed"""
+        for attempt in range(1, self.max_attempts + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text, parse_mode='HTML')
+                return 'sent'
+            except TelegramRetryAfter as e:
+                # Флуд-контроль касается всего бота: ждут все отправки
+                logging.warning(f"Рассылка: RetryAfter {e.retry_after}с")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return 'blocked'
+            except TelegramBadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    return 'blocked'
+                logging.warning(f"Рассылка: ошибка отправки в чат {chat_id}: {e}")
+                return 'failed'
+            except Exception as e:
+                logging.warning(f"Рассылка: сбой отправки в чат {chat_id} (попытка {attempt}): {e}")
+                await asyncio.sleep(min(30, 2 ** attempt))
+        return 'failed'
+
+    async def _report(self, broadcast, counters: dict, state: str):
+        """Обновляет (или создает) сообщение о прогрессе в админском чате"""
+        processed = sum(counters.values())
+        text = (
+            f"📣 Рассылка #{broadcast.id} {state}\n\n"
+            f"👥 Обработано: {processed} из {broadcast.total}\n"
+            f"✅ Доставлено: {counters['sent']}\n"
+            f"🚫 Недоступны: {counters['blocked']}\n"
+            f"❌ Ошибки: {counters['failed']}"
+        )
+        try:
+            await self.limiter.acquire(broadcast.admin_chat_id)
+            if broadcast.progress_message_id:
+                await self.bot.edit_message_text(
+                    text, chat_id=broadcast.admin_chat_id, message_id=broadcast.progress_message_id
+                )
+                return broadcast.progress_message_id
+            message = await self.bot.send_message(broadcast.admin_chat_id, text)
+            return message.message_id
+        except Exception as e:
+            logging.warning(f"Рассылка: не удалось обновить прогресс: {e}")
+            return broadcast.progress_message_id
+
+    async def close(self, timeout: float = 10):
+        """Останавливает обработчик; прерванная рассылка продолжится после перезапуска"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Проверка планов горячих запросов: каждый должен использовать свой индекс.
+
+Создает схему и применяет миграции на отдельной тестовой БД, заполняет ее
+данными и выполняет EXPLAIN для запросов DatabaseService, enhanced_admin
+и admin_simple. Запуск:
+
+    python check_query_plans.py                      # временная SQLite
+    EXPLAIN_DATABASE_URL=postgresql://... python check_query_plans.py
+
+Для PostgreSQL используйте отдельную пустую базу - скрипт пишет в нее
+тестовые данные. Последовательное сканирование в сессии проверки
+отключается (enable_seqscan=off), чтобы на небольшом наборе данных
+планировщик показал, каким индексом он может воспользоваться.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, delete, select, func, text
+
+from models import Base, Application, BotMetrics, DialogState, User
+from migrations import run_migrations
+from database_service import (
+    build_recent_applications_query, build_applications_page_query,
+    build_summary_query, summary_since, build_active_recipients_query
+)
+from enhanced_admin import DAILY_STATS_SQL
+from admin_simple import PACKAGE_STATS_SQL, DAILY_COUNTS_SQL, RECENT_ACTIVITY_SQL
+
+SEED_APPLICATIONS = 20000
+SEED_METRICS = 50000
+
+def seed(conn):
+    """Заполняет пустую тестовую БД данными"""
+    if conn.execute(select(func.count(Application.id))).scalar():
+        print("ℹ️ Данные уже есть, заполнение пропущено")
+        return
+    random.seed(42)
+    now = datetime.utcnow()
+    packages = ['start', 'business', 'professional', 'corporate', None]
+    statuses = ['new', 'contacted', 'closed']
+    actions = ['start', 'view_packages', 'view_package_details', 'start_contact_form', 'submit_application']
+
+    # Каждый пятый пользователь заблокировал бота
+    conn.execute(insert(User), [{'telegram_id': i, 'is_active': i % 5 != 0} for i in range(1, 5001)])
+    # Одна заявка на пользователя (уникальный индекс applications.user_id)
+    applicants = random.sample(range(1, SEED_APPLICATIONS * 2), SEED_APPLICATIONS)
+    conn.execute(insert(Application), [
+        {
+            'user_id': applicants[i],
+            'name': f'Клиент {i}',
+            'phone': f'+7900{i:07d}',
+            'package_interest': random.choice(packages),
+            'status': random.choice(statuses),
+            'created_at': now - timedelta(minutes=i * 7)
+        }
+        for i in range(SEED_APPLICATIONS)
+    ])
+    conn.execute(insert(BotMetrics), [
+        {
+            'telegram_id': random.randint(1, 5000),
+            'action': random.choice(actions),
+            'created_at': now - timedelta(seconds=i * 30)
+        }
+        for i in range(SEED_METRICS)
+    ])
+    conn.execute(insert(DialogState), [
+        {'telegram_id': i, 'current_state': 'ContactForm:waiting_for_name',
+         'updated_at': now - timedelta(hours=i % 72)}
+        for i in range(1, 2001)
+    ])
+    print(f"✅ Тестовые данные: {SEED_APPLICATIONS} заявок, {SEED_METRICS} метрик")
+
+def hot_queries(dialect_name: str):
+    """(название, запрос, параметры, ожидаемые индексы)"""
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    cursor = (datetime.utcnow() - timedelta(days=30), 1000)
+    return [
+        ('последние заявки', build_recent_applications_query(10), None,
+         ['ix_applications_created_at_id']),
+        ('API: страница по курсору', build_applications_page_query(21, after=cursor), None,
+         ['ix_applications_created_at_id']),
+        ('API: фильтр по статусу', build_applications_page_query(21, status='contacted'), None,
+         ['ix_applications_status_created_at']),
+        ('API: фильтр по пакету', build_applications_page_query(21, package='business'), None,
+         ['ix_applications_package_created_at']),
+        ('сводная статистика', build_summary_query(summary_since(7)), None,
+         ['ix_applications_status_created_at', 'ix_applications_package_created_at',
+          'ix_applications_created_at_id']),
+        ('enhanced_admin /stats по дням', text(DAILY_STATS_SQL), {'week_ago': week_ago},
+         ['ix_applications_created_at_id']),
+        ('admin_simple: по пакетам', text(PACKAGE_STATS_SQL), None,
+         ['ix_applications_package_created_at']),
+        ('admin_simple: по дням', text(DAILY_COUNTS_SQL), None,
+         ['ix_applications_created_at_id']),
+        ('admin_simple: активность', text(RECENT_ACTIVITY_SQL), None,
+         ['ix_bot_metrics_created_at']),
+        ('очистка состояний FSM',
+         delete(DialogState).where(DialogState.updated_at < datetime.utcnow() - timedelta(days=1)), None,
+         ['ix_dialog_states_updated_at']),
+        # В SQLite users.id - это rowid, таблица и так упорядочена по нему
+        ('получатели рассылки', build_active_recipients_query(1000, 100), None,
+         ['ix_users_active_id'] if dialect_name == 'postgresql' else ['INTEGER PRIMARY KEY']),
+    ]
+
+def explain(conn, statement, params) -> str:
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    if params is None:
+        compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True})
+        sql, params = str(compiled), {}
+    else:
+        sql = statement.text
+    rows = conn.execute(text(prefix + sql), params).fetchall()
+    return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+def main() -> int:
+    database_url = os.getenv('EXPLAIN_DATABASE_URL')
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'explain_check.db')
+    elif database_url.startswith('postgres://'):
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        seed(conn)
+        conn.execute(text('ANALYZE'))
+
+    failures = 0
+    with engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text('SET enable_seqscan = off'))
+        for name, statement, params, expected in hot_queries(conn.dialect.name):
+            plan = explain(conn, statement, params)
+            missing = [index for index in expected if index not in plan]
+            if missing:
+                failures += 1
+                print(f"❌ {name}: не используется {', '.join(missing)}\n{plan}\n")
+            else:
+                print(f"✅ {name}")
+        conn.rollback()
+
+    engine.dispose()
+    if failures:
+        print(f"\n❌ Запросов без нужного индекса: {failures}")
+        return 1
+    print("\n✅ Все горячие запросы используют индексы")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,49 +1,235 @@
 from sqlalchemy.orm import Session
-from models import User, Application, DialogState, BotMetrics, get_db
-from datetime import datetime
+from sqlalchemy import select, func, literal_column, null, cast, union_all, String, and_, or_, case
+from sqlalchemy.dialects import postgresql, sqlite
+from models import User, Application, DialogState, BotMetrics, RollupWatermark, get_db
+from metrics_store import DAILY_WATERMARK, build_action_counts_query, sum_action_counts
+from funnel import build_funnel_query, summarize_funnel
+from datetime import datetime, timedelta
 import json
 import logging
 
+def build_summary_query(since: datetime):
+    """Строит один запрос (UNION ALL) со всеми агрегатами по заявкам.
+
+    Каждая строка результата: (dimension, key, value). Счетчики считаются на
+    стороне БД по всей таблице, а не по последним N заявкам.
+    """
+    day = cast(func.date(Application.created_at), String)
+    no_key = cast(null(), String)
+    # Имена измерений - SQL-литералы, а не параметры: asyncpg не выводит тип
+    # параметра внутри UNION
+    return union_all(
+        select(literal_column("'total'").label('dimension'), no_key.label('key'),
+               func.count(Application.id).label('value')),
+        select(literal_column("'applicants'"), no_key, func.count(func.distinct(Application.user_id))),
+        select(literal_column("'users'"), no_key, func.count(User.id)),
+        select(literal_column("'status'"), cast(Application.status, String), func.count(Application.id))
+        .group_by(Application.status),
+        select(literal_column("'package'"), cast(Application.package_interest, String),
+               func.count(Application.id))
+        .group_by(Application.package_interest),
+        select(literal_column("'day'"), day, func.count(Application.id))
+        .where(Application.created_at >= since)
+        .group_by(day),
+    )
+
+def summarize_stats(rows) -> dict:
+    """Превращает строки build_summary_query в словарь статистики"""
+    stats = {
+        'total_applications': 0,
+        'unique_applicants': 0,
+        'total_users': 0,
+        'by_status': {},
+        'by_package': {},
+        'by_day': {}
+    }
+    scalar_keys = {'total': 'total_applications', 'applicants': 'unique_applicants', 'users': 'total_users'}
+    for dimension, key, value in rows:
+        if dimension in scalar_keys:
+            stats[scalar_keys[dimension]] = value or 0
+        elif dimension == 'package':
+            stats['by_package'][key or 'none'] = value
+        else:
+            stats[f'by_{dimension}'][key] = value
+    today = datetime.utcnow().date().isoformat()
+    stats['new_applications'] = stats['by_status'].get('new', 0)
+    stats['today_applications'] = stats['by_day'].get(today, 0)
+    return stats
+
+def summary_since(days: int) -> datetime:
+    """Начало окна статистики по дням (полночь UTC days-1 дней назад)"""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days - 1)
+
+def _dialect_insert(model, dialect_name: str):
+    # ON CONFLICT есть только в диалектных insert() PostgreSQL и SQLite
+    if dialect_name == 'postgresql':
+        return postgresql.insert(model)
+    if dialect_name == 'sqlite':
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upsert не поддерживается для {dialect_name}")
+
+def build_user_upsert(dialect_name: str, telegram_id: int, username: str = None,
+                      first_name: str = None, last_name: str = None):
+    """INSERT ... ON CONFLICT (telegram_id) DO UPDATE для пользователя.
+
+    updated_at меняется, только если данные Telegram или is_active действительно изменились.
+    """
+    now = datetime.utcnow()
+    stmt = _dialect_insert(User, dialect_name).values(
+        telegram_id=telegram_id, username=username, first_name=first_name,
+        last_name=last_name, is_active=True, created_at=now, updated_at=now
+    )
+    changed = or_(
+        User.username.is_distinct_from(stmt.excluded.username),
+        User.first_name.is_distinct_from(stmt.excluded.first_name),
+        User.last_name.is_distinct_from(stmt.excluded.last_name),
+        User.is_active.is_distinct_from(stmt.excluded.is_active)
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={
+            'username': stmt.excluded.username,
+            'first_name': stmt.excluded.first_name,
+            'last_name': stmt.excluded.last_name,
+            # Пользователь написал боту - значит, снова доступен
+            'is_active': stmt.excluded.is_active,
+            'updated_at': case((changed, stmt.excluded.updated_at), else_=User.updated_at)
+        }
+    )
+
+def build_application_upsert(dialect_name: str, telegram_id: int, name: str, phone: str,
+                             package_interest: str = None):
+    """INSERT ... ON CONFLICT (user_id) DO UPDATE для заявки.
+
+    Повторная подача обновляет заявку пользователя и сбрасывает статус в new
+    (уникальный индекс на applications.user_id - миграция 0003).
+    """
+    now = datetime.utcnow()
+    stmt = _dialect_insert(Application, dialect_name).values(
+        user_id=telegram_id, name=name, phone=phone, package_interest=package_interest,
+        status='new', created_at=now, updated_at=now
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[Application.user_id],
+        set_={
+            'name': stmt.excluded.name,
+            'phone': stmt.excluded.phone,
+            'package_interest': stmt.excluded.package_interest,
+            'status': stmt.excluded.status,
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+
+def build_dialog_states_upsert(dialect_name: str, states: dict):
+    """Многострочный upsert состояний {telegram_id: (state, data)} в dialog_states"""
+    now = datetime.utcnow()
+    stmt = _dialect_insert(DialogState, dialect_name).values([
+        {
+            'telegram_id': telegram_id,
+            'current_state': state,
+            'data': json.dumps(data) if data else None,
+            'created_at': now,
+            'updated_at': now
+        }
+        for telegram_id, (state, data) in states.items()
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[DialogState.telegram_id],
+        set_={
+            'current_state': stmt.excluded.current_state,
+            'data': stmt.excluded.data,
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+
+def build_active_recipients_query(after_user_id: int, limit: int):
+    """Пачка активных пользователей (users.id, telegram_id) после after_user_id.
+
+    Читается из частичного индекса ix_users_active_id без обращения к таблице.
+    """
+    return (
+        select(User.id, User.telegram_id)
+        .where(User.is_active == True, User.id > after_user_id)  # "= true": условие частичного индекса
+        .order_by(User.id)
+        .limit(limit)
+    )
+
+def build_recent_applications_query(limit: int):
+    """Последние заявки (использует индекс applications (created_at, id))"""
+    return select(Application).order_by(Application.created_at.desc(), Application.id.desc()).limit(limit)
+
+def build_applications_page_query(limit: int, after: tuple = None, ascending: bool = False,
+                                  status: str = None, package: str = None,
+                                  date_from: datetime = None, date_to: datetime = None):
+    """Страница заявок с keyset-условием по (created_at, id).
+
+    date_to не включается (created_at < date_to); день из API включительно
+    превращается в границу в export_service.parse_date_to.
+    """
+    query = select(Application)
+    if status:
+        query = query.where(Application.status == status)
+    if package:
+        query = query.where(Application.package_interest == package)
+    if date_from is not None:
+        query = query.where(Application.created_at >= date_from)
+    if date_to is not None:
+        query = query.where(Application.created_at < date_to)
+    if after is not None:
+        created_at, app_id = after
+        if ascending:
+            query = query.where(or_(Application.created_at > created_at,
+                                    and_(Application.created_at == created_at, Application.id > app_id)))
+        else:
+            query = query.where(or_(Application.created_at < created_at,
+                                    and_(Application.created_at == created_at, Application.id < app_id)))
+    if ascending:
+        query = query.order_by(Application.created_at.asc(), Application.id.asc())
+    else:
+        query = query.order_by(Application.created_at.desc(), Application.id.desc())
+    return query.limit(limit)
+
+def build_export_query(date_from: datetime = None, date_to: datetime = None, status: str = None):
+    """Колонки заявок для потокового экспорта с фильтрами (date_to не включается)"""
+    query = select(
+        Application.id, Application.name, Application.phone,
+        Application.package_interest, Application.user_id, Application.status,
+        Application.created_at, Application.updated_at
+    ).order_by(Application.id)
+    if date_from is not None:
+        query = query.where(Application.created_at >= date_from)
+    if date_to is not None:
+        query = query.where(Application.created_at < date_to)
+    if status:
+        query = query.where(Application.status == status)
+    return query
+
 class DatabaseService:
     """Сервис для работы с базой данных"""
     
+    @staticmethod
+    def _upsert_returning(db: Session, stmt, model, where):
+        """Выполняет upsert и возвращает строку как ORM-объект.
+
+        SQLite до 3.35 не умеет RETURNING - тогда строка дочитывается SELECT.
+        """
+        if db.get_bind().dialect.insert_returning:
+            return db.scalars(stmt.returning(model), execution_options={'populate_existing': True}).one()
+        db.execute(stmt)
+        return db.scalars(select(model).where(where).execution_options(populate_existing=True)).one()
+    
     @staticmethod
     def get_or_create_user(telegram_id: int, username: str = None, 
                           first_name: str = None, last_name: str = None) -> User:
-        """Получает или создает пользователя"""
+        """Получает или создает пользователя (один upsert, без гонки при двойном нажатии)"""
         db = get_db()
         try:
-            user = db.query(User).filter(User.telegram_id == telegram_id).first()
-            
-            if not user:
-                user = User(
-                    telegram_id=telegram_id,
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name
-                )
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-                logging.info(f"Создан новый пользователь: {telegram_id}")
-            else:
-                # Обновляем данные если они изменились
-                updated = False
-                if user.username != username:
-                    user.username = username
-                    updated = True
-                if user.first_name != first_name:
-                    user.first_name = first_name
-                    updated = True
-                if user.last_name != last_name:
-                    user.last_name = last_name
-                    updated = True
-                
-                if updated:
-                    user.updated_at = datetime.utcnow()
-                    db.commit()
-                    logging.info(f"Обновлены данные пользователя: {telegram_id}")
-            
+            stmt = build_user_upsert(db.get_bind().dialect.name, telegram_id, username, first_name, last_name)
+            user = DatabaseService._upsert_returning(db, stmt, User, User.telegram_id == telegram_id)
+            # Отсоединяем до коммита, чтобы атрибуты остались загруженными после закрытия сессии
+            db.expunge(user)
+            db.commit()
             return user
         except Exception as e:
             db.rollback()
@@ -70,38 +256,20 @@ class DatabaseService:
     @staticmethod
     def create_application(telegram_id: int, name: str, phone: str, 
                          package_interest: str = None) -> Application:
-        """Создает новую заявку"""
+        """Создает заявку или обновляет существующую заявку пользователя (один upsert)"""
         db = get_db()
         try:
-            # Проверяем, есть ли уже заявка от этого пользователя
-            existing = db.query(Application).filter(
-                Application.user_id == telegram_id
-            ).first()
-            
-            if existing:
-                # Обновляем существующую заявку
-                existing.name = name
-                existing.phone = phone
-                existing.package_interest = package_interest
-                existing.updated_at = datetime.utcnow()
-                existing.status = 'new'  # Сбрасываем статус
-                db.commit()
-                db.refresh(existing)
-                logging.info(f"Обновлена заявка пользователя: {telegram_id}")
-                return existing
-            else:
-                # Создаем новую заявку
-                application = Application(
-                    user_id=telegram_id,
-                    name=name,
-                    phone=phone,
-                    package_interest=package_interest
-                )
-                db.add(application)
-                db.commit()
-                db.refresh(application)
+            stmt = build_application_upsert(db.get_bind().dialect.name, telegram_id, name, phone, package_interest)
+            application = DatabaseService._upsert_returning(
+                db, stmt, Application, Application.user_id == telegram_id
+            )
+            db.expunge(application)
+            db.commit()
+            if application.created_at == application.updated_at:
                 logging.info(f"Создана новая заявка: {telegram_id} - {name}")
-                return application
+            else:
+                logging.info(f"Обновлена заявка пользователя: {telegram_id}")
+            return application
         except Exception as e:
             db.rollback()
             logging.error(f"Ошибка при создании заявки {telegram_id}: {e}")
@@ -129,27 +297,10 @@ class DatabaseService:
     
     @staticmethod
     def save_dialog_state(telegram_id: int, state: str, data: dict = None):
-        """Сохраняет состояние диалога"""
+        """Сохраняет состояние диалога (upsert)"""
         db = get_db()
         try:
-            dialog_state = db.query(DialogState).filter(
-                DialogState.telegram_id == telegram_id
-            ).first()
-            
-            data_json = json.dumps(data) if data else None
-            
-            if dialog_state:
-                dialog_state.current_state = state
-                dialog_state.data = data_json
-                dialog_state.updated_at = datetime.utcnow()
-            else:
-                dialog_state = DialogState(
-                    telegram_id=telegram_id,
-                    current_state=state,
-                    data=data_json
-                )
-                db.add(dialog_state)
-            
+            db.execute(build_dialog_states_upsert(db.get_bind().dialect.name, {telegram_id: (state, data)}))
             db.commit()
         except Exception as e:
             db.rollback()
@@ -230,12 +381,89 @@ class DatabaseService:
         """Получает последние заявки"""
         db = get_db()
         try:
-            applications = db.query(Application).order_by(
-                Application.created_at.desc()
-            ).limit(limit).all()
+            applications = db.scalars(build_recent_applications_query(limit)).all()
             return applications
         except Exception as e:
             logging.error(f"Ошибка при получении заявок: {e}")
             return []
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+    
+    @staticmethod
+    def get_summary_stats(days: int = 7) -> dict:
+        """Получает агрегированную статистику по заявкам одним запросом"""
+        db = get_db()
+        try:
+            rows = db.execute(build_summary_query(summary_since(days))).fetchall()
+            return summarize_stats(rows)
+        except Exception as e:
+            logging.error(f"Ошибка при получении статистики: {e}")
+            return summarize_stats([])
+        finally:
+            db.close()
+    
+    @staticmethod
+    def get_action_counts(days: int = 30) -> dict:
+        """Число действий пользователей за days дней.
+
+        Завершенные дни читаются из дневных агрегатов, свежие - из сырых событий.
+        """
+        db = get_db()
+        try:
+            watermark = db.scalar(select(RollupWatermark.value).where(RollupWatermark.name == DAILY_WATERMARK))
+            rows = db.execute(build_action_counts_query(summary_since(days), watermark)).fetchall()
+            return sum_action_counts(rows)
+        except Exception as e:
+            logging.error(f"Ошибка при получении статистики действий: {e}")
+            return {}
+        finally:
+            db.close()
+    
+    @staticmethod
+    def get_funnel(days: int = 30) -> dict:
+        """Воронка за days дней из дневных сверток funnel_daily"""
+        db = get_db()
+        try:
+            rows = db.execute(build_funnel_query(summary_since(days))).fetchall()
+            return summarize_funnel(rows)
+        except Exception as e:
+            logging.error(f"Ошибка при получении воронки: {e}")
+            return summarize_funnel([])
+        finally:
+            db.close()
+    
+    @staticmethod
+    def iter_applications(date_from: datetime = None, date_to: datetime = None,
+                          status: str = None, batch_size: int = 1000):
+        """Потоково отдает заявки (строки с колонками) по фильтрам.
+
+        Фильтры выполняются в SQL, строки читаются серверным курсором пачками
+        по batch_size, поэтому в памяти не держится вся выборка. Сессия
+        закрывается, когда генератор исчерпан или закрыт.
+        """
+        query = build_export_query(date_from, date_to, status)
+
+        db = get_db()
+        try:
+            result = db.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+            for partition in result.partitions():
+                yield from partition
+        finally:
+            db.close()
+    
+    @staticmethod
+    def get_applications_page(limit: int = 20, after: tuple = None, ascending: bool = False,
+                              status: str = None, package: str = None,
+                              date_from: datetime = None, date_to: datetime = None) -> list:
+        """Получает страницу заявок с keyset-пагинацией по (created_at, id).
+
+        after - (created_at, id) последней заявки предыдущей страницы. Вместо
+        OFFSET используется условие по ключу сортировки, поэтому стоимость
+        запроса не растет с номером страницы. Возвращает до limit заявок.
+        """
+        db = get_db()
+        try:
+            query = build_applications_page_query(limit, after, ascending, status, package, date_from, date_to)
+            return list(db.scalars(query))
+        finally:
+            db.close()
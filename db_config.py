@@ -0,0 +1,107 @@
+"""
+Настройки пулов соединений с базой данных для разных типов процессов.
+
+Профиль выбирается переменной DB_POOL_PROFILE (worker, web, cli) - в Procfile
+он задан для каждого процесса, а ручные скрипты (python -m migrations,
+metrics_store.py, admin_simple.py) по умолчанию берут cli. Любой параметр
+профиля можно переопределить переменными окружения: DB_POOL_SIZE и
+DB_MAX_OVERFLOW - для синхронного движка, DB_ASYNC_POOL_SIZE и
+DB_ASYNC_MAX_OVERFLOW - для асинхронного, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS - для обоих. Миграции выполняются
+без statement_timeout (см. migrations._lock).
+
+Лимит соединений Heroku Postgres делится между всеми dyno: на процесс
+приходится до (pool_size + max_overflow) соединений синхронного движка плюс
+столько же асинхронного. Бот работает через асинхронный движок, веб-админка -
+через синхронный, поэтому неиспользуемый пул в каждом профиле минимален.
+
+DB_PGBOUNCER=true - режим для PgBouncer в transaction pooling (например,
+buildpack heroku-buildpack-pgbouncer): пулом управляет PgBouncer, поэтому на
+стороне приложения используется NullPool, кэш подготовленных выражений
+asyncpg отключен, а statement_timeout не передается в параметрах
+подключения (PgBouncer их не пропускает) - задайте его для роли в БД.
+"""
+
+import os
+from uuid import uuid4
+
+from sqlalchemy.pool import NullPool
+
+# sync - синхронный движок (Flask-админки, CLI), async - асинхронный (бот)
+POOL_PROFILES = {
+    'worker': {
+        'sync': {'pool_size': 1, 'max_overflow': 1},
+        'async': {'pool_size': 5, 'max_overflow': 5},
+        'statement_timeout_ms': 10000,
+    },
+    'web': {
+        'sync': {'pool_size': 3, 'max_overflow': 2},
+        'async': {'pool_size': 1, 'max_overflow': 0},
+        'statement_timeout_ms': 30000,
+    },
+    'cli': {
+        'sync': {'pool_size': 1, 'max_overflow': 0},
+        'async': {'pool_size': 1, 'max_overflow': 0},
+        'statement_timeout_ms': 0,
+    },
+    'default': {
+        'sync': {'pool_size': 5, 'max_overflow': 5},
+        'async': {'pool_size': 5, 'max_overflow': 5},
+        'statement_timeout_ms': 30000,
+    },
+}
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+def get_pool_profile() -> str:
+    profile = os.getenv('DB_POOL_PROFILE', 'default')
+    return profile if profile in POOL_PROFILES else 'default'
+
+def is_pgbouncer() -> bool:
+    return os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+def engine_options(database_url: str, is_async: bool = False) -> dict:
+    """Параметры create_engine / create_async_engine для текущего профиля"""
+    if not database_url.startswith('postgresql'):
+        # SQLite (локальная разработка) - настройки SQLAlchemy по умолчанию
+        return {}
+
+    profile_name = get_pool_profile()
+    profile = POOL_PROFILES[profile_name]
+    pool = profile['async' if is_async else 'sync']
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', profile['statement_timeout_ms'])
+    application_name = f"chatbot-{profile_name}"
+
+    if is_pgbouncer():
+        options = {'poolclass': NullPool}
+        if is_async:
+            # Подготовленные выражения не переживают смену серверного соединения
+            options['connect_args'] = {
+                'statement_cache_size': 0,
+                'prepared_statement_cache_size': 0,
+                'prepared_statement_name_func': lambda: f"__asyncpg_{uuid4()}__",
+            }
+        return options
+
+    prefix = 'DB_ASYNC_' if is_async else 'DB_'
+    options = {
+        'pool_size': _env_int(f'{prefix}POOL_SIZE', pool['pool_size']),
+        'max_overflow': _env_int(f'{prefix}MAX_OVERFLOW', pool['max_overflow']),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 10),
+        # Heroku и балансировщики рвут простаивающие соединения
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+    if is_async:
+        server_settings = {'application_name': application_name}
+        if statement_timeout:
+            server_settings['statement_timeout'] = str(statement_timeout)
+        options['connect_args'] = {'server_settings': server_settings}
+    else:
+        connect_args = {'application_name': application_name}
+        if statement_timeout:
+            connect_args['options'] = f"-c statement_timeout={statement_timeout}"
+        options['connect_args'] = connect_args
+    return options
@@ -0,0 +1,36 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from models import AsyncSessionLocal
+from async_database_service import commit_unit, rollback_unit
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Одна сессия и одна транзакция БД на апдейт (unit of work).
+
+    Сессия передается в хендлер аргументом ``db``; методы AsyncDatabaseService,
+    получившие ее, только отправляют изменения (flush), а коммит выполняется
+    один раз после хендлера. Если хендлер упал, транзакция откатывается целиком.
+    Соединение из пула берется только при первом запросе к БД, поэтому апдейты,
+    которые обходятся кэшами, пул не трогают.
+
+    Хендлер может закоммитить раньше сам (commit_unit), например чтобы ответить
+    пользователю только после того, как заявка надежно сохранена.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with AsyncSessionLocal() as db:
+            data['db'] = db
+            try:
+                result = await handler(event, data)
+                await commit_unit(db)
+            except Exception:
+                await rollback_unit(db)
+                raise
+            return result
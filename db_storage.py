@@ -0,0 +1,174 @@
+import asyncio
+import copy
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from async_database_service import AsyncDatabaseService
+
+class DatabaseStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх таблицы dialog_states.
+
+    Состояние и данные формы (включая интересующий пакет) живут в одной записи
+    на пользователя, поэтому переживают перезапуск и видны всем воркерам.
+    Каждое изменение сразу записывается в БД (write-through), а чтение идет из
+    БД (read-through), поэтому следующий апдейт пользователя, попавший на
+    другой воркер, видит актуальное состояние. Локальная копия используется
+    без обращения к БД только ``cache_ttl`` секунд (по умолчанию 0; больше
+    нуля - только для единственного воркера) и пока запись не удалась: такие
+    изменения повторяются в фоне раз в ``flush_interval_ms``.
+    Состояния, не обновлявшиеся дольше ``state_ttl`` секунд, считаются
+    истекшими и периодически удаляются.
+
+    В таблице ключ - telegram_id, поэтому в БД попадают только состояния личных
+    чатов. Состояния групп, тредов и нестандартных destiny хранятся в памяти.
+    """
+
+    def __init__(self, flush_interval_ms: int = None, cache_ttl: float = None,
+                 state_ttl: float = None, cleanup_interval: float = 600):
+        self.flush_interval = (flush_interval_ms or int(os.getenv('FSM_FLUSH_INTERVAL_MS', '200'))) / 1000
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(os.getenv('FSM_CACHE_TTL', '0'))
+        self.state_ttl = state_ttl if state_ttl is not None else float(os.getenv('FSM_STATE_TTL', '86400'))
+        self.cleanup_interval = cleanup_interval
+        self._cache = {}  # telegram_id -> {'state', 'data', 'loaded_at'}
+        self._dirty = set()
+        self._fallback = MemoryStorage()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def pending_writes(self) -> int:
+        """Число состояний, ожидающих записи в БД"""
+        return len(self._dirty)
+
+    @staticmethod
+    def _is_persistent(key: StorageKey) -> bool:
+        return key.chat_id == key.user_id and key.thread_id is None and key.destiny == 'default'
+
+    def start(self):
+        """Запускает фоновую задачу повтора записи и очистки"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        last_cleanup = time.monotonic()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.cleanup_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            await self.flush()
+
+            if time.monotonic() - last_cleanup >= self.cleanup_interval:
+                last_cleanup = time.monotonic()
+                self._evict_stale()
+                before = datetime.utcnow() - timedelta(seconds=self.state_ttl)
+                removed = await AsyncDatabaseService.delete_expired_dialog_states(before)
+                if removed:
+                    logging.info(f"Удалено устаревших состояний диалога: {removed}")
+
+    def _evict_stale(self):
+        """Убирает из локального кэша сохраненные и устаревшие записи"""
+        now = time.monotonic()
+        stale = [telegram_id for telegram_id, entry in self._cache.items()
+                 if telegram_id not in self._dirty and now - entry['loaded_at'] >= self.cache_ttl]
+        for telegram_id in stale:
+            del self._cache[telegram_id]
+
+    async def flush(self, telegram_ids: list = None) -> bool:
+        """Записывает измененные состояния в БД (все или только telegram_ids).
+
+        True - записи дошли до БД. Если запись не завершилась (ошибка или
+        отмена задачи), состояния остаются грязными и будут записаны повторно.
+        """
+        telegram_ids = [telegram_id for telegram_id in (telegram_ids or list(self._dirty))
+                        if telegram_id in self._dirty]
+        if not telegram_ids:
+            return True
+        self._dirty.difference_update(telegram_ids)
+        states = {}
+        for telegram_id in telegram_ids:
+            entry = self._cache[telegram_id]
+            states[telegram_id] = (entry['state'], copy.deepcopy(entry['data']))
+        saved = False
+        try:
+            await AsyncDatabaseService.save_dialog_states(states)
+            saved = True
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении FSM-состояний ({len(states)} шт.): {e}")
+        finally:
+            if not saved:
+                # Повторим при следующем сбросе (и при остановке)
+                self._dirty.update(telegram_ids)
+                self._wakeup.set()
+        return saved
+
+    async def _get_entry(self, telegram_id: int) -> dict:
+        entry = self._cache.get(telegram_id)
+        if entry is not None and (telegram_id in self._dirty
+                                  or time.monotonic() - entry['loaded_at'] < self.cache_ttl):
+            return entry
+
+        row = await AsyncDatabaseService.load_dialog_state(telegram_id)
+        state, data = None, {}
+        if row is not None:
+            state, data, updated_at = row
+            if updated_at and updated_at < datetime.utcnow() - timedelta(seconds=self.state_ttl):
+                state, data = None, {}
+        entry = {'state': state, 'data': data, 'loaded_at': time.monotonic()}
+        self._cache[telegram_id] = entry
+        return entry
+
+    async def _write(self, telegram_id: int):
+        """Сразу записывает состояние пользователя в БД (при ошибке - повтор в фоне)"""
+        self._cache[telegram_id]['loaded_at'] = time.monotonic()
+        self._dirty.add(telegram_id)
+        await self.flush([telegram_id])
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if not self._is_persistent(key):
+            return await self._fallback.set_state(key, state)
+        entry = await self._get_entry(key.user_id)
+        entry['state'] = state.state if isinstance(state, State) else state
+        await self._write(key.user_id)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        if not self._is_persistent(key):
+            return await self._fallback.get_state(key)
+        entry = await self._get_entry(key.user_id)
+        return entry['state']
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not self._is_persistent(key):
+            return await self._fallback.set_data(key, data)
+        entry = await self._get_entry(key.user_id)
+        entry['data'] = copy.deepcopy(data)
+        await self._write(key.user_id)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        if not self._is_persistent(key):
+            return await self._fallback.get_data(key)
+        entry = await self._get_entry(key.user_id)
+        return copy.deepcopy(entry['data'])
+
+    async def close(self) -> None:
+        """Останавливает фоновую задачу и записывает несохраненные изменения"""
+        if self._task is not None:
+            # Без cancel(): текущая запись в БД должна завершиться
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await self._fallback.close()
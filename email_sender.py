@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class EmailSender:
+    """Отправка писем вне event loop через постоянное SMTP-соединение.
+
+    Все операции smtplib выполняются в одном выделенном потоке: соединение
+    (connect + STARTTLS + login) устанавливается один раз и переиспользуется.
+    Если оно простаивало дольше ``keepalive`` секунд, перед отправкой оно
+    проверяется командой NOOP и при необходимости переподключается.
+    Письма из очереди отправляются пачками до ``batch_size`` штук.
+    """
+
+    def __init__(self, server: str, port: int, username: str = None, password: str = None,
+                 use_tls: bool = True, batch_size: int = 20, keepalive: float = 60,
+                 timeout: float = 30, max_queue_size: int = 1000):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.batch_size = batch_size
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smtp')
+        self._smtp = None
+        self._last_used = 0.0
+        self._queue = None
+        self._task = None
+        self._in_flight = []  # futures пачки, которая сейчас отправляется
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        if self.use_tls:
+            smtp.starttls()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        logging.info(f"SMTP-соединение с {self.server}:{self.port} установлено")
+        return smtp
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+    def _drop_connection(self):
+        """Бросает разорванное соединение, закрывая сокет"""
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _ensure_connection(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > self.keepalive:
+            try:
+                self._smtp.noop()
+            except OSError:  # включает SMTPException
+                self._disconnect()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def _deliver_batch(self, messages: list) -> list:
+        """Отправляет пачку писем (выполняется в потоке SMTP)"""
+        results = []
+        for msg in messages:
+            for attempt in range(2):
+                try:
+                    self._ensure_connection().send_message(msg)
+                    self._last_used = time.monotonic()
+                    results.append(True)
+                    break
+                except smtplib.SMTPServerDisconnected as e:
+                    # Соединение разорвано сервером - переподключаемся один раз
+                    self._drop_connection()
+                    if attempt:
+                        results.append(e)
+                except smtplib.SMTPException as e:
+                    # Ошибка протокола (адрес отклонен и т.п.) - повтор не поможет
+                    results.append(e)
+                    break
+                except OSError as e:
+                    # Сетевая ошибка - переподключаемся один раз
+                    self._drop_connection()
+                    if attempt:
+                        results.append(e)
+                except Exception as e:
+                    results.append(e)
+                    break
+        return results
+
+    def start(self):
+        """Запускает фоновую задачу, разбирающую очередь писем"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:  # close(): все письма до него уже разобраны
+                break
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            messages = [msg for msg, _ in batch]
+            self._in_flight = [future for _, future in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self._deliver_batch, messages)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self._in_flight = []
+
+    def _fail_pending(self, error: Exception):
+        """Завершает ошибкой письма, которые уже не будут отправлены (send() не зависнет)"""
+        futures = self._in_flight
+        self._in_flight = []
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                futures.append(item[1])
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def send(self, msg) -> bool:
+        """Ставит письмо в очередь и ждет результата отправки"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((msg, future))
+        return await future
+
+    async def _stop_runner(self):
+        await self._queue.put(None)
+        await self._task
+
+    async def close(self, timeout: float = None):
+        """Дожидается отправки поставленных писем и закрывает SMTP-соединение.
+
+        Письма, не ушедшие за timeout (по умолчанию - два таймаута SMTP),
+        завершаются ошибкой.
+        """
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._stop_runner(), timeout=timeout or self.timeout * 2)
+            except asyncio.TimeoutError:
+                logging.warning("SMTP: очередь писем не разобрана до остановки")
+                if not self._task.done():
+                    self._task.cancel()
+                    try:
+                        await self._task
+                    except asyncio.CancelledError:
+                        pass
+            self._task = None
+            self._fail_pending(ConnectionError("Отправка писем остановлена"))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._disconnect)
+        self._executor.shutdown(wait=False)
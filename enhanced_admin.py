@@ -5,12 +5,17 @@
 
 import os
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template_string, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template_string
 from database_service import DatabaseService
-from sqlalchemy import create_engine, text
-from models import get_database_url, SessionLocal
+from export_service import stream_applications, parse_date, parse_date_to
+from applications_api import applications_api
+from instrumentation import instrument_flask
+from sqlalchemy import text
+from models import SessionLocal
 
 app = Flask(__name__)
+app.register_blueprint(applications_api)
+instrument_flask(app)
 
 # Простая аутентификация
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
@@ -55,6 +60,12 @@ ENHANCED_HTML_TEMPLATE = '''
         .stat-number { font-size: 2.5em; font-weight: bold; color: #007bff; margin-bottom: 5px; }
         .stat-label { color: #666; font-size: 0.9em; text-transform: uppercase; letter-spacing: 1px; }
         
+        .funnel { background: white; padding: 20px; border-radius: 12px; margin-bottom: 20px; box-shadow: 0 2px 15px rgba(0,0,0,0.08); }
+        .funnel h3 { margin-top: 0; color: #333; }
+        .funnel table { width: 100%; border-collapse: collapse; }
+        .funnel th, .funnel td { padding: 8px 10px; text-align: left; border-bottom: 1px solid #eee; }
+        .funnel th { color: #666; font-size: 0.85em; text-transform: uppercase; }
+        
         .controls { background: white; padding: 20px; border-radius: 12px; margin-bottom: 20px; box-shadow: 0 2px 15px rgba(0,0,0,0.08); }
         .controls h3 { margin-top: 0; color: #333; }
         .btn { padding: 10px 20px; border: none; border-radius: 6px; cursor: pointer; font-size: 14px; margin: 5px; text-decoration: none; display: inline-block; transition: all 0.3s; }
@@ -169,6 +180,7 @@ ENHANCED_HTML_TEMPLATE = '''
             <h3>🔧 Управление</h3>
             <button onclick="refreshPage()" class="btn btn-primary">🔄 Обновить данные</button>
             <a href="/export" class="btn btn-secondary">📊 Экспорт CSV</a>
+            <a href="/export?format=ndjson&gzip=1" class="btn btn-secondary">📦 Экспорт NDJSON.gz</a>
             <a href="/api/applications" class="btn btn-secondary">🔗 JSON API</a>
             <button onclick="window.print()" class="btn btn-secondary">🖨️ Печать</button>
         </div>
@@ -192,6 +204,36 @@ ENHANCED_HTML_TEMPLATE = '''
             </div>
         </div>
 
+        {% if funnel %}
+        <div class="funnel">
+            <h3>🔻 Воронка за 30 дней</h3>
+            <table>
+                <tr><th>Этап</th><th>Пользователи</th><th>Конверсия</th><th>От старта</th></tr>
+                {% for row in funnel.overall %}
+                <tr>
+                    <td>{{ row.title }}</td>
+                    <td>{{ row.users }}</td>
+                    <td>{{ row.conversion if row.conversion is not none else '—' }}{% if row.conversion is not none %}%{% endif %}</td>
+                    <td>{{ row.overall if row.overall is not none else '—' }}{% if row.overall is not none %}%{% endif %}</td>
+                </tr>
+                {% endfor %}
+            </table>
+            {% if funnel.by_package %}
+            <h3 style="margin-top: 20px;">📦 По пакетам</h3>
+            <table>
+                <tr><th>Пакет</th>{% for row in funnel.by_package.values()|first %}<th>{{ row.title }}</th>{% endfor %}<th>Детали → заявка</th></tr>
+                {% for package, rows in funnel.by_package.items() %}
+                <tr>
+                    <td>{{ package }}</td>
+                    {% for row in rows %}<td>{{ row.users }}</td>{% endfor %}
+                    <td>{{ rows[-1].overall if rows[-1].overall is not none else '—' }}{% if rows[-1].overall is not none %}%{% endif %}</td>
+                </tr>
+                {% endfor %}
+            </table>
+            {% endif %}
+        </div>
+        {% endif %}
+
         <div class="applications">
             <h3>📋 Заявки клиентов</h3>
             
@@ -217,6 +259,18 @@ ENHANCED_HTML_TEMPLATE = '''
                     </div>
                     
                     <div class="app-details">
+                        <div class="detail-item">
+                            <span class="detail-label">👤 Имя клиента</span>
+                            <span class="detail-value">{{ app.name }}</span>
+                        </div>
+                        <div class="detail-item">
+                            <span class="detail-label">📞 Телефон</span>
+                            <span class="detail-value"><a href="tel:{{ app.phone }}">{{ app.phone }}</a></span>
+                        </div>
+                        <div class="detail-item">
+                            <span class="detail-label">🆔 Telegram ID</span>
+                            <span class="detail-value">{{ app.user_id }}</span>
+                        </div>
                         <div class="detail-item">
                             <span class="detail-label">⏰ Дата заявки</span>
                             <span class="detail-value">{{ app.created_at.strftime('%d.%m.%Y %H:%M') }}</span>
@@ -316,28 +370,21 @@ def admin_panel():
         return render_template_string(ENHANCED_HTML_TEMPLATE, authenticated=False)
     
     try:
-        # Получаем все заявки
+        # Получаем последние заявки для списка
         applications = DatabaseService.get_recent_applications(limit=50)
-        total_applications = DatabaseService.get_applications_count()
         
-        # Статистика
-        new_applications = sum(1 for app in applications if app.status == 'new')
-        
-        # Заявки за сегодня
-        today = datetime.now().date()
-        today_applications = sum(1 for app in applications if app.created_at.date() == today)
-        
-        # Уникальные пользователи
-        total_users = len(set(app.user_id for app in applications))
+        # Статистика считается в БД одним запросом по всей таблице
+        stats = DatabaseService.get_summary_stats()
         
         return render_template_string(
             ENHANCED_HTML_TEMPLATE,
             authenticated=True,
             applications=applications,
-            total_applications=total_applications,
-            new_applications=new_applications,
-            today_applications=today_applications,
-            total_users=total_users,
+            total_applications=stats['total_applications'],
+            new_applications=stats['new_applications'],
+            today_applications=stats['today_applications'],
+            total_users=stats['total_users'],
+            funnel=DatabaseService.get_funnel(days=30),
             current_time=datetime.now().strftime('%d.%m.%Y %H:%M:%S'),
             password=ADMIN_PASSWORD
         )
@@ -372,63 +419,35 @@ def update_status():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/applications')
-def api_applications():
-    """API для получения заявок"""
-    try:
-        applications = DatabaseService.get_recent_applications(limit=20)
-        result = []
-        
-        for app in applications:
-            result.append({
-                'id': app.id,
-                'name': app.name,
-                'phone': app.phone,
-                'package_interest': app.package_interest,
-                'user_id': app.user_id,
-                'status': app.status,
-                'created_at': app.created_at.isoformat(),
-                'updated_at': app.updated_at.isoformat() if app.updated_at else None
-            })
-        
-        return jsonify({
-            'total': DatabaseService.get_applications_count(),
-            'applications': result,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
 @app.route('/export')
 def export_csv():
-    """Экспорт заявок в CSV"""
+    """Потоковый экспорт заявок (CSV или NDJSON, опционально gzip).
+
+    Параметры: format=csv|ndjson, gzip=1, date_from, date_to (YYYY-MM-DD, день
+    date_to включается), status.
+    Фильтры выполняются в SQL, файл формируется по частям без ограничения числа строк.
+    """
     try:
-        applications = DatabaseService.get_recent_applications(limit=1000)
-        
-        # Формируем CSV
-        csv_content = "ID,Имя,Телефон,Пакет,Telegram ID,Статус,Дата создания,Дата обновления\n"
-        
-        for app in applications:
-            package_names = {
-                'basic': 'Базовый',
-                'advanced': 'Продвинутый',
-                'premium': 'Премиум'
-            }
-            package_name = package_names.get(app.package_interest, app.package_interest or '')
-            
-            csv_content += f'{app.id},"{app.name}","{app.phone}","{package_name}",{app.user_id},{app.status},{app.created_at},{app.updated_at or ""}\n'
+        fmt = request.args.get('format', 'csv')
+        compress = request.args.get('gzip') in ('1', 'true')
+        date_from = parse_date(request.args.get('date_from'))
+        date_to = parse_date_to(request.args.get('date_to'))
+        status = request.args.get('status') or None
+        
+        stream, mimetype, filename = stream_applications(
+            fmt, compress=compress, date_from=date_from, date_to=date_to, status=status
+        )
         
-        # Отправляем файл
-        from flask import Response
         return Response(
-            csv_content,
-            mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename="applications_{datetime.now().strftime("%Y%m%d_%H%M")}.csv"'}
+            stream,
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
         )
         
+    except ValueError as e:
+        return f"Ошибка экспорта: {str(e)}", 400
     except Exception as e:
-        return f"Ошибка экспорта: {str(e)}"
+        return f"Ошибка экспорта: {str(e)}", 500
 
 @app.route('/health')
 def health_check():
@@ -440,6 +459,18 @@ def health_check():
         'total_applications': DatabaseService.get_applications_count()
     })
 
+# Статистика по дням (диапазон по индексу applications (created_at, id))
+DAILY_STATS_SQL = """
+    SELECT DATE(created_at) as date, COUNT(*) as count,
+           COUNT(CASE WHEN package_interest = 'basic' THEN 1 END) as basic_count,
+           COUNT(CASE WHEN package_interest = 'advanced' THEN 1 END) as advanced_count,
+           COUNT(CASE WHEN package_interest = 'premium' THEN 1 END) as premium_count
+    FROM applications 
+    WHERE created_at >= :week_ago
+    GROUP BY DATE(created_at) 
+    ORDER BY date DESC
+"""
+
 @app.route('/stats')
 def get_stats():
     """Детальная статистика"""
@@ -448,30 +479,22 @@ def get_stats():
         
         # Статистика по дням за последнюю неделю
         week_ago = datetime.now() - timedelta(days=7)
-        daily_stats = db.execute(text("""
-            SELECT DATE(created_at) as date, COUNT(*) as count,
-                   COUNT(CASE WHEN package_interest = 'basic' THEN 1 END) as basic_count,
-                   COUNT(CASE WHEN package_interest = 'advanced' THEN 1 END) as advanced_count,
-                   COUNT(CASE WHEN package_interest = 'premium' THEN 1 END) as premium_count
-            FROM applications 
-            WHERE created_at >= :week_ago
-            GROUP BY DATE(created_at) 
-            ORDER BY date DESC
-        """), {"week_ago": week_ago}).fetchall()
-        
-        # Статистика по статусам
-        status_stats = db.execute(text("""
-            SELECT status, COUNT(*) as count 
-            FROM applications 
-            GROUP BY status
-        """)).fetchall()
+        daily_stats = db.execute(text(DAILY_STATS_SQL), {"week_ago": week_ago}).fetchall()
         
         db.close()
         
+        # Статусы, пакеты и итоги - одним агрегирующим запросом
+        summary = DatabaseService.get_summary_stats()
+        
         stats = {
             'daily_stats': [{'date': str(row[0]), 'total': row[1], 'basic': row[2], 'advanced': row[3], 'premium': row[4]} for row in daily_stats],
-            'status_stats': [{'status': row[0], 'count': row[1]} for row in status_stats],
-            'total_applications': DatabaseService.get_applications_count()
+            'status_stats': [{'status': status, 'count': count} for status, count in summary['by_status'].items()],
+            'package_stats': summary['by_package'],
+            'total_applications': summary['total_applications'],
+            'unique_applicants': summary['unique_applicants'],
+            'total_users': summary['total_users'],
+            'action_stats': DatabaseService.get_action_counts(days=30),
+            'funnel': DatabaseService.get_funnel(days=30)
         }
         
         return jsonify(stats)
@@ -482,16 +505,3 @@ def get_stats():
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
-                            <span class="detail-label">👤 Имя клиента</span>
-                            <span class="detail-value">{{ app.name }}</span>
-                        </div>
-                        <div class="detail-item">
-                            <span class="detail-label">📞 Телефон</span>
-                            <span class="detail-value"><a href="tel:{{ app.phone }}">{{ app.phone }}</a></span>
-                        </div>
-                        <div class="detail-item">
-                            <span class="detail-label">🆔 Telegram ID</span>
-                            <span class="detail-value">{{ app.user_id }}</span>
-                        </div>
-                        <div class="detail-item">
-                            
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from database_service import DatabaseService
+
+PACKAGE_NAMES = {
+    'basic': 'Базовый',
+    'advanced': 'Продвинутый',
+    'premium': 'Премиум'
+}
+
+CSV_HEADER = ['ID', 'Имя', 'Телефон', 'Пакет', 'Telegram ID', 'Статус', 'Дата создания', 'Дата обновления']
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson')
+}
+
+def parse_date(value: str):
+    """Разбирает дату фильтра (YYYY-MM-DD или ISO), пустое значение - None"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+def parse_date_to(value: str):
+    """Разбирает верхнюю границу фильтра (не включая ее).
+
+    Дата без времени (YYYY-MM-DD) означает «по этот день включительно»:
+    граница сдвигается на начало следующего дня. Время (ISO) - граница как есть.
+    """
+    date_to = parse_date(value)
+    if date_to is not None and 'T' not in value and ' ' not in value.strip():
+        date_to += timedelta(days=1)
+    return date_to
+
+def iter_csv(rows, chunk_rows: int = 500):
+    """Формирует CSV по частям: каждые chunk_rows строк отдаются одним куском"""
+    buffer = io.StringIO()
+    # BOM, чтобы Excel правильно открыл кириллицу
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    pending = 0
+    for row in rows:
+        writer.writerow([
+            row.id,
+            row.name,
+            row.phone,
+            PACKAGE_NAMES.get(row.package_interest, row.package_interest or ''),
+            row.user_id,
+            row.status,
+            row.created_at,
+            row.updated_at or ''
+        ])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def iter_ndjson(rows, chunk_rows: int = 500):
+    """Формирует NDJSON (по объекту JSON на строку) по частям"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({
+            'id': row.id,
+            'name': row.name,
+            'phone': row.phone,
+            'package_interest': row.package_interest,
+            'user_id': row.user_id,
+            'status': row.status,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'updated_at': row.updated_at.isoformat() if row.updated_at else None
+        }, ensure_ascii=False))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def gzip_stream(chunks):
+    """Сжимает поток текстовых кусков в gzip на лету"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def prefetch(chunks, description: str = 'экспорт'):
+    """Выполняет запрос и формирует первый кусок до отправки ответа.
+
+    Ошибка запроса возникает здесь, и вызывающий успевает вернуть код ошибки
+    вместо 200 с обрезанным файлом. Ошибка в середине потока логируется и
+    пробрасывается дальше - сервер обрывает соединение без завершающего куска,
+    и клиент видит неполную загрузку, а не «успешный» файл.
+    """
+    first = next(chunks, None)
+
+    def stream():
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        except Exception as e:
+            logging.error(f"Поток «{description}» прерван: {e}")
+            raise
+        finally:
+            chunks.close()
+
+    return stream()
+
+def stream_applications(fmt: str = 'csv', compress: bool = False, date_from: datetime = None,
+                        date_to: datetime = None, status: str = None):
+    """Возвращает (генератор данных, mimetype, имя файла) для экспорта заявок.
+
+    Запрос к БД выполняется сразу: его ошибки выбрасываются отсюда, до ответа.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    rows = DatabaseService.iter_applications(date_from=date_from, date_to=date_to, status=status)
+    chunks = iter_csv(rows) if fmt == 'csv' else iter_ndjson(rows)
+
+    filename = f"applications_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}"
+    if compress:
+        return prefetch(gzip_stream(chunks), 'экспорт заявок'), 'application/gzip', filename + '.gz'
+    return prefetch((chunk.encode('utf-8') for chunk in chunks), 'экспорт заявок'), mimetype, filename
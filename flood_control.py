@@ -0,0 +1,85 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from rate_limit import TokenBucket
+
+class FloodControlMiddleware(BaseMiddleware):
+    """Защита от флуда кнопками и сообщениями (outer-мидлварь).
+
+    Срабатывает до фильтров и хендлеров, поэтому отсеянные апдейты не трогают
+    БД (register_user, log_user_action) и не рисуют экраны (edit_text):
+
+    - пока обрабатывается callback с некоторыми данными, такие же нажатия того
+      же пользователя склеиваются с ним - на них сразу отвечается answer();
+    - у каждого пользователя своя корзина токенов: ``rate`` апдейтов в секунду,
+      до ``burst`` подряд. Лишние callback'и получают короткий answer(),
+      лишние сообщения отбрасываются.
+
+    Корзины хранятся в LRU на ``max_users`` пользователей: вытесненный
+    пользователь просто начинает с полной корзиной.
+    """
+
+    def __init__(self, rate: float = None, burst: float = None, max_users: int = None):
+        self.rate = rate or float(os.getenv('FLOOD_RATE', '2'))
+        self.burst = burst or float(os.getenv('FLOOD_BURST', '5'))
+        self.max_users = max_users or int(os.getenv('FLOOD_MAX_USERS', '10000'))
+        self._buckets = OrderedDict()  # telegram_id -> TokenBucket
+        self._in_flight = set()  # (telegram_id, callback data)
+        self.coalesced = 0
+        self.throttled = 0
+
+    def _bucket(self, telegram_id: int) -> TokenBucket:
+        bucket = self._buckets.get(telegram_id)
+        if bucket is None:
+            bucket = self._buckets[telegram_id] = TokenBucket(self.rate, capacity=self.burst)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(telegram_id)
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return await handler(event, data)
+
+        is_callback = isinstance(event, CallbackQuery)
+        key = (user.id, event.data) if is_callback else None
+        if key is not None and key in self._in_flight:
+            self.coalesced += 1
+            await self._answer(event)
+            return None
+
+        if not self._bucket(user.id).try_acquire():
+            self.throttled += 1
+            if self.throttled % 100 == 1:
+                logging.warning(f"⏳ Флуд от пользователя {user.id}: апдейты отбрасываются")
+            if is_callback:
+                await self._answer(event, "⏳ Не так быстро")
+            return None
+
+        if key is None:
+            return await handler(event, data)
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
+
+    @staticmethod
+    async def _answer(callback: CallbackQuery, text: str = None):
+        """Убирает «часики» на кнопке; ошибка ответа не важна"""
+        try:
+            await callback.answer(text)
+        except Exception as e:
+            logging.debug(f"Не удалось ответить на callback {callback.id}: {e}")
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import JSON, select, func, delete, insert, case, cast, union_all, literal_column
+
+from models import BotMetrics, FunnelDaily, AsyncSessionLocal
+from metrics_store import FUNNEL_LOCK_KEY, day_start, get_watermark, set_watermark, try_job_lock
+
+FUNNEL_WATERMARK = 'funnel_daily'
+
+# Этапы воронки в порядке прохождения: (этап, действие в bot_metrics, название)
+FUNNEL_STAGES = [
+    ('start', 'start', 'Запуск бота'),
+    ('packages', 'view_packages', 'Просмотр пакетов'),
+    ('details', 'view_package_details', 'Детали пакета'),
+    ('contact', 'start_contact_form', 'Начало заявки'),
+    ('submit', 'submit_application', 'Заявка отправлена'),
+]
+
+# Этапы, для которых известен пакет (воронка по пакетам начинается с деталей)
+PACKAGE_STAGES = ['details', 'contact', 'submit']
+
+ALL_PACKAGES = '*'
+
+# События из буфера метрик приходят с задержкой в секунды; с запасом
+# пересчитываем день, в который попадает водяной знак
+LATE_EVENTS_GRACE = timedelta(minutes=10)
+
+def _sql_string(value: str):
+    # Константы - SQL-литералы, а не параметры: выражения в SELECT и GROUP BY
+    # должны совпадать, а asyncpg не выводит тип параметров внутри UNION
+    return literal_column(f"'{value}'")
+
+def _json_field(column, key: str, dialect_name: str):
+    """Значение ключа из JSON, хранящегося в текстовой колонке"""
+    if dialect_name == 'postgresql':
+        return cast(column, JSON).op('->>')(_sql_string(key))
+    return func.json_extract(column, _sql_string(f'$.{key}'))
+
+def build_funnel_day_insert(day: datetime, dialect_name: str):
+    """INSERT ... SELECT счетчиков воронки за один день (все пакеты и по пакетам)"""
+    stage = case(*[
+        (BotMetrics.action == _sql_string(action), _sql_string(name))
+        for name, action, _ in FUNNEL_STAGES
+    ])
+    package = func.coalesce(
+        _json_field(BotMetrics.data, 'package', dialect_name),
+        _json_field(BotMetrics.data, 'package_interest', dialect_name)
+    )
+    in_day = (
+        BotMetrics.created_at >= day,
+        BotMetrics.created_at < day + timedelta(days=1),
+        BotMetrics.action.in_([action for _, action, _ in FUNNEL_STAGES])
+    )
+    # В SQLite дата хранится строкой, в PostgreSQL нужен явный тип date
+    if dialect_name == 'postgresql':
+        day_value = literal_column(f"DATE '{day:%Y-%m-%d}'")
+    else:
+        day_value = _sql_string(f'{day:%Y-%m-%d}')
+    total = (
+        select(day_value, _sql_string(ALL_PACKAGES), stage,
+               func.count(func.distinct(BotMetrics.telegram_id)), func.count(BotMetrics.id))
+        .where(*in_day)
+        .group_by(stage)
+    )
+    per_package = (
+        select(day_value, package, stage,
+               func.count(func.distinct(BotMetrics.telegram_id)), func.count(BotMetrics.id))
+        .where(*in_day, package.is_not(None))
+        .group_by(package, stage)
+    )
+    return insert(FunnelDaily).from_select(
+        ['day', 'package', 'stage', 'users', 'events'], union_all(total, per_package)
+    )
+
+def build_funnel_query(since: datetime):
+    """Суммы воронки по пакетам и этапам начиная с дня since"""
+    return (
+        select(FunnelDaily.package, FunnelDaily.stage,
+               func.sum(FunnelDaily.users), func.sum(FunnelDaily.events))
+        .where(FunnelDaily.day >= since.date())
+        .group_by(FunnelDaily.package, FunnelDaily.stage)
+    )
+
+def _stage_rows(counts: dict, stages: list) -> list:
+    rows = []
+    first_users = None
+    previous_users = None
+    for name, _, title in FUNNEL_STAGES:
+        if name not in stages:
+            continue
+        users, events = counts.get(name, (0, 0))
+        if first_users is None:
+            first_users = users
+        rows.append({
+            'stage': name,
+            'title': title,
+            'users': users,
+            'events': events,
+            'conversion': round(users * 100 / previous_users, 1) if previous_users else None,
+            'overall': round(users * 100 / first_users, 1) if first_users else None
+        })
+        previous_users = users
+    return rows
+
+def summarize_funnel(rows) -> dict:
+    """Воронка целиком и по пакетам с конверсией между этапами, %.
+
+    users за период - сумма дневных уникальных пользователей (человеко-дни).
+    """
+    by_package = {}
+    for package, stage, users, events in rows:
+        by_package.setdefault(package, {})[stage] = (int(users or 0), int(events or 0))
+
+    overall = by_package.pop(ALL_PACKAGES, {})
+    return {
+        'overall': _stage_rows(overall, [name for name, _, _ in FUNNEL_STAGES]),
+        'by_package': {
+            package: _stage_rows(counts, PACKAGE_STAGES)
+            for package, counts in sorted(by_package.items())
+        }
+    }
+
+class FunnelRollup:
+    """Инкрементальная свертка воронки в funnel_daily.
+
+    Каждый проход пересчитывает только дни от водяного знака до текущего
+    момента (обычно - только сегодня) целиком из сырых событий, поэтому
+    число уникальных пользователей остается точным, а повтор безопасен.
+    Каждый день пересчитывается под advisory-lock: пока проход выполняет
+    один воркер, остальные его пропускают.
+    """
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or float(os.getenv('FUNNEL_ROLLUP_INTERVAL', '60'))
+        self._task = None
+
+    def start(self):
+        """Запускает периодическую свертку"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Ошибка свертки воронки: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Пересчитывает дни начиная с водяного знака, возвращает их число"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            watermark = await get_watermark(db, FUNNEL_WATERMARK)
+            if watermark is None:
+                watermark = await db.scalar(select(func.min(BotMetrics.created_at)))
+                if watermark is None:
+                    return 0
+
+        day = day_start(watermark)
+        days = 0
+        while day <= now:
+            async with AsyncSessionLocal() as db:
+                if not await try_job_lock(db, FUNNEL_LOCK_KEY):
+                    logging.info("Свертку воронки выполняет другой воркер")
+                    return days
+                dialect_name = db.bind.dialect.name
+                await db.execute(delete(FunnelDaily).where(FunnelDaily.day == day.date()))
+                await db.execute(build_funnel_day_insert(day, dialect_name))
+                # Водяной знак не дальше now - grace: поздние события этого дня
+                # попадут в следующий пересчет
+                await set_watermark(db, FUNNEL_WATERMARK, min(day + timedelta(days=1), now - LATE_EVENTS_GRACE))
+                await db.commit()
+            day += timedelta(days=1)
+            days += 1
+        return days
+
+    async def close(self):
+        """Останавливает фоновую задачу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,305 @@
+"""
+Метрики процесса в формате Prometheus (text exposition 0.0.4).
+
+Счетчики, гистограммы и gauge-метрики живут в памяти процесса; render()
+отдает их текстом для эндпоинта /metrics. Бот отдает /metrics со своего
+aiohttp-сервера (см. bot_instrumentation.py), веб-админки - через
+instrument_flask(app). Модуль не зависит ни от aiogram, ни от Flask и
+импортируется админками без лишней нагрузки на старт.
+"""
+
+import hmac
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Токен доступа к /metrics (Authorization: Bearer <токен>); без него и бот,
+# и админки принимают ADMIN_PASSWORD
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Сколько секунд держать размер outbox между опросами /metrics
+OUTBOX_BACKLOG_TTL = float(os.getenv('OUTBOX_BACKLOG_TTL', '15'))
+
+# Границы гистограмм времени (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы гистограмм числа SQL-запросов на апдейт/запрос
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+
+_registry = []
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._functions = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labels}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def set_function(self, function, **labels):
+        """Значение вычисляется функцией при каждом чтении /metrics"""
+        self._functions[self._key(labels)] = function
+
+    def _samples(self) -> list:
+        with self._lock:
+            samples = list(self._values.items())
+        for key, function in list(self._functions.items()):
+            try:
+                samples.append((key, function()))
+            except Exception:
+                continue
+        return samples
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self._samples()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            samples = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in sorted(samples):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# --- Общие метрики ---------------------------------------------------------
+
+DB_QUERIES = Counter('db_queries_total', 'SQL-запросы процесса')
+DB_QUERY_SECONDS = Histogram('db_query_seconds', 'Время выполнения SQL-запроса')
+
+# --- Бот ---------------------------------------------------------------------
+
+BOT_UPDATES = Counter('bot_updates_total', 'Обработанные апдейты по хендлерам', ('handler', 'status'))
+BOT_HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Время обработки апдейта хендлером', ('handler',))
+BOT_UPDATE_DB_QUERIES = Histogram('bot_update_db_queries', 'SQL-запросов на апдейт', ('handler',),
+                                  buckets=QUERY_COUNT_BUCKETS)
+BOT_UPDATE_DB_SECONDS = Histogram('bot_update_db_seconds', 'Время SQL-запросов на апдейт', ('handler',))
+BOT_DROPPED_UPDATES = Counter('bot_dropped_updates_total', 'Апдейты, отсеянные флуд-контролем', ('reason',))
+BOT_SKIPPED_RENDERS = Counter('bot_skipped_renders_total', 'edit_text, пропущенные кэшем отрисовки')
+TELEGRAM_API_SECONDS = Histogram('telegram_api_seconds', 'Время вызова Bot API', ('method',))
+TELEGRAM_API_ERRORS = Counter('telegram_api_errors_total', 'Ошибки вызовов Bot API', ('method', 'error'))
+NOTIFICATIONS = Counter('notifications_total', 'Попытки доставки уведомлений о заявках', ('channel', 'outcome'))
+BROADCAST_MESSAGES = Counter('broadcast_messages_total', 'Сообщения рассылок', ('outcome',))
+QUEUE_DEPTH = Gauge('queue_depth', 'Размер очередей в памяти процесса', ('queue',))
+
+# --- Веб-админки ---------------------------------------------------------------
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP-запросы админки', ('endpoint', 'status'))
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'Время обработки HTTP-запроса', ('endpoint',))
+HTTP_REQUEST_DB_QUERIES = Histogram('http_request_db_queries', 'SQL-запросов на HTTP-запрос', ('endpoint',),
+                                    buckets=QUERY_COUNT_BUCKETS)
+OUTBOX_BACKLOG = Gauge('notification_outbox', 'Уведомления в outbox по статусам', ('status',))
+
+# --- SQL-запросы -------------------------------------------------------------
+
+class QueryStats:
+    """Счетчик SQL-запросов текущего апдейта или HTTP-запроса"""
+
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+current_query_stats = ContextVar('current_query_stats', default=None)
+
+_sqlalchemy_instrumented = False
+
+def instrument_sqlalchemy():
+    """Считает запросы всех движков SQLAlchemy процесса (включая созданные позже)"""
+    global _sqlalchemy_instrumented
+    if _sqlalchemy_instrumented:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        _record_query(time.perf_counter() - started)
+
+    @event.listens_for(Engine, 'handle_error')
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_started'):
+            started = connection.info['query_started'].pop()
+            _record_query(time.perf_counter() - started)
+
+    _sqlalchemy_instrumented = True
+
+def _record_query(seconds: float):
+    DB_QUERIES.inc()
+    DB_QUERY_SECONDS.observe(seconds)
+    # Контекст задачи апдейта/запроса доходит и до greenlet асинхронного движка
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += seconds
+
+# --- Доступ -------------------------------------------------------------------
+
+def metrics_token() -> str:
+    """Токен /metrics: METRICS_TOKEN, а если он не задан - ADMIN_PASSWORD"""
+    return METRICS_TOKEN or os.getenv('ADMIN_PASSWORD', 'admin123')
+
+def metrics_authorized(authorization: str = None, password: str = None, token: str = None) -> bool:
+    """Проверяет заголовок Authorization: Bearer <токен> или ?password=<токен>"""
+    token = token or metrics_token()
+    if not token:
+        return False
+    supplied = password
+    if authorization and authorization.startswith('Bearer '):
+        supplied = authorization[len('Bearer '):].strip()
+    return supplied is not None and hmac.compare_digest(supplied.encode(), token.encode())
+
+# --- Flask ---------------------------------------------------------------------
+
+def instrument_flask(app):
+    """Метрики HTTP-запросов и эндпоинт /metrics для Flask-админки"""
+    from flask import Response, abort, g, request
+
+    token = metrics_token()
+
+    instrument_sqlalchemy()
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_stats = QueryStats()
+        g.metrics_token = current_query_stats.set(g.metrics_stats)
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unknown'
+            HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+            HTTP_REQUEST_DB_QUERIES.observe(g.metrics_stats.queries, endpoint=endpoint)
+        return response
+
+    @app.teardown_request
+    def reset_request_metrics(exc):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            current_query_stats.reset(token)
+
+    @app.route('/metrics')
+    def metrics():
+        """Метрики процесса для Prometheus"""
+        if not metrics_authorized(request.headers.get('Authorization'), request.args.get('password'), token):
+            abort(401)
+        _refresh_outbox_backlog()
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    return app
+
+# Незавершенные статусы: отправленные строки не удаляются, их не считаем
+OUTBOX_BACKLOG_STATUSES = ('pending', 'processing', 'failed')
+_outbox_backlog_refreshed = 0.0
+_outbox_backlog_lock = threading.Lock()
+
+def _refresh_outbox_backlog():
+    """Размер очереди уведомлений по незавершенным статусам, не чаще раза в OUTBOX_BACKLOG_TTL"""
+    global _outbox_backlog_refreshed
+    with _outbox_backlog_lock:
+        if time.monotonic() - _outbox_backlog_refreshed < OUTBOX_BACKLOG_TTL:
+            return
+        _outbox_backlog_refreshed = time.monotonic()
+    try:
+        from sqlalchemy import func, select
+        from models import NotificationOutbox, SessionLocal
+        db = SessionLocal()
+        try:
+            # Идет по индексу (status, next_attempt_at)
+            rows = db.execute(
+                select(NotificationOutbox.status, func.count(NotificationOutbox.id))
+                .where(NotificationOutbox.status.in_(OUTBOX_BACKLOG_STATUSES))
+                .group_by(NotificationOutbox.status)
+            ).all()
+        finally:
+            db.close()
+    except Exception:
+        return
+    counts = dict(rows)
+    for status in OUTBOX_BACKLOG_STATUSES:
+        OUTBOX_BACKLOG.set(counts.get(status, 0), status=status)
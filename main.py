@@ -1,17 +1,31 @@
 import asyncio
 import logging
 import os
+from collections import namedtuple
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import CommandStart, Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Импорт наших модулей
-from models import create_tables
-from database_service import DatabaseService
+from models import create_tables, dispose_engines
+from async_database_service import AsyncDatabaseService, after_commit, commit_unit, rollback_unit
+from db_middleware import DbSessionMiddleware
+from bot_instrumentation import HandlerMetricsMiddleware, TelegramApiMetrics, start_metrics_server
+from instrumentation import BOT_DROPPED_UPDATES, BOT_SKIPPED_RENDERS, QUEUE_DEPTH
+from flood_control import FloodControlMiddleware
+from render_cache import RenderCache
+from metrics_buffer import MetricsBuffer
+from metrics_store import MetricsRetention
+from funnel import FunnelRollup
+from user_cache import UserCache
+from db_storage import DatabaseStorage
+from outbox import OutboxDispatcher
+from broadcast import BroadcastEngine
+from unreachable_users import UnreachableUsers
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -23,19 +37,46 @@ MANAGER_PHONE = os.getenv('MANAGER_PHONE', '+7 (981) 685-36-38')
 MANAGER_EMAIL_CONTACT = os.getenv('MANAGER_EMAIL_CONTACT', 'info@ai-solutions.ru')
 WORK_HOURS = os.getenv('WORK_HOURS', 'ПН-ПТ с 9:00 до 18:00 МСК')
 TELEGRAM_MANAGER = os.getenv('TELEGRAM_MANAGER', '@yourusername')
+BOT_MODE = os.getenv('BOT_MODE', 'polling')  # polling или webhook
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения")
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+storage = DatabaseStorage()
 dp = Dispatcher(storage=storage)
 
+# Флуд-контроль до фильтров и хендлеров: повторные нажатия и всплески отсеиваются без БД
+flood_control = FloodControlMiddleware()
+dp.message.outer_middleware(flood_control)
+dp.callback_query.outer_middleware(flood_control)
+
+# Метрики хендлеров (/metrics); раньше сессии БД, чтобы в замер попал коммит
+handler_metrics = HandlerMetricsMiddleware()
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+bot.session.middleware(TelegramApiMetrics())
+
+# Сессия БД на апдейт: хендлеры получают ее аргументом db, коммит - один в конце
+dp.message.middleware(DbSessionMiddleware())
+dp.callback_query.middleware(DbSessionMiddleware())
+
+# Буфер действий пользователей: пишет BotMetrics пачками в фоне
+metrics_buffer = MetricsBuffer()
+metrics_retention = MetricsRetention()
+funnel_rollup = FunnelRollup()
+
+# Кэш зарегистрированных пользователей: БД трогаем только при промахе или изменении данных
+user_cache = UserCache()
+
+# Последнее содержимое меню-сообщений: повторная отрисовка того же экрана не идет в API
+render_cache = RenderCache()
+
 # Инициализация сервиса уведомлений
 try:
     from notification_service import NotificationService
-    notification_service = NotificationService()
+    notification_service = NotificationService(bot=bot)
     NOTIFICATIONS_AVAILABLE = True
     print("✅ Сервис уведомлений подключен")
 except ImportError:
@@ -47,12 +88,39 @@ except ImportError:
             print(f"🔔 [MOCK] Уведомление: Новая заявка #{data['id']} - {data['name']}")
             return {"telegram": False, "email": False}
         
+        def enabled_channels(self):
+            return ['mock']
+        
+        async def deliver(self, channel, data):
+            await self.send_all_notifications(data)
+        
         async def send_daily_report(self):
             print("📊 [MOCK] Ежедневный отчет")
             return False
+        
+        async def close(self):
+            pass
     
     notification_service = MockNotificationService()
 
+# Очередь уведомлений: заявки доставляются из таблицы outbox с повторами
+outbox = OutboxDispatcher(notification_service)
+
+# Рассылки по пользователям с лимитами Telegram и контрольными точками
+broadcast_engine = BroadcastEngine(bot)
+
+# Пользователи, заблокировавшие бота, отключаются (is_active = False) пачками
+unreachable_users = UnreachableUsers(user_cache)
+bot.session.middleware(unreachable_users)
+
+# Очереди в памяти и работа защитных кэшей - для /metrics
+QUEUE_DEPTH.set_function(lambda: len(metrics_buffer), queue='metrics_buffer')
+QUEUE_DEPTH.set_function(storage.pending_writes, queue='fsm_writes')
+QUEUE_DEPTH.set_function(lambda: len(unreachable_users), queue='unreachable_users')
+BOT_DROPPED_UPDATES.set_function(lambda: flood_control.coalesced, reason='coalesced')
+BOT_DROPPED_UPDATES.set_function(lambda: flood_control.throttled, reason='throttled')
+BOT_SKIPPED_RENDERS.set_function(lambda: render_cache.skipped)
+
 # Состояния для FSM
 class ContactForm(StatesGroup):
     waiting_for_name = State()
@@ -128,7 +196,10 @@ DEVELOPMENT_STAGES = [
     "4️⃣ **Запуск (1 день)**: Запускаем бота, обучаем вашу команду работе с системой."
 ]
 
-def get_main_menu():
+# Готовый экран: текст, клавиатура и отпечаток для кэша отрисовки
+Screen = namedtuple('Screen', ['text', 'markup', 'fingerprint'], defaults=(None,))
+
+def build_main_menu():
     """Создает главное меню бота"""
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="📦 Пакеты услуг", callback_data="packages"))
@@ -139,7 +210,7 @@ def get_main_menu():
     builder.adjust(1)
     return builder.as_markup()
 
-def get_packages_menu():
+def build_packages_menu():
     """Создает меню выбора пакетов"""
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="🚀 Старт (20 000₽)", callback_data="package_start"))
@@ -150,13 +221,13 @@ def get_packages_menu():
     builder.adjust(1)
     return builder.as_markup()
 
-def get_back_menu():
+def build_back_menu():
     """Создает меню с кнопкой назад"""
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
     return builder.as_markup()
 
-def get_contact_menu():
+def build_contact_menu():
     """Создает меню для раздела заявки"""
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="📞 Оставить контакт", callback_data="start_contact"))
@@ -164,27 +235,262 @@ def get_contact_menu():
     builder.adjust(1)
     return builder.as_markup()
 
+def build_manager_contact_screen():
+    """Экран контактов менеджера"""
+    contact_text = (
+        f"👨‍💻 **ПРЯМАЯ СВЯЗЬ С МЕНЕДЖЕРОМ**\n\n"
+        
+        f"📱 **Telegram**: {TELEGRAM_MANAGER}\n"
+        f"📞 **Телефон**: {MANAGER_PHONE}\n"
+        f"📧 **Email**: {MANAGER_EMAIL_CONTACT}\n\n"
+        
+        f"⏰ **Рабочее время**: {WORK_HOURS}\n\n"
+        
+        "🚀 **При обращении напишите:**\n"
+        "• Что вас интересует (пакет, функционал)\n"
+        "• Ваша сфера деятельности\n"
+        "• Примерный бюджет\n\n"
+        
+        "⚡ **Ответим в течение 1 часа в рабочее время!**"
+    )
+    
+    builder = InlineKeyboardBuilder()
+    manager_username = TELEGRAM_MANAGER.replace('@', '')
+    builder.add(InlineKeyboardButton(text=f"💬 Написать {TELEGRAM_MANAGER}", url=f"https://t.me/{manager_username}"))
+    builder.add(InlineKeyboardButton(text="📝 Оставить заявку через бота", callback_data="quick_contact"))
+    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
+    builder.adjust(1)
+    
+    return Screen(contact_text, builder.as_markup())
+
+def build_about_screen():
+    """Экран «О компании»"""
+    about_text = (
+        f"💼 **О КОМПАНИИ {COMPANY_NAME.upper()}**\n\n"
+        
+        "🎯 **Наша специализация:**\n"
+        "• Разработка Telegram-ботов любой сложности\n"
+        "• Интеграция с CRM, базами данных, API\n"
+        "• ИИ-консультанты и чат-боты\n"
+        "• Автоматизация бизнес-процессов\n\n"
+        
+        "📊 **Наши показатели:**\n"
+        "• 50+ успешных проектов\n"
+        "• Средняя окупаемость бота: 1-3 месяца\n"
+        "• Поддержка 24/7\n"
+        "• 100% выполнение в срок\n\n"
+        
+        "🛠 **Технологии:**\n"
+        "• Python, aiogram, FastAPI\n"
+        "• PostgreSQL, MongoDB\n"
+        "• OpenAI GPT, Claude, Gemini\n"
+        "• Docker, VPS\n\n"
+        
+        "✨ **Почему выбирают нас:**\n"
+        "• Бесплатная консультация\n"
+        "• Фиксированная стоимость\n"
+        "• Гарантия на все работы\n"
+        "• Обучение вашей команды"
+    )
+    
+    return Screen(about_text, build_back_menu())
+
+def build_packages_screen():
+    """Экран списка пакетов"""
+    packages_text = (
+        "📦 **Наши пакеты услуг**\n\n"
+        "Выберите оптимальный пакет для вашего бизнеса.\n"
+        "Все боты окупаются за 1-3 месяца! 💰\n\n"
+        "**Какой пакет вас интересует?**"
+    )
+    
+    return Screen(packages_text, build_packages_menu())
+
+def build_package_screen(package_type: str, package: dict):
+    """Экран с деталями пакета"""
+    features_text = "\n".join(package["features"])
+    
+    package_text = (
+        f"💼 **{package['name']}**\n\n"
+        f"💰 **Стоимость**: {package['price']}\n"
+        f"⏱ **Срок разработки**: {package['timeline']}\n\n"
+        f"**Что входит:**\n{features_text}\n\n"
+        f"📝 {package['description']}\n\n"
+        f"**Хотите узнать больше или оставить заявку?**"
+    )
+    
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="📝 Оставить заявку", callback_data=f"contact_package_{package_type}"))
+    builder.add(InlineKeyboardButton(text="💬 Связаться напрямую", callback_data="manager_contact"))
+    builder.add(InlineKeyboardButton(text="📦 Другие пакеты", callback_data="packages"))
+    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
+    builder.adjust(1)
+    
+    return Screen(package_text, builder.as_markup())
+
+def build_stages_screen():
+    """Экран этапов разработки"""
+    stages_text = (
+        "🔧 **Этапы разработки чат-бота**\n\n"
+        "**Стандартный срок разработки — 7 рабочих дней** ⚡\n\n"
+    )
+    
+    stages_text += "\n\n".join(DEVELOPMENT_STAGES)
+    
+    stages_text += (
+        "\n\n✨ **От идеи до работающего бота — всего неделя!**\n"
+        "💎 Консультация и расчет стоимости — **бесплатно**"
+    )
+    
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="📦 Посмотреть пакеты", callback_data="packages"))
+    builder.add(InlineKeyboardButton(text="📝 Оставить заявку", callback_data="quick_contact"))
+    builder.add(InlineKeyboardButton(text="💬 Связаться напрямую", callback_data="manager_contact"))
+    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
+    builder.adjust(1)
+    
+    return Screen(stages_text, builder.as_markup())
+
+def build_contact_request_screen(has_application: bool, package_interest: str = None):
+    """Экран перед оставлением заявки"""
+    if has_application:
+        contact_text = (
+            "📋 **У вас уже есть активная заявка!**\n\n"
+            "Наш менеджер обязательно с вами свяжется в рабочее время.\n"
+            "Если хотите обновить данные или уточнить детали, "
+            "можете оставить новую заявку.\n\n"
+            f"⏰ **Рабочее время**: {WORK_HOURS}\n\n"
+            "**Хотите оставить новую заявку?**"
+        )
+    else:
+        contact_text = (
+            "📝 **Оставить заявку**\n\n"
+            "Для оформления заявки нам понадобятся ваши контактные данные.\n"
+            "Наш менеджер свяжется с вами в рабочее время для:\n\n"
+            "• 💰 Расчета точной стоимости проекта\n"
+            "• 📋 Обсуждения технических деталей\n"
+            "• ⏱ Согласования сроков разработки\n"
+            "• 🎯 Составления индивидуального предложения\n\n"
+        )
+        
+        if package_interest:
+            package_name = PACKAGES_DATA.get(package_interest, {}).get("name", "")
+            contact_text += f"📦 **Интересующий пакет**: {package_name}\n\n"
+        
+        contact_text += f"⏰ **Рабочее время**: {WORK_HOURS}\n\n**Готовы оставить контакт?**"
+    
+    builder = InlineKeyboardBuilder()
+    button_text = "📞 Обновить контакт" if has_application else "📞 Оставить контакт"
+    builder.add(InlineKeyboardButton(text=button_text, callback_data="start_contact"))
+    builder.add(InlineKeyboardButton(text="💬 Связаться напрямую", callback_data="manager_contact"))
+    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
+    builder.adjust(1)
+    
+    return Screen(contact_text, builder.as_markup())
+
+def build_screens() -> dict:
+    """Собирает все статические экраны: тексты и клавиатуры"""
+    main_menu = build_main_menu()
+    
+    screens = {
+        'main_menu': Screen(
+            "🤖 **Главное меню**\n\n"
+            "Выберите интересующий вас раздел:",
+            main_menu
+        ),
+        'unknown': Screen(
+            "🤔 Извините, я не понимаю эту команду.\n\n"
+            "Я могу помочь вам:\n"
+            "• 📦 Узнать о пакетах услуг\n"
+            "• 🔧 Изучить этапы разработки\n" 
+            "• 📝 Оставить заявку на разработку бота\n"
+            "• 💬 Связаться с менеджером напрямую\n\n"
+            "**Выберите нужный раздел:**",
+            main_menu
+        ),
+        'contact_name': Screen(
+            "👤 **Как к вам обращаться?**\n\n"
+            "Напишите ваше имя:",
+            None
+        ),
+        'packages': build_packages_screen(),
+        'stages': build_stages_screen(),
+        'about': build_about_screen(),
+        'manager_contact': build_manager_contact_screen(),
+        'back_menu': Screen(None, build_back_menu()),
+        'contact_menu': Screen(None, build_contact_menu()),
+    }
+    
+    for package_type, package in PACKAGES_DATA.items():
+        screens[f"package_{package_type}"] = build_package_screen(package_type, package)
+    
+    for has_application in (False, True):
+        for package_interest in (None, *PACKAGES_DATA):
+            screens[("contact", has_application, package_interest)] = (
+                build_contact_request_screen(has_application, package_interest)
+            )
+    
+    # Отпечаток (сериализация клавиатуры) считается один раз, а не на каждое нажатие
+    return {
+        name: screen._replace(fingerprint=RenderCache.fingerprint(screen.text, screen.markup, "Markdown"))
+        for name, screen in screens.items()
+    }
+
+# Кэш экранов: собирается один раз при запуске, дальше отдаются готовые
+# (неизменяемые) объекты клавиатур без пересборки на каждый апдейт
+SCREENS = build_screens()
+
+def reload_screens():
+    """Пересобирает кэш экранов (после изменения настроек или PACKAGES_DATA)"""
+    SCREENS.clear()
+    SCREENS.update(build_screens())
+
+def get_main_menu():
+    """Возвращает главное меню бота"""
+    return SCREENS['main_menu'].markup
+
+def get_packages_menu():
+    """Возвращает меню выбора пакетов"""
+    return SCREENS['packages'].markup
+
+def get_back_menu():
+    """Возвращает меню с кнопкой назад"""
+    return SCREENS['back_menu'].markup
+
+def get_contact_menu():
+    """Возвращает меню для раздела заявки"""
+    return SCREENS['contact_menu'].markup
+
 def is_admin_chat(chat_id: int) -> bool:
     """Проверяет, является ли чат админским"""
     admin_chat_id = os.getenv('ADMIN_CHAT_ID')
     return admin_chat_id and str(chat_id) == admin_chat_id
 
-async def register_user(message_or_callback):
+async def register_user(message_or_callback, db: AsyncSession = None):
     """Регистрирует или обновляет пользователя в базе данных"""
     user = message_or_callback.from_user
-    DatabaseService.get_or_create_user(
+    # Пользователь пишет боту - значит, доступен, даже если недавно не был
+    unreachable_users.seen(user.id)
+    fingerprint = UserCache.fingerprint(user.username, user.first_name, user.last_name)
+    if user_cache.is_fresh(user.id, fingerprint):
+        return
+    
+    await AsyncDatabaseService.get_or_create_user(
         telegram_id=user.id,
         username=user.username,
         first_name=user.first_name,
-        last_name=user.last_name
+        last_name=user.last_name,
+        db=db
     )
+    # В кэш - только после коммита, иначе откат оставит его рассинхронизированным
+    after_commit(db, lambda: user_cache.remember(user.id, fingerprint))
 
 @dp.message(CommandStart())
-async def start_handler(message: types.Message):
+async def start_handler(message: types.Message, db: AsyncSession):
     """Обработчик команды /start"""
-    await register_user(message)
+    await register_user(message, db)
     
-    DatabaseService.log_user_action(
+    metrics_buffer.log(
         telegram_id=message.from_user.id,
         action="start"
     )
@@ -236,35 +542,81 @@ async def admin_commands(message: types.Message):
             "/stats - Статистика заявок\n"
             "/report - Отчет за сегодня\n"
             "/getchatid - Получить ID чата\n"
-            "/test - Тест уведомлений\n\n"
+            "/test - Тест уведомлений\n"
+            "/broadcast - Рассылка всем пользователям\n"
+            "/broadcast\\_cancel - Остановить рассылку\n\n"
             "🔗 Веб-админка доступна по IP сервера"
         )
         await message.answer(admin_text, parse_mode="Markdown")
 
+@dp.message(Command("broadcast"))
+async def start_broadcast(message: types.Message, state: FSMContext):
+    """Начинает создание рассылки (только для админ чата)"""
+    if not is_admin_chat(message.chat.id):
+        return
+    await state.set_state(AdminCommands.waiting_for_broadcast_message)
+    await message.answer(
+        "📣 Отправьте текст рассылки одним сообщением (форматирование сохранится).\n"
+        "Для отмены - /cancel"
+    )
+
+@dp.message(AdminCommands.waiting_for_broadcast_message)
+async def create_broadcast(message: types.Message, state: FSMContext):
+    """Создает рассылку из присланного админом сообщения"""
+    await state.clear()
+    # Любая команда (/cancel и т.п.) отменяет создание, а не уходит в рассылку
+    if not is_admin_chat(message.chat.id) or (message.text or '').startswith('/'):
+        await message.answer("❌ Рассылка отменена")
+        return
+    if not message.text:
+        await message.answer("⚠️ Поддерживаются только текстовые рассылки. Начните заново: /broadcast")
+        return
+    
+    broadcast = await AsyncDatabaseService.create_broadcast(message.html_text, message.chat.id)
+    broadcast_engine.wake()
+    await message.answer(
+        f"✅ Рассылка #{broadcast.id} создана: {broadcast.total} получателей.\n"
+        "Прогресс появится в этом чате. Остановить - /broadcast_cancel"
+    )
+
+@dp.message(Command("broadcast_cancel"))
+async def cancel_broadcast(message: types.Message):
+    """Останавливает незавершенные рассылки"""
+    if is_admin_chat(message.chat.id):
+        cancelled = await AsyncDatabaseService.cancel_broadcasts()
+        await message.answer(f"⛔ Остановлено рассылок: {cancelled}" if cancelled else "ℹ️ Активных рассылок нет")
+
 @dp.message(Command("stats"))
 async def admin_stats(message: types.Message):
     """Статистика для админа"""
     if is_admin_chat(message.chat.id):
         try:
-            total_apps = DatabaseService.get_applications_count()
-            recent_apps = DatabaseService.get_recent_applications(limit=10)
+            stats = await AsyncDatabaseService.get_summary_stats()
+            total_apps = stats['total_applications']
             
             package_stats = {'start': 0, 'business': 0, 'professional': 0, 'corporate': 0, 'none': 0}
-            for app in recent_apps:
-                if app.package_interest:
-                    package_stats[app.package_interest] = package_stats.get(app.package_interest, 0) + 1
-                else:
-                    package_stats['none'] += 1
+            package_stats.update(stats['by_package'])
+            
+            funnel = await AsyncDatabaseService.get_funnel(days=7)
+            funnel_text = "\n".join(
+                f"• {row['title']}: {row['users']}"
+                + (f" ({row['conversion']}%)" if row['conversion'] is not None else "")
+                for row in funnel['overall']
+            )
             
             stats_text = (
                 f"📊 **СТАТИСТИКА БОТА**\n\n"
-                f"📋 **Всего заявок**: {total_apps}\n\n"
+                f"📋 **Всего заявок**: {total_apps}\n"
+                f"🆕 **Новых**: {stats['new_applications']}\n"
+                f"📅 **За сегодня**: {stats['today_applications']}\n"
+                f"👥 **Пользователей**: {stats['total_users']}\n\n"
                 f"📦 **По пакетам**:\n"
                 f"• Старт: {package_stats['start']}\n"
                 f"• Бизнес: {package_stats['business']}\n"
                 f"• Профи: {package_stats['professional']}\n"
                 f"• Корпоративный: {package_stats['corporate']}\n"
                 f"• Без пакета: {package_stats['none']}\n\n"
+                f"🔻 **Воронка за 7 дней**:\n{funnel_text}\n\n"
                 f"🔔 **Уведомления**: {'✅ Включены' if NOTIFICATIONS_AVAILABLE else '❌ Отключены'}"
             )
             
@@ -273,310 +625,160 @@ async def admin_stats(message: types.Message):
             await message.answer(f"❌ Ошибка получения статистики: {e}")
 
 @dp.callback_query(F.data == "back_to_main")
-async def back_to_main(callback: types.CallbackQuery):
+async def back_to_main(callback: types.CallbackQuery, db: AsyncSession):
     """Возврат в главное меню"""
-    await register_user(callback)
-    
-    welcome_text = (
-        "🤖 **Главное меню**\n\n"
-        "Выберите интересующий вас раздел:"
-    )
+    await register_user(callback, db)
     
-    await callback.message.edit_text(
-        welcome_text,
-        reply_markup=get_main_menu(),
-        parse_mode="Markdown"
-    )
+    screen = SCREENS['main_menu']
+    await render_cache.edit(callback.message, screen.text, screen.markup, parse_mode="Markdown",
+                            fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.callback_query(F.data == "manager_contact")
-async def show_manager_contact(callback: types.CallbackQuery):
+async def show_manager_contact(callback: types.CallbackQuery, db: AsyncSession):
     """Показывает контакты менеджера"""
-    await register_user(callback)
+    await register_user(callback, db)
     
-    DatabaseService.log_user_action(
+    metrics_buffer.log(
         telegram_id=callback.from_user.id,
         action="view_manager_contact"
     )
     
-    contact_text = (
-        f"👨‍💻 **ПРЯМАЯ СВЯЗЬ С МЕНЕДЖЕРОМ**\n\n"
-        
-        f"📱 **Telegram**: {TELEGRAM_MANAGER}\n"
-        f"📞 **Телефон**: {MANAGER_PHONE}\n"
-        f"📧 **Email**: {MANAGER_EMAIL_CONTACT}\n\n"
-        
-        f"⏰ **Рабочее время**: {WORK_HOURS}\n\n"
-        
-        "🚀 **При обращении напишите:**\n"
-        "• Что вас интересует (пакет, функционал)\n"
-        "• Ваша сфера деятельности\n"
-        "• Примерный бюджет\n\n"
-        
-        "⚡ **Ответим в течение 1 часа в рабочее время!**"
-    )
-    
-    builder = InlineKeyboardBuilder()
-    manager_username = TELEGRAM_MANAGER.replace('@', '')
-    builder.add(InlineKeyboardButton(text=f"💬 Написать {TELEGRAM_MANAGER}", url=f"https://t.me/{manager_username}"))
-    builder.add(InlineKeyboardButton(text="📝 Оставить заявку через бота", callback_data="quick_contact"))
-    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
-    builder.adjust(1)
-    
-    await callback.message.edit_text(
-        contact_text,
-        reply_markup=builder.as_markup(),
-        parse_mode="Markdown"
-    )
+    screen = SCREENS['manager_contact']
+    await render_cache.edit(callback.message, screen.text, screen.markup, parse_mode="Markdown",
+                            fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.callback_query(F.data == "quick_contact")
-async def show_quick_contact(callback: types.CallbackQuery):
+async def show_quick_contact(callback: types.CallbackQuery, state: FSMContext, db: AsyncSession):
     """Быстрая заявка"""
-    await register_user(callback)
-    await handle_contact_request(callback, package_interest=None)
+    await register_user(callback, db)
+    await handle_contact_request(callback, state, db, package_interest=None)
 
 @dp.callback_query(F.data == "about")
-async def show_about(callback: types.CallbackQuery):
+async def show_about(callback: types.CallbackQuery, db: AsyncSession):
     """О компании"""
-    await register_user(callback)
+    await register_user(callback, db)
     
-    DatabaseService.log_user_action(
+    metrics_buffer.log(
         telegram_id=callback.from_user.id,
         action="view_about"
     )
     
-    about_text = (
-        f"💼 **О КОМПАНИИ {COMPANY_NAME.upper()}**\n\n"
-        
-        "🎯 **Наша специализация:**\n"
-        "• Разработка Telegram-ботов любой сложности\n"
-        "• Интеграция с CRM, базами данных, API\n"
-        "• ИИ-консультанты и чат-боты\n"
-        "• Автоматизация бизнес-процессов\n\n"
-        
-        "📊 **Наши показатели:**\n"
-        "• 50+ успешных проектов\n"
-        "• Средняя окупаемость бота: 1-3 месяца\n"
-        "• Поддержка 24/7\n"
-        "• 100% выполнение в срок\n\n"
-        
-        "🛠 **Технологии:**\n"
-        "• Python, aiogram, FastAPI\n"
-        "• PostgreSQL, MongoDB\n"
-        "• OpenAI GPT, Claude, Gemini\n"
-        "• Docker, VPS\n\n"
-        
-        "✨ **Почему выбирают нас:**\n"
-        "• Бесплатная консультация\n"
-        "• Фиксированная стоимость\n"
-        "• Гарантия на все работы\n"
-        "• Обучение вашей команды"
-    )
-    
-    await callback.message.edit_text(
-        about_text,
-        reply_markup=get_back_menu(),
-        parse_mode="Markdown"
-    )
+    screen = SCREENS['about']
+    await render_cache.edit(callback.message, screen.text, screen.markup, parse_mode="Markdown",
+                            fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.callback_query(F.data == "packages") 
-async def show_packages(callback: types.CallbackQuery):
+async def show_packages(callback: types.CallbackQuery, db: AsyncSession):
     """Показывает пакеты услуг"""
-    await register_user(callback)
+    await register_user(callback, db)
     
-    DatabaseService.log_user_action(
+    metrics_buffer.log(
         telegram_id=callback.from_user.id,
         action="view_packages"
     )
     
-    packages_text = (
-        "📦 **Наши пакеты услуг**\n\n"
-        "Выберите оптимальный пакет для вашего бизнеса.\n"
-        "Все боты окупаются за 1-3 месяца! 💰\n\n"
-        "**Какой пакет вас интересует?**"
-    )
-    
-    await callback.message.edit_text(
-        packages_text,
-        reply_markup=get_packages_menu(),
-        parse_mode="Markdown"
-    )
+    screen = SCREENS['packages']
+    await render_cache.edit(callback.message, screen.text, screen.markup, parse_mode="Markdown",
+                            fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("package_"))
-async def show_package_details(callback: types.CallbackQuery):
+async def show_package_details(callback: types.CallbackQuery, db: AsyncSession):
     """Показывает детали конкретного пакета"""
-    await register_user(callback)
+    await register_user(callback, db)
     
     package_type = callback.data.replace("package_", "")
-    package = PACKAGES_DATA.get(package_type)
+    screen = SCREENS.get(f"package_{package_type}")
     
-    if not package:
+    if not screen:
         await callback.answer("Пакет не найден", show_alert=True)
         return
     
-    DatabaseService.log_user_action(
+    metrics_buffer.log(
         telegram_id=callback.from_user.id,
         action="view_package_details",
         data={"package": package_type}
     )
     
-    features_text = "\n".join(package["features"])
-    
-    package_text = (
-        f"💼 **{package['name']}**\n\n"
-        f"💰 **Стоимость**: {package['price']}\n"
-        f"⏱ **Срок разработки**: {package['timeline']}\n\n"
-        f"**Что входит:**\n{features_text}\n\n"
-        f"📝 {package['description']}\n\n"
-        f"**Хотите узнать больше или оставить заявку?**"
-    )
-    
-    builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(text="📝 Оставить заявку", callback_data=f"contact_package_{package_type}"))
-    builder.add(InlineKeyboardButton(text="💬 Связаться напрямую", callback_data="manager_contact"))
-    builder.add(InlineKeyboardButton(text="📦 Другие пакеты", callback_data="packages"))
-    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
-    builder.adjust(1)
-    
-    await callback.message.edit_text(
-        package_text,
-        reply_markup=builder.as_markup(),
-        parse_mode="Markdown"
-    )
+    await render_cache.edit(callback.message, screen.text, screen.markup, parse_mode="Markdown",
+                            fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.callback_query(F.data == "stages")
-async def show_stages(callback: types.CallbackQuery):
+async def show_stages(callback: types.CallbackQuery, db: AsyncSession):
     """Показывает этапы разработки"""
-    await register_user(callback)
+    await register_user(callback, db)
     
-    DatabaseService.log_user_action(
+    metrics_buffer.log(
         telegram_id=callback.from_user.id,
         action="view_stages"
     )
     
-    stages_text = (
-        "🔧 **Этапы разработки чат-бота**\n\n"
-        "**Стандартный срок разработки — 7 рабочих дней** ⚡\n\n"
-    )
-    
-    stages_text += "\n\n".join(DEVELOPMENT_STAGES)
-    
-    stages_text += (
-        "\n\n✨ **От идеи до работающего бота — всего неделя!**\n"
-        "💎 Консультация и расчет стоимости — **бесплатно**"
-    )
-    
-    builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(text="📦 Посмотреть пакеты", callback_data="packages"))
-    builder.add(InlineKeyboardButton(text="📝 Оставить заявку", callback_data="quick_contact"))
-    builder.add(InlineKeyboardButton(text="💬 Связаться напрямую", callback_data="manager_contact"))
-    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
-    builder.adjust(1)
-    
-    await callback.message.edit_text(
-        stages_text,
-        reply_markup=builder.as_markup(),
-        parse_mode="Markdown"
-    )
+    screen = SCREENS['stages']
+    await render_cache.edit(callback.message, screen.text, screen.markup, parse_mode="Markdown",
+                            fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.callback_query(F.data == "contact")
-async def show_contact_info(callback: types.CallbackQuery):
+async def show_contact_info(callback: types.CallbackQuery, state: FSMContext, db: AsyncSession):
     """Показывает информацию о заявке"""
-    await register_user(callback)
-    await handle_contact_request(callback, package_interest=None)
+    await register_user(callback, db)
+    await handle_contact_request(callback, state, db, package_interest=None)
 
 @dp.callback_query(F.data.startswith("contact_package_"))
-async def show_contact_info_with_package(callback: types.CallbackQuery):
+async def show_contact_info_with_package(callback: types.CallbackQuery, state: FSMContext,
+                                        db: AsyncSession):
     """Показывает информацию о заявке с предвыбранным пакетом"""
-    await register_user(callback)
+    await register_user(callback, db)
     package_type = callback.data.replace("contact_package_", "")
-    await handle_contact_request(callback, package_interest=package_type)
+    await handle_contact_request(callback, state, db, package_interest=package_type)
 
-async def handle_contact_request(callback: types.CallbackQuery, package_interest: str = None):
+async def handle_contact_request(callback: types.CallbackQuery, state: FSMContext,
+                                 db: AsyncSession, package_interest: str = None):
     """Обрабатывает запрос на оставление заявки"""
     telegram_id = callback.from_user.id
     
-    has_application = DatabaseService.has_user_submitted_application(telegram_id)
-    
-    if has_application:
-        contact_text = (
-            "📋 **У вас уже есть активная заявка!**\n\n"
-            "Наш менеджер обязательно с вами свяжется в рабочее время.\n"
-            "Если хотите обновить данные или уточнить детали, "
-            "можете оставить новую заявку.\n\n"
-            f"⏰ **Рабочее время**: {WORK_HOURS}\n\n"
-            "**Хотите оставить новую заявку?**"
-        )
-    else:
-        contact_text = (
-            "📝 **Оставить заявку**\n\n"
-            "Для оформления заявки нам понадобятся ваши контактные данные.\n"
-            "Наш менеджер свяжется с вами в рабочее время для:\n\n"
-            "• 💰 Расчета точной стоимости проекта\n"
-            "• 📋 Обсуждения технических деталей\n"
-            "• ⏱ Согласования сроков разработки\n"
-            "• 🎯 Составления индивидуального предложения\n\n"
-        )
-        
-        if package_interest:
-            package_name = PACKAGES_DATA.get(package_interest, {}).get("name", "")
-            contact_text += f"📦 **Интересующий пакет**: {package_name}\n\n"
-        
-        contact_text += f"⏰ **Рабочее время**: {WORK_HOURS}\n\n**Готовы оставить контакт?**"
+    has_application = await AsyncDatabaseService.has_user_submitted_application(telegram_id, db=db)
     
     if package_interest:
-        DatabaseService.save_dialog_state(
-            telegram_id=telegram_id,
-            state="package_interest",
-            data={"package": package_interest}
-        )
+        # Интересующий пакет хранится в данных FSM до отправки заявки
+        await state.update_data(package=package_interest)
     
-    builder = InlineKeyboardBuilder()
-    button_text = "📞 Обновить контакт" if has_application else "📞 Оставить контакт"
-    builder.add(InlineKeyboardButton(text=button_text, callback_data="start_contact"))
-    builder.add(InlineKeyboardButton(text="💬 Связаться напрямую", callback_data="manager_contact"))
-    builder.add(InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main"))
-    builder.adjust(1)
+    screen = SCREENS.get(("contact", has_application, package_interest))
+    if screen is None:
+        # Неизвестный пакет из callback_data - собираем экран на лету
+        screen = build_contact_request_screen(has_application, package_interest)
     
-    await callback.message.edit_text(
-        contact_text,
-        reply_markup=builder.as_markup(),
-        parse_mode="Markdown"
-    )
+    await render_cache.edit(callback.message, screen.text, screen.markup, parse_mode="Markdown",
+                            fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.callback_query(F.data == "start_contact")
-async def start_contact_collection(callback: types.CallbackQuery, state: FSMContext):
+async def start_contact_collection(callback: types.CallbackQuery, state: FSMContext, db: AsyncSession):
     """Начинает сбор контактных данных"""
-    await register_user(callback)
+    await register_user(callback, db)
     
-    DatabaseService.log_user_action(
+    # Пакет (если выбран) нужен для воронки по пакетам
+    package_interest = (await state.get_data()).get('package')
+    metrics_buffer.log(
         telegram_id=callback.from_user.id,
-        action="start_contact_form"
+        action="start_contact_form",
+        data={"package": package_interest} if package_interest else None
     )
     
     await state.set_state(ContactForm.waiting_for_name)
     
-    contact_text = (
-        "👤 **Как к вам обращаться?**\n\n"
-        "Напишите ваше имя:"
-    )
-    
-    await callback.message.edit_text(
-        contact_text,
-        parse_mode="Markdown"
-    )
+    screen = SCREENS['contact_name']
+    await render_cache.edit(callback.message, screen.text, parse_mode="Markdown", fingerprint=screen.fingerprint)
     await callback.answer()
 
 @dp.message(ContactForm.waiting_for_name)
-async def process_name(message: types.Message, state: FSMContext):
+async def process_name(message: types.Message, state: FSMContext, db: AsyncSession):
     """Обрабатывает ввод имени"""
-    await register_user(message)
+    await register_user(message, db)
     
     name = message.text.strip() if message.text else ""
     
@@ -598,9 +800,13 @@ async def process_name(message: types.Message, state: FSMContext):
     await message.answer(phone_text, parse_mode="Markdown")
 
 @dp.message(ContactForm.waiting_for_phone)
-async def process_phone(message: types.Message, state: FSMContext):
-    """Обрабатывает ввод телефона"""
-    await register_user(message)
+async def process_phone(message: types.Message, state: FSMContext, db: AsyncSession):
+    """Обрабатывает ввод телефона.
+
+    Пользователь, заявка, его контактные данные и уведомления в outbox
+    сохраняются в одной транзакции: либо все, либо ничего.
+    """
+    await register_user(message, db)
     
     phone = message.text.strip() if message.text else ""
     
@@ -613,22 +819,21 @@ async def process_phone(message: types.Message, state: FSMContext):
     
     data = await state.get_data()
     name = data.get("name")
+    package_interest = data.get("package")
     telegram_id = message.from_user.id
     
-    dialog_state, dialog_data = DatabaseService.get_dialog_state(telegram_id)
-    package_interest = dialog_data.get("package") if dialog_data else None
-    
     try:
-        application = DatabaseService.create_application(
+        application = await AsyncDatabaseService.create_application(
             telegram_id=telegram_id,
             name=name,
             phone=phone,
-            package_interest=package_interest
+            package_interest=package_interest,
+            db=db
         )
         
-        DatabaseService.update_user_contact_data(telegram_id, name, phone)
+        await AsyncDatabaseService.update_user_contact_data(telegram_id, name, phone, db=db)
         
-        DatabaseService.log_user_action(
+        metrics_buffer.log(
             telegram_id=telegram_id,
             action="submit_application",
             data={
@@ -648,9 +853,9 @@ async def process_phone(message: types.Message, state: FSMContext):
             'created_at': application.created_at.strftime('%d.%m.%Y %H:%M')
         }
         
-        asyncio.create_task(notification_service.send_all_notifications(application_data))
-        
-        DatabaseService.clear_dialog_state(telegram_id)
+        await outbox.enqueue(application_data, revision=application.updated_at.isoformat(), db=db)
+        # Отвечаем «заявка принята» только после коммита
+        await commit_unit(db)
         
         success_text = (
             f"✅ **Спасибо, {name}!**\n\n"
@@ -689,6 +894,7 @@ async def process_phone(message: types.Message, state: FSMContext):
         
     except Exception as e:
         logging.error(f"Ошибка при сохранении заявки: {e}")
+        await rollback_unit(db)
         success_text = (
             f"❌ **Извините, {name}!**\n\n"
             "Произошла ошибка при сохранении заявки.\n"
@@ -708,9 +914,9 @@ async def process_phone(message: types.Message, state: FSMContext):
     await state.clear()
 
 @dp.message()
-async def universal_message_handler(message: types.Message):
+async def universal_message_handler(message: types.Message, db: AsyncSession):
     """Универсальный обработчик сообщений"""
-    await register_user(message)
+    await register_user(message, db)
     
     logging.info(f"MESSAGE: Chat={message.chat.id}, User={message.from_user.id}, Text='{message.text[:50] if message.text else 'No text'}...'")
     
@@ -727,42 +933,40 @@ async def universal_message_handler(message: types.Message):
         return
     
     if message.chat.type == 'private':
-        DatabaseService.log_user_action(
+        metrics_buffer.log(
             telegram_id=message.from_user.id,
             action="unknown_message",
             data={"text": (message.text or "")[:100]}
         )
         
-        unknown_text = (
-            "🤔 Извините, я не понимаю эту команду.\n\n"
-            "Я могу помочь вам:\n"
-            "• 📦 Узнать о пакетах услуг\n"
-            "• 🔧 Изучить этапы разработки\n" 
-            "• 📝 Оставить заявку на разработку бота\n"
-            "• 💬 Связаться с менеджером напрямую\n\n"
-            "**Выберите нужный раздел:**"
-        )
-        
+        screen = SCREENS['unknown']
         await message.answer(
-            unknown_text,
-            reply_markup=get_main_menu(),
+            screen.text,
+            reply_markup=screen.markup,
             parse_mode="Markdown"
         )
 
 async def main():
     """Основная функция запуска бота"""
     print("🤖 Инициализация базы данных...")
+    metrics_runner = None
     
     try:
         create_tables()
         print("✅ База данных инициализирована")
         
-        await bot.delete_webhook(drop_pending_updates=True)
-        print("✅ Webhook удален, переключаемся на polling")
+        metrics_buffer.start()
+        metrics_retention.start()
+        funnel_rollup.start()
+        storage.start()
+        outbox.start()
+        broadcast_engine.start()
+        unreachable_users.start()
         
         print(f"🤖 Бот для {COMPANY_NAME} запущен и готов к работе!")
         print("📊 Статистика:")
-        print(f"   • Всего заявок: {DatabaseService.get_applications_count()}")
+        total_apps = await AsyncDatabaseService.get_applications_count()
+        print(f"   • Всего заявок: {total_apps}")
         
         admin_chat_id = os.getenv('ADMIN_CHAT_ID')
         manager_telegram = os.getenv('TELEGRAM_MANAGER', '@yourusername')
@@ -773,12 +977,30 @@ async def main():
         print(f"   • Телефон: {MANAGER_PHONE}")
         print(f"   • Email: {MANAGER_EMAIL_CONTACT}")
         
-        await dp.start_polling(bot)
+        if BOT_MODE == 'webhook':
+            from webhook_server import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            metrics_runner = await start_metrics_server()
+            await bot.delete_webhook(drop_pending_updates=True)
+            print("✅ Webhook удален, переключаемся на polling")
+            await dp.start_polling(bot)
         
     except Exception as e:
         logging.error(f"Ошибка при запуске бота: {e}")
     finally:
+        await metrics_buffer.close()
+        await metrics_retention.close()
+        await funnel_rollup.close()
+        await storage.close()
+        await outbox.close()
+        await broadcast_engine.close()
+        await unreachable_users.close()
+        await notification_service.close()
         await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await dispose_engines()
 
 if __name__ == "__main__":
     asyncio.run(main())
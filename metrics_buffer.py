@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+from async_database_service import AsyncDatabaseService
+
+class MetricsBuffer:
+    """Буфер событий BotMetrics: копит действия в памяти и пишет их пачками.
+
+    Сброс происходит каждые ``batch_size`` событий или раз в ``flush_interval_ms``
+    миллисекунд - смотря что наступит раньше. Одна пачка = один multi-row INSERT.
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval_ms: int = None,
+                 max_buffer_size: int = None):
+        self.batch_size = batch_size or int(os.getenv('METRICS_BATCH_SIZE', '100'))
+        self.flush_interval = (flush_interval_ms or int(os.getenv('METRICS_FLUSH_INTERVAL_MS', '2000'))) / 1000
+        # Защита от неограниченного роста памяти, если БД недоступна
+        self.max_buffer_size = max_buffer_size or int(os.getenv('METRICS_MAX_BUFFER', '10000'))
+        self._events = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def log(self, telegram_id: int, action: str, data: dict = None):
+        """Добавляет событие в буфер (не ждет записи в БД)"""
+        if len(self._events) >= self.max_buffer_size:
+            logging.warning(f"Буфер метрик переполнен, событие {action} от {telegram_id} отброшено")
+            return
+        self._events.append({
+            'telegram_id': telegram_id,
+            'action': action,
+            'data': json.dumps(data) if data else None,
+            'created_at': datetime.utcnow()
+        })
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    def __len__(self):
+        return len(self._events)
+
+    def start(self):
+        """Запускает фоновую задачу сброса буфера"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные события в БД"""
+        while self._events:
+            batch = self._events[:self.batch_size]
+            del self._events[:self.batch_size]
+            saved = False
+            try:
+                await AsyncDatabaseService.log_user_actions(batch)
+                saved = True
+            except Exception as e:
+                logging.error(f"Ошибка при сбросе буфера метрик ({len(batch)} событий): {e}")
+            finally:
+                if not saved:
+                    # Ошибка или отмена: возвращаем пачку в начало буфера, повторим позже
+                    self._events[:0] = batch
+            if not saved:
+                return
+
+    async def close(self):
+        """Останавливает фоновую задачу и сбрасывает остаток буфера"""
+        if self._task is not None:
+            # Без cancel(): текущая запись пачки должна завершиться
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
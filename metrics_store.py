@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Хранилище событий bot_metrics: сырые события + дневные агрегаты.
+
+- Сырые события пишутся в bot_metrics (в PostgreSQL - секции по месяцам,
+  см. migrations/versions/0002_partition_bot_metrics.py).
+- MetricsRetention раз в час сворачивает завершенные дни в bot_metrics_daily,
+  заранее создает секции на следующие месяцы и удаляет сырые события старше
+  METRICS_RAW_RETENTION_DAYS (в PostgreSQL - целыми секциями).
+- Статистика за период читается из двух уровней: дни до водяного знака -
+  из агрегатов, остаток - из сырых событий.
+
+Однократный проход обслуживания (например, из Heroku Scheduler):
+    python metrics_store.py
+"""
+
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, delete, insert, text, union_all, literal_column
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from models import BotMetrics, BotMetricsDaily, RollupWatermark, AsyncSessionLocal, get_async_engine, dispose_engines
+
+DAILY_WATERMARK = 'bot_metrics_daily'
+
+# Запас на события, которые еще лежат в буфере метрик к моменту свертки
+ROLLUP_GRACE = timedelta(hours=1)
+
+PARTITION_NAME = re.compile(r'^bot_metrics_y(\d{4})m(\d{2})$')
+
+# Ключи advisory-lock фоновых задач (у migrations - 8317013): задачу запускает
+# каждый воркер бота, а выполнять ее должен один
+RETENTION_LOCK_KEY = 8317014
+FUNNEL_LOCK_KEY = 8317015
+
+def day_start(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+def next_month(dt: datetime) -> datetime:
+    return datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"bot_metrics_y{month.year}m{month.month:02d}"
+
+def build_action_counts_query(since: datetime, watermark: datetime = None):
+    """Число событий по действиям начиная с since.
+
+    Дни до watermark берутся из bot_metrics_daily, остальное - из сырых
+    событий. Строки результата: (tier, action, events); одно действие может
+    прийти из обоих уровней, их нужно сложить.
+    """
+    raw_since = since if watermark is None else max(since, watermark)
+    raw = (
+        select(literal_column("'raw'").label('tier'), BotMetrics.action, func.count(BotMetrics.id).label('events'))
+        .where(BotMetrics.created_at >= raw_since)
+        .group_by(BotMetrics.action)
+    )
+    if watermark is None or watermark <= since:
+        return raw
+    daily = (
+        select(literal_column("'daily'"), BotMetricsDaily.action, func.sum(BotMetricsDaily.events))
+        .where(BotMetricsDaily.day >= since.date(), BotMetricsDaily.day < watermark.date())
+        .group_by(BotMetricsDaily.action)
+    )
+    return union_all(daily, raw)
+
+def sum_action_counts(rows) -> dict:
+    counts = {}
+    for _, action, events in rows:
+        counts[action] = counts.get(action, 0) + (events or 0)
+    return counts
+
+async def get_watermark(db, name: str):
+    return await db.scalar(select(RollupWatermark.value).where(RollupWatermark.name == name))
+
+async def try_job_lock(db, key: int) -> bool:
+    """Берет advisory-lock фоновой задачи до конца транзакции (PostgreSQL).
+
+    False - задачу сейчас выполняет другой воркер. Заодно снимает
+    statement_timeout профиля worker: свертка за несколько дней по большой
+    bot_metrics в него не укладывается.
+    """
+    dialect = db.dialect if isinstance(db, AsyncConnection) else db.bind.dialect
+    if dialect.name != 'postgresql':
+        return True
+    await db.execute(text("SET LOCAL statement_timeout = 0"))
+    return bool(await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': key}))
+
+async def set_watermark(db, name: str, value: datetime):
+    """Сохраняет водяной знак в текущей транзакции"""
+    watermark = await db.get(RollupWatermark, name)
+    if watermark is None:
+        db.add(RollupWatermark(name=name, value=value))
+    else:
+        watermark.value = value
+
+class MetricsRetention:
+    """Фоновое обслуживание bot_metrics: свертка, секции, удаление старых событий"""
+
+    def __init__(self, raw_retention_days: int = None, interval: float = None,
+                 months_ahead: int = 2, rollup_chunk_days: int = 7, delete_batch_size: int = 5000):
+        self.raw_retention_days = raw_retention_days or int(os.getenv('METRICS_RAW_RETENTION_DAYS', '90'))
+        self.interval = interval or float(os.getenv('METRICS_RETENTION_INTERVAL', '3600'))
+        self.months_ahead = months_ahead
+        self.rollup_chunk_days = rollup_chunk_days
+        self.delete_batch_size = delete_batch_size
+        self._task = None
+
+    def start(self):
+        """Запускает периодическое обслуживание"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Ошибка обслуживания bot_metrics: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> dict:
+        """Один проход: свертка, создание секций, удаление старых событий"""
+        rolled_days = await self.rollup()
+        await self.ensure_partitions()
+        removed = await self.drop_expired()
+        if rolled_days or removed:
+            logging.info(f"bot_metrics: свернуто дней {rolled_days}, удалено {removed}")
+        return {'rolled_days': rolled_days, 'removed': removed}
+
+    async def rollup(self) -> int:
+        """Сворачивает завершенные дни в bot_metrics_daily, двигая водяной знак.
+
+        Каждая порция - отдельная транзакция под advisory-lock; водяной знак
+        читается уже под блокировкой, поэтому воркеры не сворачивают одни и
+        те же дни одновременно.
+        """
+        end = day_start(datetime.utcnow() - ROLLUP_GRACE)
+        rolled_days = 0
+        day = func.date(BotMetrics.created_at)
+        while True:
+            async with AsyncSessionLocal() as db:
+                if not await try_job_lock(db, RETENTION_LOCK_KEY):
+                    logging.info("bot_metrics: свертку выполняет другой воркер")
+                    return rolled_days
+                watermark = await get_watermark(db, DAILY_WATERMARK)
+                if watermark is None:
+                    first = await db.scalar(select(func.min(BotMetrics.created_at)))
+                    watermark = day_start(first or end)
+                if watermark >= end:
+                    return rolled_days
+                chunk_end = min(watermark + timedelta(days=self.rollup_chunk_days), end)
+                # Пересчет диапазона целиком, поэтому повторный запуск безопасен
+                await db.execute(delete(BotMetricsDaily).where(
+                    BotMetricsDaily.day >= watermark.date(), BotMetricsDaily.day < chunk_end.date()
+                ))
+                await db.execute(insert(BotMetricsDaily).from_select(
+                    ['day', 'action', 'events', 'users'],
+                    select(day, BotMetrics.action, func.count(BotMetrics.id),
+                           func.count(func.distinct(BotMetrics.telegram_id)))
+                    .where(BotMetrics.created_at >= watermark, BotMetrics.created_at < chunk_end)
+                    .group_by(day, BotMetrics.action)
+                ))
+                await set_watermark(db, DAILY_WATERMARK, chunk_end)
+                await db.commit()
+            rolled_days += (chunk_end - watermark).days
+
+    @staticmethod
+    async def _is_partitioned(conn) -> bool:
+        if conn.dialect.name != 'postgresql':
+            return False
+        result = await conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'bot_metrics')"
+        ))
+        return result.scalar()
+
+    async def ensure_partitions(self):
+        """Создает секции текущего и следующих months_ahead месяцев (PostgreSQL)"""
+        async with get_async_engine().connect() as conn:
+            if not await self._is_partitioned(conn):
+                return
+            await conn.commit()
+            month = month_start(datetime.utcnow())
+            for _ in range(self.months_ahead + 1):
+                upper = next_month(month)
+                try:
+                    async with conn.begin():
+                        await conn.execute(text(
+                            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF bot_metrics "
+                            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+                        ))
+                except Exception as e:
+                    # Например, в секции по умолчанию уже есть строки этого месяца
+                    logging.error(f"Не удалось создать секцию {partition_name(month)}: {e}")
+                month = upper
+
+    async def drop_expired(self) -> int:
+        """Удаляет сырые события старше срока хранения, уже попавшие в агрегаты"""
+        async with AsyncSessionLocal() as db:
+            watermark = await get_watermark(db, DAILY_WATERMARK)
+        if watermark is None:
+            return 0
+        cutoff = min(day_start(datetime.utcnow()) - timedelta(days=self.raw_retention_days), watermark)
+
+        async with get_async_engine().connect() as conn:
+            if await self._is_partitioned(conn):
+                return await self._drop_partitions(conn, cutoff)
+        return await self._delete_rows(cutoff)
+
+    async def _drop_partitions(self, conn, cutoff: datetime) -> int:
+        result = await conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'bot_metrics'"
+        ))
+        partitions = [row[0] for row in result.fetchall()]
+        await conn.commit()
+        dropped = 0
+        for name in partitions:
+            match = PARTITION_NAME.match(name)
+            if not match:
+                continue
+            month = datetime(int(match.group(1)), int(match.group(2)), 1)
+            if next_month(month) <= cutoff:
+                async with conn.begin():
+                    if not await try_job_lock(conn, RETENTION_LOCK_KEY):
+                        return dropped
+                    await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                logging.info(f"Секция {name} удалена")
+                dropped += 1
+        # Секция по умолчанию чистится построчно
+        async with conn.begin():
+            if not await try_job_lock(conn, RETENTION_LOCK_KEY):
+                return dropped
+            await conn.execute(text("DELETE FROM bot_metrics_default WHERE created_at < :cutoff"),
+                               {'cutoff': cutoff})
+        return dropped
+
+    async def _delete_rows(self, cutoff: datetime) -> int:
+        removed = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                batch = select(BotMetrics.id).where(BotMetrics.created_at < cutoff).limit(self.delete_batch_size)
+                result = await db.execute(delete(BotMetrics).where(BotMetrics.id.in_(batch)))
+                await db.commit()
+            removed += result.rowcount
+            if result.rowcount < self.delete_batch_size:
+                return removed
+
+    async def close(self):
+        """Останавливает фоновую задачу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+async def _main():
+    try:
+        result = await MetricsRetention().run_once()
+        print(f"✅ Обслуживание bot_metrics: свернуто дней {result['rolled_days']}, удалено {result['removed']}")
+    finally:
+        await dispose_engines()
+
+if __name__ == '__main__':
+    os.environ.setdefault('DB_POOL_PROFILE', 'cli')
+    asyncio.run(_main())
@@ -0,0 +1,96 @@
+"""
+Миграции схемы базы данных.
+
+Каждая миграция - модуль в migrations/versions с атрибутами revision,
+down_revision, description и функциями upgrade(conn) / downgrade(conn).
+Примененные ревизии хранятся в таблице schema_migrations. Миграции
+применяются автоматически из models.create_tables(), вручную:
+
+    python -m migrations upgrade
+    python -m migrations downgrade <revision>
+    python -m migrations current
+"""
+
+import importlib
+import logging
+import pkgutil
+from datetime import datetime
+
+from sqlalchemy import text
+
+VERSIONS_PACKAGE = 'migrations.versions'
+
+# Произвольный ключ advisory-lock, чтобы web и worker не применяли миграции одновременно
+ADVISORY_LOCK_KEY = 8317013
+
+def load_migrations() -> list:
+    """Загружает модули миграций в порядке ревизий (по цепочке down_revision)"""
+    package = importlib.import_module(VERSIONS_PACKAGE)
+    modules = [
+        importlib.import_module(f"{VERSIONS_PACKAGE}.{info.name}")
+        for info in pkgutil.iter_modules(package.__path__)
+    ]
+    by_parent = {module.down_revision: module for module in modules}
+    ordered = []
+    current = by_parent.get(None)
+    while current is not None:
+        ordered.append(current)
+        current = by_parent.get(current.revision)
+    if len(ordered) != len(modules):
+        raise RuntimeError("Цепочка миграций разорвана или содержит ветвление")
+    return ordered
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version VARCHAR(32) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+    ))
+
+def applied_revisions(conn) -> set:
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def _lock(conn):
+    if conn.dialect.name == 'postgresql':
+        # Миграции применяются и при старте бота, а у профиля worker короткий
+        # statement_timeout: копирование bot_metrics и построение индексов на
+        # больших таблицах (и ожидание блокировки) его не укладываются
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': ADVISORY_LOCK_KEY})
+
+def run_migrations(engine, target: str = None) -> list:
+    """Применяет непримененные миграции (до target включительно, если указан)"""
+    applied_now = []
+    for migration in load_migrations():
+        with engine.begin() as conn:
+            _lock(conn)
+            if migration.revision in applied_revisions(conn):
+                continue
+            migration.upgrade(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, applied_at) VALUES (:version, :applied_at)"),
+                {'version': migration.revision, 'applied_at': datetime.utcnow()}
+            )
+        applied_now.append(migration.revision)
+        logging.info(f"Миграция {migration.revision} применена: {migration.description}")
+        print(f"✅ Миграция {migration.revision}: {migration.description}")
+        if target is not None and migration.revision == target:
+            break
+    return applied_now
+
+def downgrade(engine, target: str = None) -> list:
+    """Откатывает миграции, примененные после target (target=None - все)"""
+    reverted = []
+    for migration in reversed(load_migrations()):
+        if target is not None and migration.revision == target:
+            break
+        with engine.begin() as conn:
+            _lock(conn)
+            if migration.revision not in applied_revisions(conn):
+                continue
+            migration.downgrade(conn)
+            conn.execute(text("DELETE FROM schema_migrations WHERE version = :version"),
+                         {'version': migration.revision})
+        reverted.append(migration.revision)
+        print(f"↩️ Миграция {migration.revision} откатена")
+    return reverted
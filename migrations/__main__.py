@@ -0,0 +1,33 @@
+import os
+import sys
+
+# Ручной запуск - профиль пулов для скриптов (до первого создания движка)
+os.environ.setdefault('DB_POOL_PROFILE', 'cli')
+
+from models import get_engine, create_tables
+from migrations import run_migrations, downgrade, applied_revisions, load_migrations
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    target = sys.argv[2] if len(sys.argv) > 2 else None
+
+    if command == 'upgrade':
+        if target is None:
+            # Базовая схема создается из моделей, затем применяются миграции
+            create_tables()
+        else:
+            run_migrations(get_engine(), target)
+    elif command == 'downgrade':
+        downgrade(get_engine(), target)
+    elif command == 'current':
+        with get_engine().begin() as conn:
+            applied = applied_revisions(conn)
+        for migration in load_migrations():
+            mark = '✅' if migration.revision in applied else '⏳'
+            print(f"{mark} {migration.revision} - {migration.description}")
+    else:
+        print("Использование: python -m migrations [upgrade|downgrade|current] [revision]")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
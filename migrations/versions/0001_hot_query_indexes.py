@@ -0,0 +1,32 @@
+"""Составные индексы под запросы админки, API заявок и статистики.
+
+- applications (created_at, id): последние заявки, keyset-пагинация, статистика по дням
+- applications (status, created_at, id): фильтр и группировка по статусу
+- applications (package_interest, created_at, id): фильтр и группировка по пакету
+- bot_metrics (created_at): последняя активность
+- bot_metrics (action, created_at): подсчет действий за период
+- dialog_states (updated_at): очистка устаревших состояний FSM
+"""
+
+from sqlalchemy import text
+
+revision = '0001'
+down_revision = None
+description = 'составные индексы для горячих запросов'
+
+INDEXES = [
+    ('ix_applications_created_at_id', 'applications', 'created_at, id'),
+    ('ix_applications_status_created_at', 'applications', 'status, created_at, id'),
+    ('ix_applications_package_created_at', 'applications', 'package_interest, created_at, id'),
+    ('ix_bot_metrics_created_at', 'bot_metrics', 'created_at'),
+    ('ix_bot_metrics_action_created_at', 'bot_metrics', 'action, created_at'),
+    ('ix_dialog_states_updated_at', 'dialog_states', 'updated_at'),
+]
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+def downgrade(conn):
+    for name, _, _ in INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
@@ -0,0 +1,107 @@
+"""Секционирование bot_metrics по месяцам (только PostgreSQL).
+
+Таблица пересоздается как PARTITION BY RANGE (created_at) с секциями
+bot_metrics_yYYYYmMM и секцией по умолчанию, существующие события
+переносятся. Первичный ключ становится (id, created_at) - этого требует
+секционирование; последовательность id сохраняется. В SQLite остается одна
+таблица, старые события удаляются построчно (см. metrics_store.py).
+"""
+
+from datetime import datetime
+
+from sqlalchemy import text
+
+revision = '0002'
+down_revision = '0001'
+description = 'секционирование bot_metrics по месяцам'
+
+INDEXES = [
+    ('ix_bot_metrics_telegram_id', 'telegram_id'),
+    ('ix_bot_metrics_created_at', 'created_at'),
+    ('ix_bot_metrics_action_created_at', 'action, created_at'),
+]
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+def _next_month(dt: datetime) -> datetime:
+    return datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+
+def _is_partitioned(conn) -> bool:
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'bot_metrics')"
+    )).scalar()
+
+def _create_indexes(conn):
+    for name, columns in INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON bot_metrics ({columns})"))
+
+def upgrade(conn):
+    if conn.dialect.name != 'postgresql' or _is_partitioned(conn):
+        return
+
+    conn.execute(text("ALTER TABLE bot_metrics RENAME TO bot_metrics_legacy"))
+    conn.execute(text("ALTER INDEX IF EXISTS bot_metrics_pkey RENAME TO bot_metrics_legacy_pkey"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('bot_metrics_legacy', 'id')")).scalar()
+    # Последовательность переживет удаление старой таблицы
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+
+    conn.execute(text(f"""
+        CREATE TABLE bot_metrics (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'),
+            telegram_id INTEGER NOT NULL,
+            action VARCHAR(100) NOT NULL,
+            data TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """))
+    conn.execute(text("CREATE TABLE bot_metrics_default PARTITION OF bot_metrics DEFAULT"))
+
+    now = datetime.utcnow()
+    first, last = conn.execute(text("SELECT min(created_at), max(created_at) FROM bot_metrics_legacy")).one()
+    month = _month_start(min(first or now, now))
+    # Секции на весь период данных и на следующий месяц вперед
+    end = _next_month(_next_month(_month_start(max(last or now, now))))
+    while month < end:
+        upper = _next_month(month)
+        conn.execute(text(
+            f"CREATE TABLE bot_metrics_y{month.year}m{month.month:02d} PARTITION OF bot_metrics "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+        ))
+        month = upper
+
+    conn.execute(text("""
+        INSERT INTO bot_metrics (id, telegram_id, action, data, created_at)
+        SELECT id, telegram_id, action, data, COALESCE(created_at, now() AT TIME ZONE 'utc')
+        FROM bot_metrics_legacy
+    """))
+    conn.execute(text("DROP TABLE bot_metrics_legacy"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY bot_metrics.id"))
+    _create_indexes(conn)
+
+def downgrade(conn):
+    if conn.dialect.name != 'postgresql' or not _is_partitioned(conn):
+        return
+
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('bot_metrics', 'id')")).scalar()
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    conn.execute(text("ALTER TABLE bot_metrics RENAME TO bot_metrics_partitioned"))
+    conn.execute(text("ALTER INDEX IF EXISTS bot_metrics_pkey RENAME TO bot_metrics_partitioned_pkey"))
+    conn.execute(text(f"""
+        CREATE TABLE bot_metrics (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}') PRIMARY KEY,
+            telegram_id INTEGER NOT NULL,
+            action VARCHAR(100) NOT NULL,
+            data TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO bot_metrics (id, telegram_id, action, data, created_at)
+        SELECT id, telegram_id, action, data, created_at FROM bot_metrics_partitioned
+    """))
+    conn.execute(text("DROP TABLE bot_metrics_partitioned"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY bot_metrics.id"))
+    _create_indexes(conn)
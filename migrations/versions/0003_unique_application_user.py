@@ -0,0 +1,36 @@
+"""Уникальный индекс applications.user_id - одна заявка на пользователя.
+
+Бот всегда хранил одну заявку на пользователя (повторная подача обновляет
+ее), но проверка была select-then-update и при двойном нажатии могла создать
+дубль. Теперь заявка пишется через INSERT ... ON CONFLICT (user_id), которому
+нужен уникальный индекс. Перед его созданием из дублей остается самая
+свежая заявка пользователя (по updated_at, затем по id).
+"""
+
+from sqlalchemy import text
+
+revision = '0003'
+down_revision = '0002'
+description = 'уникальный индекс applications.user_id'
+
+def upgrade(conn):
+    removed = conn.execute(text(
+        "DELETE FROM applications WHERE EXISTS ("
+        " SELECT 1 FROM applications newer"
+        " WHERE newer.user_id = applications.user_id"
+        " AND (newer.updated_at > applications.updated_at"
+        "      OR (newer.updated_at = applications.updated_at AND newer.id > applications.id)))"
+    )).rowcount
+    # Дубли с пустым updated_at сравнить нельзя - из них остается последняя по id
+    removed += conn.execute(text(
+        "DELETE FROM applications WHERE id NOT IN ("
+        " SELECT MAX(id) FROM applications GROUP BY user_id)"
+    )).rowcount
+    if removed:
+        print(f"⚠️ Удалено дублей заявок: {removed}")
+    conn.execute(text("DROP INDEX IF EXISTS ix_applications_user_id"))
+    conn.execute(text("CREATE UNIQUE INDEX ix_applications_user_id ON applications (user_id)"))
+
+def downgrade(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_applications_user_id"))
+    conn.execute(text("CREATE INDEX ix_applications_user_id ON applications (user_id)"))
@@ -0,0 +1,24 @@
+"""Частичный индекс по активным пользователям.
+
+Получатели рассылок выбираются как is_active = true по ключу users.id;
+индекс (id, telegram_id) только по активным строкам покрывает этот запрос,
+а отключенные пользователи (бот заблокирован, чат удален) в него не попадают.
+"""
+
+from sqlalchemy import text
+
+revision = '0004'
+down_revision = '0003'
+description = 'частичный индекс по активным пользователям'
+
+def upgrade(conn):
+    # В SQLite частичный индекс применяется, только если условие запроса
+    # совпадает с условием индекса дословно ("is_active = 1")
+    predicate = 'is_active' if conn.dialect.name == 'postgresql' else 'is_active = 1'
+    conn.execute(text("UPDATE users SET is_active = true WHERE is_active IS NULL"))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_users_active_id ON users (id, telegram_id) WHERE {predicate}"
+    ))
+
+def downgrade(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_active_id"))
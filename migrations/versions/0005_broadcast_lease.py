@@ -0,0 +1,20 @@
+"""Аренда рассылки воркером.
+
+Рассылку забирает один воркер: статус running и lease_until проставляются
+атомарно (FOR UPDATE SKIP LOCKED) и продлеваются после каждой пачки. Рассылка
+с истекшей арендой (воркер упал) забирается другим воркером.
+"""
+
+from sqlalchemy import inspect, text
+
+revision = '0005'
+down_revision = '0004'
+description = 'аренда рассылки воркером'
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('broadcasts')}
+    if 'lease_until' not in columns:
+        conn.execute(text("ALTER TABLE broadcasts ADD COLUMN lease_until TIMESTAMP"))
+
+def downgrade(conn):
+    conn.execute(text("ALTER TABLE broadcasts DROP COLUMN lease_until"))
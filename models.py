@@ -1,8 +1,11 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Date, DateTime, Text, Boolean, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import os
+import threading
+
+from db_config import engine_options
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
@@ -18,10 +21,16 @@ class User(Base):
     last_name = Column(String(255), nullable=True)
     name = Column(String(255), nullable=True)  # Имя указанное пользователем
     phone = Column(String(50), nullable=True)
-    is_active = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True)  # False - бот заблокирован или чат удален
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Частичный индекс по активным пользователям - получатели рассылок (миграция 0004)
+    __table_args__ = (
+        Index('ix_users_active_id', 'id', 'telegram_id',
+              postgresql_where=text('is_active'), sqlite_where=text('is_active = 1')),
+    )
+    
     def __repr__(self):
         return f"<User(telegram_id={self.telegram_id}, name='{self.name}')>"
 
@@ -30,7 +39,7 @@ class Application(Base):
     __tablename__ = 'applications'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False, index=True)  # telegram_id пользователя
+    user_id = Column(Integer, nullable=False, unique=True, index=True)  # telegram_id пользователя, одна заявка на пользователя (миграция 0003)
     name = Column(String(255), nullable=False)
     phone = Column(String(50), nullable=False)
     package_interest = Column(String(50), nullable=True)  # basic, advanced, premium
@@ -39,6 +48,13 @@ class Application(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Индексы под реальные запросы админки и API (см. migrations/versions/0001_hot_query_indexes.py)
+    __table_args__ = (
+        Index('ix_applications_created_at_id', 'created_at', 'id'),
+        Index('ix_applications_status_created_at', 'status', 'created_at', 'id'),
+        Index('ix_applications_package_created_at', 'package_interest', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f"<Application(id={self.id}, name='{self.name}', status='{self.status}')>"
 
@@ -53,11 +69,20 @@ class DialogState(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        Index('ix_dialog_states_updated_at', 'updated_at'),
+    )
+    
     def __repr__(self):
         return f"<DialogState(telegram_id={self.telegram_id}, state='{self.current_state}')>"
 
 class BotMetrics(Base):
-    """Модель метрик бота"""
+    """Модель метрик бота (сырые события).
+
+    В PostgreSQL таблица секционирована по месяцам created_at (миграция 0002,
+    первичный ключ там (id, created_at)); старые секции удаляются после
+    свертки в bot_metrics_daily (см. metrics_store.py).
+    """
     __tablename__ = 'bot_metrics'
     
     id = Column(Integer, primary_key=True)
@@ -66,9 +91,100 @@ class BotMetrics(Base):
     data = Column(Text, nullable=True)  # Дополнительные данные
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index('ix_bot_metrics_created_at', 'created_at'),
+        Index('ix_bot_metrics_action_created_at', 'action', 'created_at'),
+    )
+    
     def __repr__(self):
         return f"<BotMetrics(telegram_id={self.telegram_id}, action='{self.action}')>"
 
+class BotMetricsDaily(Base):
+    """Дневные агрегаты событий (свертка bot_metrics)"""
+    __tablename__ = 'bot_metrics_daily'
+    
+    day = Column(Date, primary_key=True)
+    action = Column(String(100), primary_key=True)
+    events = Column(Integer, nullable=False, default=0)
+    users = Column(Integer, nullable=False, default=0)  # уникальные пользователи за день
+    
+    def __repr__(self):
+        return f"<BotMetricsDaily(day={self.day}, action='{self.action}', events={self.events})>"
+
+class FunnelDaily(Base):
+    """Дневные счетчики воронки (start → packages → details → contact → submit)"""
+    __tablename__ = 'funnel_daily'
+    
+    day = Column(Date, primary_key=True)
+    package = Column(String(50), primary_key=True)  # '*' - все пакеты вместе
+    stage = Column(String(20), primary_key=True)
+    users = Column(Integer, nullable=False, default=0)  # уникальные пользователи за день
+    events = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<FunnelDaily(day={self.day}, package='{self.package}', stage='{self.stage}', users={self.users})>"
+
+class RollupWatermark(Base):
+    """Водяные знаки фоновых сверток: до какого момента данные уже обработаны"""
+    __tablename__ = 'rollup_watermarks'
+    
+    name = Column(String(100), primary_key=True)
+    value = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<RollupWatermark(name='{self.name}', value={self.value})>"
+
+class NotificationOutbox(Base):
+    """Модель очереди уведомлений (outbox)"""
+    __tablename__ = 'notification_outbox'
+    
+    id = Column(Integer, primary_key=True)
+    idempotency_key = Column(String(255), unique=True, nullable=False)  # заявка + ревизия + канал
+    application_id = Column(Integer, nullable=False, index=True)
+    channel = Column(String(20), nullable=False)  # telegram, email
+    payload = Column(Text, nullable=False)  # JSON данные заявки
+    status = Column(String(20), default='pending')  # pending, processing, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_notification_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f"<NotificationOutbox(application_id={self.application_id}, channel='{self.channel}', status='{self.status}')>"
+
+class Broadcast(Base):
+    """Рассылка по пользователям бота с контрольной точкой прогресса"""
+    __tablename__ = 'broadcasts'
+    
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)  # HTML-текст сообщения
+    status = Column(String(20), default='pending')  # pending, running, done, cancelled
+    admin_chat_id = Column(BigInteger, nullable=False)  # куда отчитываться о прогрессе
+    progress_message_id = Column(Integer, nullable=True)
+    total = Column(Integer, default=0)  # получателей на момент создания
+    last_user_id = Column(Integer, default=0)  # users.id последнего обработанного получателя
+    sent = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)  # бот заблокирован или чат удален
+    failed = Column(Integer, default=0)
+    lease_until = Column(DateTime, nullable=True)  # аренда воркера, который ведет рассылку
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_broadcasts_status', 'status'),
+    )
+    
+    def __repr__(self):
+        return f"<Broadcast(id={self.id}, status='{self.status}', sent={self.sent}/{self.total})>"
+
 # Настройка подключения к базе данных
 def get_database_url():
     """Получает URL базы данных из переменных окружения"""
@@ -78,14 +194,87 @@ def get_database_url():
         database_url = database_url.replace('postgres://', 'postgresql://', 1)
     return database_url or 'sqlite:///bot.db'  # Fallback для локальной разработки
 
-# Создание движка и сессии
-engine = create_engine(get_database_url())
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def get_async_database_url():
+    """Получает URL базы данных с асинхронным драйвером (asyncpg/aiosqlite)"""
+    database_url = get_database_url()
+    if database_url.startswith('postgresql://'):
+        return database_url.replace('postgresql://', 'postgresql+asyncpg://', 1)
+    if database_url.startswith('sqlite://'):
+        return database_url.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+    return database_url
+
+# Движки создаются при первом обращении, а не при импорте: процессу, которому
+# нужен только один из них (веб-админке - синхронный, боту - в основном
+# асинхронный), не приходится импортировать драйвер и открывать пул второго.
+# Параметры пула - по профилю процесса, см. db_config.py
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Синхронный движок (создается один раз, потокобезопасно)"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(get_database_url(), **engine_options(get_database_url()))
+    return _engine
+
+def get_async_engine():
+    """Асинхронный движок для бота: запросы не блокируют event loop aiogram"""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        _async_engine = create_async_engine(
+            get_async_database_url(), **engine_options(get_database_url(), is_async=True)
+        )
+    return _async_engine
+
+async def dispose_engines():
+    """Закрывает пулы созданных движков"""
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+class LazySessionFactory:
+    """Фабрика сессий, которая строит sessionmaker (и движок) при первом вызове"""
+    
+    def __init__(self, build):
+        self._build = build
+        self._factory = None
+    
+    def __call__(self, **kwargs):
+        if self._factory is None:
+            self._factory = self._build()
+        return self._factory(**kwargs)
+
+def _build_async_sessionmaker():
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    # expire_on_commit=False - объекты остаются доступны после закрытия сессии
+    return async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+
+SessionLocal = LazySessionFactory(lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_engine()))
+AsyncSessionLocal = LazySessionFactory(_build_async_sessionmaker)
+
+def __getattr__(name):
+    # models.engine / models.async_engine для старого кода - тоже лениво
+    if name == 'engine':
+        return get_engine()
+    if name == 'async_engine':
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_tables():
-    """Создает все таблицы в базе данных"""
-    Base.metadata.create_all(bind=engine)
+    """Создает все таблицы в базе данных и применяет миграции"""
+    from migrations import run_migrations
+    
+    Base.metadata.create_all(bind=get_engine())
     print("✅ Таблицы базы данных созданы")
+    run_migrations(get_engine())
 
 def get_db():
     """Получает сессию базы данных"""
@@ -1,15 +1,13 @@
 import asyncio
+import importlib.util
 import logging
 import os
 from datetime import datetime
 
-try:
-    import smtplib
-    from email.mime.text import MimeText
-    from email.mime.multipart import MimeMultipart
-    EMAIL_AVAILABLE = True
-except ImportError:
-    EMAIL_AVAILABLE = False
+# smtplib и email.mime нужны только при первой отправке письма - они
+# импортируются лениво, чтобы не замедлять старт бота
+EMAIL_AVAILABLE = importlib.util.find_spec('smtplib') is not None
+if not EMAIL_AVAILABLE:
     print("⚠️ Email библиотеки недоступны")
 
 try:
@@ -22,7 +20,11 @@ except ImportError:
 class NotificationService:
     """Сервис для отправки уведомлений менеджерам"""
     
-    def __init__(self):
+    def __init__(self, bot=None):
+        # Бот из main.py переиспользуется, чтобы не открывать новую HTTP-сессию
+        # (и TLS-соединение) на каждое уведомление
+        self._bot = bot
+        self._owns_bot = False
         self.bot_token = os.getenv('BOT_TOKEN')
         self.admin_chat_id = os.getenv('ADMIN_CHAT_ID')
         self.manager_email = os.getenv('MANAGER_EMAIL')
@@ -30,6 +32,41 @@ class NotificationService:
         self.smtp_port = int(os.getenv('SMTP_PORT', '587'))
         self.smtp_username = os.getenv('SMTP_USERNAME')
         self.smtp_password = os.getenv('SMTP_PASSWORD')
+        # STARTTLS можно отключить для локального отладочного SMTP-сервера
+        self.smtp_use_tls = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+        self._email_sender = None
+    
+    def _get_email_sender(self):
+        """Возвращает общий отправитель писем с постоянным SMTP-соединением"""
+        if self._email_sender is None:
+            from email_sender import EmailSender
+            self._email_sender = EmailSender(
+                server=self.smtp_server,
+                port=self.smtp_port,
+                username=self.smtp_username,
+                password=self.smtp_password,
+                use_tls=self.smtp_use_tls,
+                batch_size=int(os.getenv('SMTP_BATCH_SIZE', '20')),
+                keepalive=float(os.getenv('SMTP_KEEPALIVE', '60'))
+            )
+        return self._email_sender
+    
+    def _get_bot(self):
+        """Возвращает общий экземпляр бота (создает свой один раз, если не передан)"""
+        if self._bot is None:
+            self._bot = Bot(token=self.bot_token)
+            self._owns_bot = True
+        return self._bot
+    
+    async def close(self):
+        """Закрывает SMTP-соединение и HTTP-сессию бота, если она создана самим сервисом"""
+        if self._email_sender is not None:
+            await self._email_sender.close()
+            self._email_sender = None
+        if self._bot is not None and self._owns_bot:
+            await self._bot.session.close()
+            self._bot = None
+            self._owns_bot = False
         
     async def send_telegram_notification(self, application_data: dict):
         """Отправляет уведомление в Telegram админ-чат"""
@@ -42,41 +79,7 @@ class NotificationService:
             return False
             
         try:
-            bot = Bot(token=self.bot_token)
-            
-            # Форматируем данные пакета
-            package_names = {
-                'basic': 'Базовый (85 000₽)',
-                'advanced': 'Продвинутый (150 000₽)',
-                'premium': 'Премиум (250 000₽)'
-            }
-            package_name = package_names.get(
-                application_data.get('package_interest', ''), 
-                application_data.get('package_interest', 'не указан')
-            )
-            
-            # Создаем сообщение
-            message = (
-                f"🆕 **НОВАЯ ЗАЯВКА #{application_data['id']}**\n\n"
-                f"👤 **Клиент**: {application_data['name']}\n"
-                f"📞 **Телефон**: `{application_data['phone']}`\n"
-                f"📦 **Интересующий пакет**: {package_name}\n"
-                f"🆔 **Telegram ID**: {application_data['user_id']}\n"
-                f"⏰ **Время**: {application_data['created_at']}\n\n"
-                f"🔗 **Админка**: https://my-chatbot-landing.herokuapp.com\n\n"
-                f"⚡ **Действия**:\n"
-                f"• Позвонить клиенту в рабочее время\n"
-                f"• Обсудить детали проекта\n"
-                f"• Подготовить коммерческое предложение"
-            )
-            
-            await bot.send_message(
-                chat_id=self.admin_chat_id,
-                text=message,
-                parse_mode="Markdown"
-            )
-            
-            await bot.session.close()
+            await self._deliver_telegram(application_data)
             print(f"✅ Telegram уведомление отправлено для заявки #{application_data['id']}")
             return True
             
@@ -84,25 +87,74 @@ class NotificationService:
             print(f"❌ Ошибка отправки Telegram уведомления: {e}")
             return False
     
-    def send_email_notification(self, application_data: dict):
-        """Отправляет email уведомление менеджеру"""
+    async def _deliver_telegram(self, application_data: dict):
+        """Отправляет уведомление в админ-чат (исключения пробрасываются вызывающему)"""
+        bot = self._get_bot()
+        
+        # Форматируем данные пакета
+        package_names = {
+            'basic': 'Базовый (85 000₽)',
+            'advanced': 'Продвинутый (150 000₽)',
+            'premium': 'Премиум (250 000₽)'
+        }
+        package_name = package_names.get(
+            application_data.get('package_interest', ''), 
+            application_data.get('package_interest', 'не указан')
+        )
+        
+        # Создаем сообщение
+        message = (
+            f"🆕 **НОВАЯ ЗАЯВКА #{application_data['id']}**\n\n"
+            f"👤 **Клиент**: {application_data['name']}\n"
+            f"📞 **Телефон**: `{application_data['phone']}`\n"
+            f"📦 **Интересующий пакет**: {package_name}\n"
+            f"🆔 **Telegram ID**: {application_data['user_id']}\n"
+            f"⏰ **Время**: {application_data['created_at']}\n\n"
+            f"🔗 **Админка**: https://my-chatbot-landing.herokuapp.com\n\n"
+            f"⚡ **Действия**:\n"
+            f"• Позвонить клиенту в рабочее время\n"
+            f"• Обсудить детали проекта\n"
+            f"• Подготовить коммерческое предложение"
+        )
+        
+        await bot.send_message(
+            chat_id=self.admin_chat_id,
+            text=message,
+            parse_mode="Markdown"
+        )
+    
+    async def send_email_notification(self, application_data: dict):
+        """Отправляет email уведомление менеджеру (не блокируя event loop)"""
         if not EMAIL_AVAILABLE:
             print("❌ Email библиотеки недоступны")
             return False
             
-        if not all([self.manager_email, self.smtp_username, self.smtp_password]):
+        if not all([self.manager_email, self.smtp_username]):
             print("⚠️ Email уведомления не настроены")
             return False
             
         try:
-            # Создаем сообщение
-            msg = MimeMultipart()
-            msg['From'] = self.smtp_username
-            msg['To'] = self.manager_email
-            msg['Subject'] = f"Новая заявка #{application_data['id']} - {application_data['name']}"
-            
-            # Простое текстовое содержимое
-            text_body = f"""
+            await self._deliver_email(application_data)
+            print(f"✅ Email уведомление отправлено для заявки #{application_data['id']}")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Ошибка отправки email уведомления: {e}")
+            return False
+    
+    async def _deliver_email(self, application_data: dict):
+        """Отправляет письмо менеджеру (исключения пробрасываются вызывающему)"""
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        
+        # Создаем сообщение
+        msg = MIMEMultipart()
+        msg['From'] = self.smtp_username
+        msg['To'] = self.manager_email
+        msg['Subject'] = f"Новая заявка #{application_data['id']} - {application_data['name']}"
+        
+        # Простое текстовое содержимое
+        text_body = f"""
 Новая заявка #{application_data['id']}
 
 Клиент: {application_data['name']}
@@ -111,24 +163,34 @@ Telegram ID: {application_data['user_id']}
 Время: {application_data['created_at']}
 
 Админ-панель: https://my-chatbot-landing.herokuapp.com
-            """
-            
-            msg.attach(MimeText(text_body, 'plain', 'utf-8'))
-            
-            # Отправляем письмо
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.smtp_username, self.smtp_password)
-            text = msg.as_string()
-            server.sendmail(self.smtp_username, self.manager_email, text)
-            server.quit()
-            
-            print(f"✅ Email уведомление отправлено для заявки #{application_data['id']}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Ошибка отправки email уведомления: {e}")
-            return False
+        """
+        
+        msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
+        
+        # Отправляем письмо через постоянное SMTP-соединение в отдельном потоке
+        await self._get_email_sender().send(msg)
+    
+    def enabled_channels(self) -> list:
+        """Возвращает настроенные каналы уведомлений"""
+        channels = []
+        if TELEGRAM_AVAILABLE and self.bot_token and self.admin_chat_id:
+            channels.append('telegram')
+        if EMAIL_AVAILABLE and self.manager_email and self.smtp_username:
+            channels.append('email')
+        return channels
+    
+    async def deliver(self, channel: str, application_data: dict):
+        """Отправляет уведомление в указанный канал; при ошибке бросает исключение.
+
+        Используется outbox-диспетчером, который сам решает, повторять ли отправку.
+        """
+        if channel == 'telegram':
+            await self._deliver_telegram(application_data)
+        elif channel == 'email':
+            await self._deliver_email(application_data)
+        else:
+            raise ValueError(f"Неизвестный канал уведомлений: {channel}")
+        print(f"✅ Уведомление ({channel}) отправлено для заявки #{application_data['id']}")
     
     async def send_all_notifications(self, application_data: dict):
         """Отправляет все типы уведомлений"""
@@ -145,9 +207,9 @@ Telegram ID: {application_data['user_id']}
         except Exception as e:
             print(f"❌ Ошибка Telegram уведомления: {e}")
         
-        # Email уведомление (синхронно)
+        # Email уведомление (в потоке SMTP, event loop не блокируется)
         try:
-            results['email'] = self.send_email_notification(application_data)
+            results['email'] = await self.send_email_notification(application_data)
         except Exception as e:
             print(f"❌ Ошибка Email уведомления: {e}")
         
@@ -167,27 +229,26 @@ Telegram ID: {application_data['user_id']}
             return False
             
         try:
-            from database_service import DatabaseService
-            
-            # Получаем статистику за сегодня
-            today = datetime.now().date()
-            total_apps = DatabaseService.get_applications_count()
-            recent_apps = DatabaseService.get_recent_applications(limit=10)
+            from async_database_service import AsyncDatabaseService
+            from database_service import summary_since
             
-            # Подсчитываем заявки за сегодня
-            today_apps = [app for app in recent_apps if app.created_at.date() == today]
+            # Получаем статистику за сегодня (агрегаты считаются в БД)
+            today = datetime.utcnow().date()
+            stats = await AsyncDatabaseService.get_summary_stats(days=1)
+            total_apps = stats['total_applications']
+            today_apps = await AsyncDatabaseService.get_applications_since(summary_since(1))
             
             if not self.admin_chat_id or not self.bot_token:
                 print("⚠️ Настройки Telegram для отчета не найдены")
                 return False
             
-            bot = Bot(token=self.bot_token)
+            bot = self._get_bot()
             
             report_message = (
                 f"📊 **ЕЖЕДНЕВНЫЙ ОТЧЕТ** - {today.strftime('%d.%m.%Y')}\n\n"
                 f"📈 **Статистика:**\n"
                 f"• Всего заявок: {total_apps}\n"
-                f"• Заявок за сегодня: {len(today_apps)}\n\n"
+                f"• Заявок за сегодня: {stats['today_applications']}\n\n"
             )
             
             if today_apps:
@@ -213,7 +274,6 @@ Telegram ID: {application_data['user_id']}
                 parse_mode="Markdown"
             )
             
-            await bot.session.close()
             print("✅ Ежедневный отчет отправлен")
             return True
             
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from async_database_service import AsyncDatabaseService, after_commit
+from instrumentation import NOTIFICATIONS
+
+try:
+    from aiogram.exceptions import TelegramRetryAfter
+except ImportError:
+    TelegramRetryAfter = None
+
+class OutboxDispatcher:
+    """Доставка уведомлений о заявках через таблицу notification_outbox.
+
+    Хендлер только записывает уведомления в outbox (по строке на канал), а
+    фоновый воркер забирает их пачками не больше ``concurrency`` штук и
+    отправляет. Ошибки повторяются с экспоненциальной задержкой, RetryAfter от
+    Telegram выдерживается ровно столько, сколько попросил сервер. Уведомление,
+    не доставленное за ``max_attempts`` попыток, помечается как failed.
+    """
+
+    def __init__(self, notification_service, concurrency: int = None, poll_interval: float = None,
+                 max_attempts: int = None, base_delay: float = None, max_delay: float = None,
+                 retention_days: int = 7):
+        self.notification_service = notification_service
+        self.concurrency = concurrency or int(os.getenv('OUTBOX_CONCURRENCY', '5'))
+        self.poll_interval = poll_interval or float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+        self.max_attempts = max_attempts or int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+        self.base_delay = base_delay or float(os.getenv('OUTBOX_BASE_DELAY', '5'))
+        self.max_delay = max_delay or float(os.getenv('OUTBOX_MAX_DELAY', '3600'))
+        self.retention_days = retention_days
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        # Доставленные уведомления, которые не удалось отметить в outbox:
+        # повторно не отправляются, отметка повторяется
+        self._delivered = set()
+
+    @staticmethod
+    def idempotency_key(application_id: int, revision: str, channel: str) -> str:
+        return f"application:{application_id}:{revision}:{channel}"
+
+    async def enqueue(self, application_data: dict, revision: str = '', db=None) -> int:
+        """Записывает уведомления о заявке в outbox.
+
+        revision отличает повторную подачу заявки (та же запись applications)
+        от повторной доставки того же события - для последнего ключ совпадет
+        и дубль не будет создан. С сессией апдейта (db) уведомления пишутся в
+        одной транзакции с заявкой, а воркер будится после ее коммита.
+        """
+        payload = json.dumps(application_data, ensure_ascii=False, default=str)
+        entries = [
+            {
+                'idempotency_key': self.idempotency_key(application_data['id'], revision, channel),
+                'application_id': application_data['id'],
+                'channel': channel,
+                'payload': payload
+            }
+            for channel in self.notification_service.enabled_channels()
+        ]
+        added = await AsyncDatabaseService.enqueue_notifications(entries, db=db)
+        if added:
+            after_commit(db, self._wakeup.set)
+        return added
+
+    def start(self):
+        """Запускает фоновый воркер доставки"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        last_purge = time.monotonic()
+        while not self._stopping:
+            await self._complete_delivered()
+            try:
+                rows = await AsyncDatabaseService.claim_notifications(self.concurrency)
+            except Exception as e:
+                logging.error(f"Ошибка при чтении outbox: {e}")
+                rows = []
+
+            if rows:
+                results = await asyncio.gather(*(self._process(row) for row in rows),
+                                               return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        logging.error(f"Ошибка при обновлении outbox: {result}")
+                continue
+
+            if time.monotonic() - last_purge > 3600:
+                last_purge = time.monotonic()
+                before = datetime.utcnow() - timedelta(days=self.retention_days)
+                await AsyncDatabaseService.purge_sent_notifications(before)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _process(self, row):
+        if row.id in self._delivered:
+            # Уже отправлено, не удалась только отметка - аренда истекла, и запись вернулась
+            await self._complete(row.id)
+            return
+
+        try:
+            application_data = json.loads(row.payload)
+        except (TypeError, ValueError) as e:
+            # Повтор не поможет: запись сразу помечается как failed
+            NOTIFICATIONS.inc(channel=row.channel, outcome='failed')
+            logging.error(f"Outbox: некорректные данные уведомления #{row.id} "
+                          f"для заявки #{row.application_id}: {e}")
+            await AsyncDatabaseService.reschedule_notification(
+                row.id, row.attempts + 1, datetime.utcnow(), f"Некорректные данные: {e}", failed=True
+            )
+            return
+
+        try:
+            await self.notification_service.deliver(row.channel, application_data)
+        except Exception as e:
+            now = datetime.utcnow()
+            if TelegramRetryAfter is not None and isinstance(e, TelegramRetryAfter):
+                # Флуд-контроль Telegram: ждем указанное время, попытка не расходуется
+                NOTIFICATIONS.inc(channel=row.channel, outcome='rate_limited')
+                logging.warning(f"Outbox: RetryAfter {e.retry_after}с для заявки #{row.application_id}")
+                await AsyncDatabaseService.reschedule_notification(
+                    row.id, row.attempts, now + timedelta(seconds=e.retry_after), str(e)
+                )
+                return
+
+            attempts = row.attempts + 1
+            failed = attempts >= self.max_attempts
+            next_attempt_at = now + timedelta(seconds=self._backoff(attempts))
+            NOTIFICATIONS.inc(channel=row.channel, outcome='failed' if failed else 'retry')
+            await AsyncDatabaseService.reschedule_notification(
+                row.id, attempts, next_attempt_at, str(e), failed=failed
+            )
+            if failed:
+                logging.error(f"Outbox: уведомление ({row.channel}) для заявки "
+                              f"#{row.application_id} не доставлено за {attempts} попыток: {e}")
+            else:
+                logging.warning(f"Outbox: ошибка отправки ({row.channel}) для заявки "
+                                f"#{row.application_id}, попытка {attempts}: {e}")
+            return
+
+        NOTIFICATIONS.inc(channel=row.channel, outcome='sent')
+        await self._complete(row.id)
+
+    async def _complete(self, outbox_id: int):
+        """Отмечает уведомление отправленным; при ошибке БД запоминает его, чтобы не слать повторно"""
+        try:
+            await AsyncDatabaseService.complete_notification(outbox_id)
+            self._delivered.discard(outbox_id)
+        except Exception as e:
+            self._delivered.add(outbox_id)
+            logging.error(f"Outbox: уведомление #{outbox_id} отправлено, но не отмечено: {e}")
+
+    async def _complete_delivered(self):
+        for outbox_id in list(self._delivered):
+            await self._complete(outbox_id)
+
+    async def close(self, timeout: float = 10):
+        """Останавливает воркер, дожидаясь текущей пачки"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            # Незавершенные записи вернутся в работу после истечения аренды
+            self._task.cancel()
+        self._task = None
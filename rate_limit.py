@@ -0,0 +1,82 @@
+import asyncio
+import os
+import time
+
+class TokenBucket:
+    """Корзина токенов: в среднем ``rate`` операций в секунду, до ``capacity`` подряд.
+
+    acquire() ждет токен (ожидающие обслуживаются по очереди), try_acquire()
+    берет его только если он есть прямо сейчас. pause() опустошает корзину и
+    запрещает выдачу на заданное время - так выдерживается RetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = now
+
+class SendRateLimiter:
+    """Лимиты Telegram на отправку сообщений.
+
+    Общий лимит бота (~30 сообщений в секунду) - корзина токенов с rate
+    TELEGRAM_GLOBAL_RATE (по умолчанию 25, с запасом). В один чат - не чаще
+    раза в секунду для личных чатов и раза в 3 секунды для групп (20 в минуту).
+    """
+
+    def __init__(self, rate: float = None, private_interval: float = 1.0, group_interval: float = 3.0):
+        # Без запаса на всплеск: в любом окне в секунду - не больше rate сообщений
+        self.bucket = TokenBucket(rate or float(os.getenv('TELEGRAM_GLOBAL_RATE', '25')), capacity=1)
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self._next_send = {}  # chat_id -> момент, раньше которого в чат писать нельзя
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        if len(self._next_send) > 10000:
+            self._next_send = {key: value for key, value in self._next_send.items() if value > now}
+        interval = self.group_interval if chat_id < 0 else self.private_interval
+        ready = self._next_send.get(chat_id, 0.0)
+        self._next_send[chat_id] = max(now, ready) + interval
+        if ready > now:
+            await asyncio.sleep(ready - now)
+        await self.bucket.acquire()
+
+    def pause(self, seconds: float):
+        """Останавливает все отправки на seconds (ответ RetryAfter от Telegram)"""
+        self.bucket.pause(seconds)
@@ -0,0 +1,95 @@
+import logging
+import os
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest
+
+class RenderCache:
+    """LRU отпечатков последнего содержимого сообщений, которые редактирует бот.
+
+    По (chat_id, message_id) хранит хэш текста, клавиатуры и parse_mode,
+    с которыми сообщение было отрисовано последним. Повторное нажатие на
+    кнопку текущего экрана не вызывает edit_text: Telegram все равно ответил
+    бы «message is not modified», потратив запрос к API. Хендлеру остается
+    только callback.answer().
+
+    Кэш живет в памяти процесса, поэтому пропуск безопасен, только если
+    последняя отрисовка - наша: вместе с отпечатком хранятся текст и
+    edit_date, которые вернул Telegram, и они сверяются с сообщением из
+    callback (его состояние на момент нажатия). Если сообщение с тех пор
+    отредактировал другой воркер, или в этом процессе еще идет отрисовка
+    того же сообщения (нажатия завершаются не по порядку), edit_text
+    выполняется.
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size or int(os.getenv('RENDER_CACHE_SIZE', '10000'))
+        self._entries = OrderedDict()  # (chat_id, message_id) -> (отпечаток, текст, edit_date)
+        self._rendering = {}  # (chat_id, message_id) -> число идущих отрисовок
+        self._overlapped = set()  # отрисовки шли одновременно: итог неизвестен
+        self.skipped = 0
+
+    @staticmethod
+    def fingerprint(text: str, markup=None, parse_mode: str = None) -> int:
+        """Отпечаток экрана; для готовых экранов считается один раз (см. build_screens)"""
+        markup_json = markup.model_dump_json(exclude_none=True) if markup is not None else None
+        return hash((text, markup_json, parse_mode))
+
+    def remember(self, chat_id: int, message_id: int, fingerprint: int, text: str = None, edit_date=None):
+        key = (chat_id, message_id)
+        self._entries[key] = (fingerprint, text, edit_date)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def forget(self, chat_id: int, message_id: int):
+        """Сбрасывает отпечаток (сообщение изменено в обход кэша)"""
+        self._entries.pop((chat_id, message_id), None)
+
+    def _is_current(self, key: tuple, message, fingerprint: int) -> bool:
+        """Сообщение уже отрисовано этим процессом с тем же отпечатком"""
+        if key in self._rendering:
+            return False
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != fingerprint:
+            return False
+        return entry[1:] == (getattr(message, 'text', None), getattr(message, 'edit_date', None))
+
+    async def edit(self, message, text: str, markup=None, parse_mode: str = None, fingerprint: int = None) -> bool:
+        """edit_text, если содержимое изменилось. True - сообщение отредактировано"""
+        key = (message.chat.id, message.message_id)
+        if fingerprint is None:
+            fingerprint = self.fingerprint(text, markup, parse_mode)
+        if self._is_current(key, message, fingerprint):
+            self._entries.move_to_end(key)
+            self.skipped += 1
+            return False
+
+        if key in self._rendering:
+            self._overlapped.add(key)
+        self._rendering[key] = self._rendering.get(key, 0) + 1
+        self.forget(*key)
+        edited = True
+        try:
+            result = await message.edit_text(text, reply_markup=markup, parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            # Сообщение уже такое (кэш пуст после перезапуска или вытеснен)
+            if 'message is not modified' not in str(e):
+                raise
+            logging.debug(f"Сообщение {key} не изменилось")
+            result, edited = message, False
+        finally:
+            self._rendering[key] -= 1
+            last = not self._rendering[key]
+            if last:
+                del self._rendering[key]
+            # Какая из одновременных отрисовок применилась последней - неизвестно
+            certain = last and key not in self._overlapped
+            if last:
+                self._overlapped.discard(key)
+        if certain and result is not True:
+            self.remember(*key, fingerprint, getattr(result, 'text', None), getattr(result, 'edit_date', None))
+        return edited
+
+    def __len__(self):
+        return len(self._entries)
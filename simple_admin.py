@@ -10,12 +10,16 @@ import json
 try:
     from flask import Flask, request, jsonify
     from database_service import DatabaseService
+    from applications_api import applications_api
+    from instrumentation import instrument_flask
 except ImportError as e:
     print(f"Ошибка импорта: {e}")
     print("Убедитесь, что установлены зависимости: pip install flask sqlalchemy psycopg2-binary")
     exit(1)
 
 app = Flask(__name__)
+app.register_blueprint(applications_api)
+instrument_flask(app)
 
 @app.route('/')
 def home():
@@ -201,32 +205,6 @@ def home():
     except Exception as e:
         return f"<h1>❌ Ошибка</h1><p>{str(e)}</p>"
 
-@app.route('/api/applications')
-def api_applications():
-    """API для получения заявок в JSON"""
-    try:
-        applications = DatabaseService.get_recent_applications(limit=10)
-        result = []
-        
-        for app in applications:
-            result.append({
-                'id': app.id,
-                'name': app.name,
-                'phone': app.phone,
-                'package_interest': app.package_interest,
-                'user_id': app.user_id,
-                'created_at': app.created_at.isoformat(),
-                'status': app.status
-            })
-        
-        return jsonify({
-            'total': DatabaseService.get_applications_count(),
-            'applications': result
-        })
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
 @app.route('/health')
 def health():
     """Проверка работоспособности"""
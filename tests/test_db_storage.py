@@ -0,0 +1,149 @@
+"""
+FSM-хранилище DatabaseStorage на SQLite вместо PostgreSQL.
+
+Два экземпляра хранилища над одной базой изображают два воркера бота.
+"""
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'fsm_test.db')
+
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import update
+
+import models
+from async_database_service import AsyncDatabaseService
+from db_storage import DatabaseStorage
+from models import DialogState, SessionLocal
+
+TELEGRAM_ID = 1001
+
+def key(telegram_id: int = TELEGRAM_ID) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=telegram_id, user_id=telegram_id)
+
+@pytest.fixture(scope='module', autouse=True)
+def database():
+    models.create_tables()
+    yield
+    asyncio.run(models.dispose_engines())
+
+@pytest.fixture(autouse=True)
+def clean_states():
+    db = SessionLocal()
+    db.query(DialogState).delete()
+    db.commit()
+    db.close()
+
+def run(coro):
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await models.dispose_engines()
+    return asyncio.run(wrapper())
+
+def test_round_trip_and_other_worker_sees_changes():
+    async def scenario():
+        worker_a, worker_b = DatabaseStorage(), DatabaseStorage()
+        await worker_a.set_state(key(), 'ContactForm:waiting_for_name')
+        await worker_a.update_data(key(), {'package': 'business'})
+
+        assert await worker_a.get_state(key()) == 'ContactForm:waiting_for_name'
+        assert await worker_a.get_data(key()) == {'package': 'business'}
+        # Следующий апдейт попал на другой воркер - состояние уже в БД
+        assert await worker_b.get_state(key()) == 'ContactForm:waiting_for_name'
+        assert await worker_b.get_data(key()) == {'package': 'business'}
+
+    run(scenario())
+
+def test_update_data_does_not_overwrite_newer_row():
+    async def scenario():
+        worker_a, worker_b = DatabaseStorage(), DatabaseStorage()
+        await worker_a.update_data(key(), {'package': 'start'})
+        await worker_b.update_data(key(), {'name': 'Иван'})
+        await worker_a.update_data(key(), {'phone': '+79990000000'})
+
+        expected = {'package': 'start', 'name': 'Иван', 'phone': '+79990000000'}
+        assert await worker_b.get_data(key()) == expected
+        row = await AsyncDatabaseService.load_dialog_state(TELEGRAM_ID)
+        assert row[1] == expected
+
+    run(scenario())
+
+def test_clear_removes_row():
+    async def scenario():
+        storage = DatabaseStorage()
+        await storage.set_state(key(), 'ContactForm:waiting_for_phone')
+        await storage.update_data(key(), {'name': 'Иван'})
+        await storage.set_state(key(), None)
+        await storage.set_data(key(), {})
+
+        assert await AsyncDatabaseService.load_dialog_state(TELEGRAM_ID) is None
+        assert await DatabaseStorage().get_state(key()) is None
+
+    run(scenario())
+
+def test_expired_state_is_ignored():
+    async def scenario():
+        storage = DatabaseStorage(state_ttl=3600)
+        await storage.set_state(key(), 'ContactForm:waiting_for_name')
+        await storage.update_data(key(), {'name': 'Иван'})
+
+        db = SessionLocal()
+        db.execute(update(DialogState).values(updated_at=datetime.utcnow() - timedelta(hours=2)))
+        db.commit()
+        db.close()
+
+        fresh = DatabaseStorage(state_ttl=3600)
+        assert await fresh.get_state(key()) is None
+        assert await fresh.get_data(key()) == {}
+
+    run(scenario())
+
+def test_failed_write_is_flushed_on_close(monkeypatch):
+    async def scenario():
+        storage = DatabaseStorage(flush_interval_ms=10_000)
+        storage.start()
+        save = AsyncDatabaseService.save_dialog_states
+
+        async def broken(states):
+            raise RuntimeError('db is down')
+
+        monkeypatch.setattr(AsyncDatabaseService, 'save_dialog_states', broken)
+        await storage.set_state(key(), 'ContactForm:waiting_for_phone')
+        assert storage.pending_writes() == 1
+        # Свои изменения видны, пока запись не удалась
+        assert await storage.get_state(key()) == 'ContactForm:waiting_for_phone'
+
+        monkeypatch.setattr(AsyncDatabaseService, 'save_dialog_states', save)
+        await storage.close()
+        assert storage.pending_writes() == 0
+        assert await DatabaseStorage().get_state(key()) == 'ContactForm:waiting_for_phone'
+
+    run(scenario())
+
+def test_cancelled_flush_keeps_states_dirty(monkeypatch):
+    async def scenario():
+        storage = DatabaseStorage()
+        started = asyncio.Event()
+
+        async def slow(states):
+            started.set()
+            await asyncio.sleep(10)
+
+        await storage.set_state(key(), 'ContactForm:waiting_for_name')
+        storage._dirty.add(TELEGRAM_ID)
+        monkeypatch.setattr(AsyncDatabaseService, 'save_dialog_states', slow)
+        task = asyncio.create_task(storage.flush())
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert storage.pending_writes() == 1
+
+    run(scenario())
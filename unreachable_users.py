@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from async_database_service import AsyncDatabaseService
+
+class UnreachableUsers(BaseRequestMiddleware):
+    """Отключает пользователей, до которых бот больше не может достучаться.
+
+    Мидлварь сессии Bot API: любой вызов в личный чат (рассылки, ответы
+    хендлеров, сообщения админов), завершившийся Forbidden (бот заблокирован,
+    аккаунт удален) или «chat not found», ставит пользователя в очередь на
+    is_active = False. Очередь сбрасывается одним UPDATE ... WHERE telegram_id
+    IN (...) раз в ``flush_interval`` секунд. Если пользователь снова напишет
+    боту (seen), он снимается с очереди, а если его пачка уже записывается -
+    включается обратно сразу после нее.
+    """
+
+    def __init__(self, user_cache=None, flush_interval: float = None, batch_size: int = 500):
+        self.user_cache = user_cache
+        self.flush_interval = flush_interval or float(os.getenv('UNREACHABLE_FLUSH_INTERVAL', '10'))
+        self.batch_size = batch_size
+        self._pending = set()
+        self._flushing = set()  # пачка, которая сейчас записывается
+        self._revived = set()  # написали боту, пока их пачка записывалась
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    async def __call__(self, make_request, bot, method):
+        try:
+            return await make_request(bot, method)
+        except TelegramForbiddenError:
+            self.mark(getattr(method, 'chat_id', None))
+            raise
+        except TelegramBadRequest as e:
+            if 'chat not found' in str(e).lower():
+                self.mark(getattr(method, 'chat_id', None))
+            raise
+
+    def mark(self, chat_id):
+        """Ставит пользователя в очередь на отключение (только личные чаты)"""
+        if not isinstance(chat_id, int) or chat_id <= 0:
+            return
+        self._pending.add(chat_id)
+        if self.user_cache is not None:
+            # Следующее сообщение от пользователя пройдет через БД и включит его обратно
+            self.user_cache.forget(chat_id)
+
+    def seen(self, telegram_id: int):
+        """Пользователь снова написал боту - он доступен, отключать его не нужно"""
+        self._pending.discard(telegram_id)
+        if telegram_id in self._flushing:
+            self._revived.add(telegram_id)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Запускает периодический сброс очереди"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self._stopping:
+                await self.flush()
+
+    async def flush(self) -> int:
+        """Отключает накопленных пользователей пачками, возвращает их число"""
+        deactivated = 0
+        while self._pending:
+            batch = [self._pending.pop() for _ in range(min(self.batch_size, len(self._pending)))]
+            self._flushing = set(batch)
+            saved = False
+            try:
+                deactivated += await AsyncDatabaseService.set_users_active(batch, False)
+                saved = True
+            except Exception as e:
+                logging.error(f"Ошибка при отключении недоступных пользователей ({len(batch)}): {e}")
+            finally:
+                self._flushing = set()
+                if not saved:
+                    # Ошибка или отмена: вернем в очередь всех, кто не написал боту за это время
+                    self._pending.update(set(batch) - self._revived)
+            if not saved:
+                break
+        if deactivated:
+            logging.info(f"🚫 Отключено недоступных пользователей: {deactivated}")
+        await self._reactivate()
+        return deactivated
+
+    async def _reactivate(self):
+        """Включает обратно тех, кто написал боту, пока их пачка отключалась"""
+        if not self._revived:
+            return
+        revived = list(self._revived)
+        self._revived.clear()
+        try:
+            await AsyncDatabaseService.set_users_active(revived, True)
+        except Exception as e:
+            logging.error(f"Ошибка при включении пользователей ({len(revived)}): {e}")
+            if self.user_cache is not None:
+                # Следующее сообщение пройдет через регистрацию и включит их
+                for telegram_id in revived:
+                    self.user_cache.forget(telegram_id)
+
+    async def close(self):
+        """Останавливает фоновую задачу и сбрасывает остаток очереди"""
+        if self._task is not None:
+            # Без cancel(): текущий UPDATE должен завершиться
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
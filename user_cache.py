@@ -0,0 +1,48 @@
+import os
+import time
+from collections import OrderedDict
+
+class UserCache:
+    """LRU/TTL кэш зарегистрированных пользователей.
+
+    Хранит по telegram_id "отпечаток" (username, first_name, last_name), который
+    последним был записан в БД. Если отпечаток не изменился и запись не устарела,
+    обращение к БД не нужно.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size or int(os.getenv('USER_CACHE_SIZE', '10000'))
+        self.ttl = ttl if ttl is not None else float(os.getenv('USER_CACHE_TTL', '3600'))
+        self._entries = OrderedDict()  # telegram_id -> (fingerprint, expires_at)
+
+    @staticmethod
+    def fingerprint(username: str = None, first_name: str = None, last_name: str = None) -> tuple:
+        return (username, first_name, last_name)
+
+    def is_fresh(self, telegram_id: int, fingerprint: tuple) -> bool:
+        """Проверяет, что пользователь уже записан в БД с такими же данными"""
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            return False
+        cached_fingerprint, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[telegram_id]
+            return False
+        if cached_fingerprint != fingerprint:
+            return False
+        self._entries.move_to_end(telegram_id)
+        return True
+
+    def remember(self, telegram_id: int, fingerprint: tuple):
+        """Запоминает данные, только что записанные в БД"""
+        self._entries[telegram_id] = (fingerprint, time.monotonic() + self.ttl)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def forget(self, telegram_id: int):
+        """Удаляет пользователя из кэша (следующее обновление пойдет в БД)"""
+        self._entries.pop(telegram_id, None)
+
+    def __len__(self):
+        return len(self._entries)
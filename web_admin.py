@@ -7,9 +7,11 @@
 import os
 from flask import Flask, render_template_string, request
 from database_service import DatabaseService
+from instrumentation import instrument_flask
 from datetime import datetime
 
 app = Flask(__name__)
+instrument_flask(app)
 
 # Простая аутентификация (в production используйте более надежную)
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
@@ -144,23 +146,17 @@ def admin_panel():
         return render_template_string(HTML_TEMPLATE, authenticated=False)
     
     try:
-        # Получаем статистику
+        # Получаем последние заявки и статистику (агрегаты считаются в БД)
         applications = DatabaseService.get_recent_applications(limit=20)
-        total_applications = DatabaseService.get_applications_count()
-        
-        # Подсчитываем новые заявки
-        new_applications = sum(1 for app in applications if app.status == 'new')
-        
-        # Подсчитываем пользователей (приблизительно)
-        total_users = len(set(app.user_id for app in applications))
+        stats = DatabaseService.get_summary_stats()
         
         return render_template_string(
             HTML_TEMPLATE,
             authenticated=True,
             applications=applications,
-            total_applications=total_applications,
-            new_applications=new_applications,
-            total_users=total_users,
+            total_applications=stats['total_applications'],
+            new_applications=stats['new_applications'],
+            total_users=stats['total_users'],
             current_time=datetime.now().strftime('%d.%m.%Y %H:%M:%S')
         )
         
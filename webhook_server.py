@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from bot_instrumentation import metrics_handler
+from instrumentation import QUEUE_DEPTH
+
+# Настройки webhook-режима
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')  # Публичный https-адрес (например, за nginx)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', '8080'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '50'))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', '30'))
+WEBHOOK_SET_ON_STARTUP = os.getenv('WEBHOOK_SET_ON_STARTUP', 'true').lower() == 'true'
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обработчик webhook с ограничением числа одновременно обрабатываемых апдейтов.
+
+    Апдейт обрабатывается до ответа на запрос Telegram (handle_in_background
+    выключен), а обработка ограничена семафором в публичном handle(). Пока все
+    слоты заняты, ответ Telegram задерживается, и он сам снижает темп
+    доставки - это и есть backpressure. Запросы в обработке учитываются в
+    собственном множестве задач: по нему считается глубина очереди и ждется
+    их завершение при остановке.
+    """
+
+    def __init__(self, *args, concurrency: int = UPDATE_CONCURRENCY, **kwargs):
+        kwargs.setdefault('handle_in_background', False)
+        super().__init__(*args, **kwargs)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight = set()
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        task = asyncio.current_task()
+        self._in_flight.add(task)
+        try:
+            async with self._semaphore:
+                return await super().handle(request)
+        finally:
+            self._in_flight.discard(task)
+
+    __call__ = handle
+
+    async def drain(self, timeout: float = WEBHOOK_SHUTDOWN_TIMEOUT) -> int:
+        """Ждет обработки принятых апдейтов, возвращает число незавершенных"""
+        if not self._in_flight:
+            return 0
+        logging.info(f"Ожидание обработки апдейтов: {len(self._in_flight)}")
+        _, pending = await asyncio.wait(set(self._in_flight), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"⚠️ Не дождались обработки апдейтов: {len(pending)}")
+            await asyncio.wait(pending)
+        return len(pending)
+
+async def health(request: web.Request) -> web.Response:
+    """Проверка работоспособности"""
+    return web.json_response({'status': 'ok', 'service': 'bot-webhook'})
+
+def build_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """Создает aiohttp-приложение, принимающее апдейты от Telegram"""
+    app = web.Application()
+    handler = BoundedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        concurrency=UPDATE_CONCURRENCY
+    )
+    handler.register(app, path=WEBHOOK_PATH)
+    app['webhook_handler'] = handler
+    QUEUE_DEPTH.set_function(lambda: len(handler), queue='webhook_updates')
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics_handler)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Запускает бота в режиме webhook до получения SIGTERM/SIGINT"""
+    if not WEBHOOK_SECRET:
+        # Без секрета SimpleRequestHandler принимает любой POST - апдейты можно подделать
+        raise ValueError("WEBHOOK_SECRET не найден в переменных окружения")
+    if WEBHOOK_SET_ON_STARTUP:
+        if not WEBHOOK_BASE_URL:
+            raise ValueError("WEBHOOK_BASE_URL не найден в переменных окружения")
+        webhook_url = WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH
+        await bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        print(f"✅ Webhook установлен: {webhook_url}")
+
+    app = build_webhook_app(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    await site.start()
+    print(f"🌐 Webhook-сервер слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH} "
+          f"(до {UPDATE_CONCURRENCY} апдейтов параллельно)")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    try:
+        await stop_event.wait()
+    finally:
+        logging.info("Остановка webhook-сервера")
+        # Сначала перестаем принимать апдейты и дорабатываем принятые: on_shutdown
+        # и finally в main() закроют сессию бота и движки БД
+        await site.stop()
+        await app['webhook_handler'].drain()
+        await runner.cleanup()